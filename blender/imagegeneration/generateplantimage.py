@@ -39,13 +39,8 @@ def generatePlantImages(genomes):
                      ])
 
 def createGenomesArgument(genomes):
-    s = "--"
-    for genome in genomes:
-        s += " " + genome
-    return s
+    return " ".join(["--"] + list(genomes))
 
 def saveGenomesToFile(genomes):
-    f =  open(GENOMES_TO_RENDER_FILE, 'w')
-    for genome in genomes:
-        f.write(genome+"\n")
-    f.close()
+    with open(GENOMES_TO_RENDER_FILE, 'w') as f:
+        f.write("".join([genome+"\n" for genome in genomes]))
@@ -18,6 +18,7 @@ class OBJECT_OT_AbstractEvoIntChooser(OBJECT_OT_AbstractOperatorLSystem):
         evolver = GeneticEvolver(self.tree_creator.turtle)
         evolver.discardEmptyEvolutions = True
         evolver.setGenerator(self.generator)
+        evolver.derivationBudget = self.createDerivationBudget()
 
         # We disable the standard render
         self.tree_creator.renderCurrentLSystemAtExecution = False
@@ -1,25 +1,34 @@
 import procedural.plantsincrementalgenerator
 #import procedural.incrementalgenerator
 import blender.utilities
+import grammar.parametric.derivationbudget
 
 import imp
 imp.reload(procedural.plantsincrementalgenerator)
 #imp.reload(procedural.incrementalgenerator)
 imp.reload(blender.utilities)
+imp.reload(grammar.parametric.derivationbudget)
 
 from procedural.plantsincrementalgenerator import PlantsIncrementalGenerator
 #from procedural.incrementalgenerator import IncrementalGenerator
 from blender.utilities import *
+from grammar.parametric.derivationbudget import DerivationBudget
 
 import bpy
 
 class OBJECT_OT_AbstractOperatorLSystem(bpy.types.Operator):
+    # Limits for the derivations performed while evolving, so that a single explosive lsystem cannot stall Blender
+    MAX_DERIVED_MODULES = 100000
+    DERIVATION_TIMEOUT = 10
 
     def execute(self, context):
         self.tree_creator = bpy.types.Scene.tree_creator
         self.current_genetic_instance = bpy.types.Scene.current_genetic_instance
         return {'FINISHED'}
 
+    def createDerivationBudget(self):
+        return DerivationBudget(maxModules = self.MAX_DERIVED_MODULES, timeout = self.DERIVATION_TIMEOUT)
+
     def createGenerator(self):
         # Parameters that are not saved in the genetic instance (common for all instances)
         parameterized = getattr(self.tree_creator,'parameterized')
@@ -24,6 +24,7 @@ class OBJECT_OT_EvolveInteractivelyLSystem(OBJECT_OT_AbstractOperatorLSystem):
         evolver = GeneticEvolver(self.tree_creator.turtle)
         evolver.discardEmptyEvolutions = True
         evolver.setGenerator(self.generator)
+        evolver.derivationBudget = self.createDerivationBudget()
 
         # We remove the standard render
         self.tree_creator.renderCurrentLSystemAtExecution = False
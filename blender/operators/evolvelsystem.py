@@ -23,6 +23,7 @@ class OBJECT_OT_EvolveLSystem(OBJECT_OT_AbstractOperatorLSystem):
         evolver = GeneticEvolver(self.tree_creator.turtle)
         evolver.discardEmptyEvolutions = False
         evolver.setGenerator(self.generator)
+        evolver.derivationBudget = self.createDerivationBudget()
 
         if self.tree_creator.evo_startFromCurrentInstance: evolver.setStartingInstance(self.current_genetic_instance)
         else: evolver.removeStartingInstance()
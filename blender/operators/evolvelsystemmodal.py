@@ -48,6 +48,7 @@ class OBJECT_OT_EvolveLSystemModal(OBJECT_OT_AbstractOperatorLSystem):
         self.evolver = GeneticEvolver(self.tree_creator.turtle)
         self.evolver.discardEmptyEvolutions = False
         self.evolver.setGenerator(self.generator)
+        self.evolver.derivationBudget = self.createDerivationBudget()
 
         if self.tree_creator.evo_startFromCurrentInstance: self.evolver.setStartingInstance(self.current_genetic_instance)
         else: self.evolver.removeStartingInstance()
@@ -84,7 +85,7 @@ class OBJECT_OT_EvolveLSystemModal(OBJECT_OT_AbstractOperatorLSystem):
                 or (self.DRAW_WITH_FITNESS_PERIOD and reached_target_fitness) \
                 or (not self.DRAW_WITH_GENERATION_PERIOD and not self.DRAW_WITH_FITNESS_PERIOD)
 
-        context.area.header_text_set("Generation " + str(self._count) + " fitness: " + str(self.evolver.getBestInstance().fitness) +  " best instance: " + str(self.current_genetic_instance.lsystem.getResultPString()))
+        context.area.header_text_set("Generation " + str(self._count) + " fitness: " + str(self.evolver.getBestInstance().fitness) +  " best instance: " + str(self.evolver.getResultPStringOf(self.current_genetic_instance.lsystem)))
 
         if willRender:
             context.scene.frame_current += 1
@@ -106,11 +107,13 @@ class OBJECT_OT_EvolveLSystemModal(OBJECT_OT_AbstractOperatorLSystem):
         if event.type == 'ESC':
             context.window_manager.event_timer_remove(self._timer)
             context.area.header_text_set("Cancelled")
+            self.evolver.close()
             return {'CANCELLED'}
 
         if event.type == "ENTER":
             context.window_manager.event_timer_remove(self._timer)
             context.area.header_text_set("Finished")
+            self.evolver.close()
             return{'RET'}
 
         if event.type == 'TIMER':
@@ -133,6 +133,9 @@ class OBJECT_OT_AddPlantForm(bpy.types.Operator):
         max=1)
 
     elasticity_from_radius = BoolProperty(name='elasticity / radius',default=False)
+    frame_turtle = BoolProperty(name='frame turtle',
+                        default=False,
+                        description="draws with a FrameTurtle, which turns a heading/left/up frame: same branching angles, but a different shape")
 
     # Mesh
     skin = BoolProperty(name='skin',
@@ -281,7 +284,7 @@ class OBJECT_OT_AddPlantForm(bpy.types.Operator):
         box.prop(self,'iterations')
 
         row = box.row(align=False)
-        row.label(text="Result: " +str(bpy.types.Scene.current_genetic_instance.lsystem.getResultPString()))
+        row.label(text="Result: " +str(bpy.types.Scene.current_genetic_instance.lsystem.getResultPString(self.renderManager.derivationBudget)))
 
         if getattr(self,'axiom')=='':
             box.alert=True
@@ -328,6 +331,7 @@ class OBJECT_OT_AddPlantForm(bpy.types.Operator):
         box.prop(self, 'tropism')
         box.prop(self, 'tropism_susceptibility')
         box.prop(self, 'elasticity_from_radius')
+        box.prop(self, 'frame_turtle')
 
     def drawRenderingGui(self,context):
         layout = self.layout
@@ -413,7 +417,7 @@ class OBJECT_OT_AddPlantForm(bpy.types.Operator):
         bpy.types.Scene.to_draw_instances = []
 
         # We define turtles and renderers at the first invocation
-        self.turtle = Turtle()
+        self.turtle = ArrayTurtle()     # Draws as a Turtle, and measures fitness without building the geometry
         self.turtleRenderer = TurtleRenderer()
         self.renderManager = PlantRenderManager()
 
@@ -440,12 +444,15 @@ class OBJECT_OT_AddPlantForm(bpy.types.Operator):
         instances = bpy.types.Scene.to_draw_instances
         if self.renderAtExecution:
             if self.showGrowth:
+                # The growth instances share their checkpoints, so each one is derived with a single step from the previous one
+                genetic_instance.lsystem.checkpoints = DerivationCheckpoints()
                 for i in range(self.iterations):
-                    genetic_instance.lsystem.targetIterations = i+1
-                    instances.append(genetic_isntance)
+                    growth_instance = GeneticInstance.copyFrom(genetic_instance)
+                    growth_instance.lsystem.setIterations(i+1)
+                    instances.append(growth_instance)
                     #instances.append(genetic_instance.lsystem.iterate(i+1))
             else:
-                genetic_instance.lsystem.iterations = self.iterations
+                genetic_instance.lsystem.setIterations(self.iterations)
                 instances.append(genetic_instance)
                 #pStrings.append(genetic_instance.lsystem.iterate(self.iterations))
         self.renderManager.renderGeneticInstances(context,self.turtle,self.turtleRenderer,instances)
@@ -479,6 +486,9 @@ class OBJECT_OT_AddPlantForm(bpy.types.Operator):
 
     # TODO: this is deprecated, since the contents of the turtle should already be in the genetic instance!
     def updateTurtle(self,context):
+        # The FrameTurtle composes rotations as rotations of its frame, instead of summing euler angles, so it draws a different shape
+        turtleClass = FrameTurtle if self.frame_turtle else ArrayTurtle
+        if type(self.turtle) is not turtleClass: self.turtle = turtleClass()
         t = self.turtle
 
         t.angle = self.angle
@@ -7,16 +7,22 @@ import bpy
 from mathutils import Vector
 
 import blender.utilities
+import grammar.parametric.derivationbudget
 import imp
 imp.reload(blender.utilities)
+imp.reload(grammar.parametric.derivationbudget)
 from blender.utilities import *
+from grammar.parametric.derivationbudget import DerivationBudget, BudgetExceededResult
 
 class PlantRenderManager:
     """
     Class that helps in rendering pL-systems in Blender
     """
     def __init__(self):
-        pass
+        # Lsystems whose derivation exceeds this budget are not rendered, so that a single explosive lsystem cannot stall Blender
+        self.derivationBudget = DerivationBudget(maxModules = 500000, timeout = 60)
+        # If not None, large deterministic derivations are rewritten in parallel by the workers of this ParallelRewriter (see close)
+        self.parallelRewriter = None
 
     def renderGeneticInstances(self, context, turtle, turtleRenderer, instances, overridenContext = None):
         """
@@ -43,8 +49,13 @@ class PlantRenderManager:
         for i in range(len(instances)):
             new_results = self.renderGeneticInstanceNTimes(context, turtle, turtleRenderer, instances[i], nInstances = nInstances, offset=offsets[i],suffix=suffixes[i],overridenContext = overridenContext)
             results.extend(new_results)
+        self.close()
         return results
 
+    def close(self):
+        """ Stops the worker processes of the parallel rewriter, if any. They are started again when needed. """
+        if self.parallelRewriter is not None: self.parallelRewriter.close()
+
     def renderGeneticInstanceNTimes(self, context, turtle, turtleRenderer, instance, nInstances = 1, renderResult = True, offset = (0,0,0), suffix = "", exportedStatisticsContainer = None, overridenContext = None):
         """
         Renders a single instance multiple times.
@@ -57,21 +68,32 @@ class PlantRenderManager:
         turtleRenderer.loadParameters(instance.turtleParameters)
         multipleInstances = nInstances > 1
 
+        # Stochastic lsystems render a different variant for each instance, derived together
+        structures = [None]*nInstances
+        if multipleInstances and instance.lsystem.isStochastic():
+            structures = instance.lsystem.iterateVariants(nInstances, budget = self.derivationBudget)
+
         # Render
         results = []
         for instance_index in range(nInstances):
-            result = self.renderGeneticInstance(context, turtle, turtleRenderer, instance, instance_index, multipleInstances, renderResult, offset, suffix, exportedStatisticsContainer, overridenContext)
-            results.append(result)
+            result = self.renderGeneticInstance(context, turtle, turtleRenderer, instance, instance_index, multipleInstances, renderResult, offset, suffix, exportedStatisticsContainer, overridenContext, structures[instance_index])
+            if result is not None: results.append(result)
         return results
 
-    def renderGeneticInstance(self, context, turtle, turtleRenderer, instance, instance_index, multipleInstances = False, renderResult = True, offset = (0,0,0), suffix = "", exportedStatisticsContainer = None, overridenContext = None):
+    def renderGeneticInstance(self, context, turtle, turtleRenderer, instance, instance_index, multipleInstances = False, renderResult = True, offset = (0,0,0), suffix = "", exportedStatisticsContainer = None, overridenContext = None, structure = None):
         """
         Renders a single genetic instance, once.
-        @return: A single TurtleResult
+        @param structure: Optional. The derived pString to render. Defaults to the result pString of the instance's lsystem.
+        @return: A single TurtleResult, or None if the derivation exceeded the budget
         """
-        structureString = str(instance.lsystem.getResultPString())
+        if structure is None:
+            if self.parallelRewriter is not None: instance.lsystem.parallelRewriter = self.parallelRewriter
+            structure = instance.lsystem.getResultPString(self.derivationBudget)
+        if isinstance(structure,BudgetExceededResult):
+            print("Cannot render instance " + str(instance_index) + ": " + str(structure))
+            return None
         #print("\n\nIT:" + str(instance.lsystem.niterations))
-        result = turtle.draw(structureString,instance_index,exportedStatisticsContainer)
+        result = turtle.draw(structure,instance_index,exportedStatisticsContainer)
         if renderResult:
             turtleRenderer.drawMesh(context, result, offset,suffix, multipleInstances = multipleInstances, overridenContext = overridenContext)
         return result
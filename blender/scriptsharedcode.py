@@ -9,6 +9,8 @@ import grammar.parametric.parametriclsystem
 import procedural.incrementalgenerator
 import procedural.geneticevolver
 import turtles.turtle
+import turtles.arrayturtle
+import turtles.frameturtle
 import blender.render.turtlerenderer
 import blender.render.plantrendermanager
 import blender.utilities
@@ -21,6 +23,8 @@ imp.reload(grammar.parametric.parametriclsystem)
 imp.reload(procedural.incrementalgenerator)
 imp.reload(procedural.geneticevolver)
 imp.reload(turtles.turtle)
+imp.reload(turtles.arrayturtle)
+imp.reload(turtles.frameturtle)
 imp.reload(blender.render.turtlerenderer)
 imp.reload(blender.render.plantrendermanager)
 imp.reload(blender.utilities)
@@ -31,6 +35,8 @@ from grammar.parametric.parametriclsystem import ParametricLSystem
 from procedural.incrementalgenerator import IncrementalGenerator
 from procedural.geneticevolver import GeneticEvolver
 from turtles.turtle import Turtle
+from turtles.arrayturtle import ArrayTurtle
+from turtles.frameturtle import FrameTurtle
 from blender.utilities import *
 from blender.render.turtlerenderer import TurtleRenderer
 from blender.render.plantrendermanager import PlantRenderManager
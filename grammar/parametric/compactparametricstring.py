@@ -0,0 +1,355 @@
+"""
+    @author: Michele Pirovano
+    @copyright: 2013-2015
+"""
+
+# This code needed for blender to load correctly updated source files
+import grammar.parametric.parametricmodule
+import grammar.parametric.parametricstring
+
+import imp
+imp.reload(grammar.parametric.parametricmodule)
+imp.reload(grammar.parametric.parametricstring)
+
+from grammar.parametric.parametricmodule import ParametricModule
+from grammar.parametric.parametricstring import ParametricString
+
+from array import array
+from collections import Counter
+
+OPEN_BRACKET = ord('[')
+CLOSE_BRACKET = ord(']')
+
+class CompactParametricString(ParametricString):
+    """
+    A 'valued' pL-system string stored in flat arrays instead of a list of ParametricModule.
+    Letters are kept in a byte array, all parameter values in a single array of doubles, and each module has an offset into the values.
+    This takes a fraction of the memory of a ParametricString, and it is used for derivation results.
+
+    Modules are created only when accessed (iterating, indexing), so changing them does not change the string.
+
+    @note: All parameters must be numbers.
+    """
+
+    def __init__(self):
+        self.letters = bytearray()          # One byte per module
+        self.values = array('d')            # The parameters of all modules, one after the other
+        self.offsets = array('L',[0])       # Module i has values[offsets[i]:offsets[i+1]]
+        self.globalDefines = None
+        self.cachedString = None
+        self.version = 0
+
+    @staticmethod
+    def fromTextString(textString):
+        ps = CompactParametricString()
+        ps.parseString(textString)
+        return ps
+
+    @staticmethod
+    def fromParametricString(other_pString):
+        """
+        Creates a compact copy of a ParametricString. Global defines are evaluated.
+        """
+        new_pString = CompactParametricString()
+        new_pString.setGlobals(other_pString.globalDefines)
+        for m in other_pString:
+            new_pString.appendModule(m)
+        return new_pString
+
+    def parseString(self,textString):
+        self.modulesList = self.stringToModulesList(textString)
+
+    def __str__(self):
+        if self.cachedString is None:
+            self.cachedString = self.modulesToString(0,len(self.letters))
+        return self.cachedString
+
+    def writeTo(self,fileLike):
+        """
+        Writes the string form of this pString to a file-like object, a chunk of modules at a time. See ParametricString.writeTo.
+        """
+        if self.cachedString is not None:
+            fileLike.write(self.cachedString)
+            return
+        nModules = len(self.letters)
+        for start in range(0,nModules,self.WRITE_CHUNK_MODULES):
+            fileLike.write(self.modulesToString(start,min(start+self.WRITE_CHUNK_MODULES,nModules)))
+
+    def modulesToString(self,start_index,end_index):
+        """ Returns the string form of the modules from start_index to end_index (excluded), without creating the modules. """
+        letters = self.letters[start_index:end_index].decode('latin-1')
+        values = self.values
+        offsets = self.offsets
+        s = []
+        for i in range(start_index,end_index):
+            s.append(letters[i-start_index])
+            start = offsets[i]
+            end = offsets[i+1]
+            if end > start:
+                s.append('(' + ','.join([str(v) for v in values[start:end]]) + ')')
+        return "".join(s)
+
+    ################
+    # Modules list
+    ################
+
+    @property
+    def modulesList(self):
+        """ A list of the modules of this pString. It is a copy. """
+        return [self.getModule(i) for i in range(len(self.letters))]
+
+    @modulesList.setter
+    def modulesList(self,modules):
+        self.cachedString = None
+        self.version += 1
+        self.letters = bytearray()
+        self.values = array('d')
+        self.offsets = array('L',[0])
+        for m in modules: self.appendModule(m)
+
+    def getModule(self,i):
+        return ParametricModule.fromValues(chr(self.letters[i]),self.values[self.offsets[i]:self.offsets[i+1]].tolist())
+
+    def getLetters(self):
+        """ Returns all the letters of this pString as a single str """
+        return self.letters.decode('latin-1')
+
+    ################
+    # Building
+    ################
+
+    def appendLetterAndValues(self,letter,values):
+        """
+        Appends a module, given its letter and its parameter values.
+        """
+        self.letters.append(ord(letter))
+        self.values.extend(values)
+        self.offsets.append(len(self.values))
+        self.cachedString = None
+        self.version += 1
+
+    def appendOpenBranch(self):
+        self.appendLetterAndValues('[',())
+
+    def appendCloseBranch(self):
+        self.appendLetterAndValues(']',())
+
+    def getModuleValues(self,m):
+        """ The parameter values of a module, as stored in this pString """
+        values = []
+        for p in m.params:
+            if self.globalDefines is not None and p in self.globalDefines: p = self.globalDefines[p]    # Uses global defines, if available
+            try:
+                values.append(float(p))
+            except ValueError:
+                raise Exception("A compact pString can only hold numeric parameters! Got: " + str(m))
+        return values
+
+    def appendModule(self,m):
+        self.appendLetterAndValues(m.letter,self.getModuleValues(m))
+
+    def insertModule(self,index,m):
+        """
+        Inserts a module before the given index, as list.insert does.
+        """
+        values = self.getModuleValues(m)
+        index, end_index, step = slice(index,None).indices(len(self.letters))
+        self.cachedString = None
+        self.version += 1
+        start_value = self.offsets[index]
+        self.letters.insert(index,ord(m.letter))
+        self.values[start_value:start_value] = array('d',values)
+        self.offsets = self.offsets[:index+1] + array('L',[o+len(values) for o in self.offsets[index:]])
+
+    def removeModulesFromTo(self,start_index,end_index):
+        start_index, end_index, step = slice(start_index,end_index).indices(len(self.letters))
+        if end_index <= start_index: return
+        self.cachedString = None
+        self.version += 1
+        start_value = self.offsets[start_index]
+        end_value = self.offsets[end_index]
+        del self.letters[start_index:end_index]
+        del self.values[start_value:end_value]
+        removed_values = end_value - start_value
+        self.offsets = self.offsets[:start_index+1] + array('L',[o-removed_values for o in self.offsets[end_index+1:]])
+
+    def evaluateDefines(self):
+        """ Values are always numeric, so there is nothing to evaluate. """
+        pass
+
+    def setParameterToModulesOfLetter(self,letter,param_value):
+        self.cachedString = None
+        self.version += 1
+        code = ord(letter)
+        value = float(param_value)
+        for i in range(len(self.letters)):
+            if self.letters[i] == code:
+                for j in range(self.offsets[i],self.offsets[i+1]): self.values[j] = value
+
+    ################
+    # Utilities
+    ################
+
+    def __iter__(self):
+        letters = self.getLetters()
+        values = self.values
+        offsets = self.offsets
+        for i in range(len(letters)):
+            yield ParametricModule.fromValues(letters[i],values[offsets[i]:offsets[i+1]].tolist())
+
+    def __getitem__(self, key):
+        if isinstance(key,slice):
+            return [self.getModule(i) for i in range(*key.indices(len(self.letters)))]
+        if key < 0: key += len(self.letters)
+        if key < 0 or key >= len(self.letters): raise IndexError("CompactParametricString index out of range")
+        return self.getModule(key)
+
+    def __len__(self):
+        return len(self.letters)
+
+    def index(self,m):
+        """ Index of the first module with the same letter and parameters """
+        for i in range(len(self.letters)):
+            if self.letters[i] == ord(m.letter) and self.values[self.offsets[i]:self.offsets[i+1]].tolist() == m.params:
+                return i
+        raise ValueError(str(m) + " is not in the pString")
+
+    def getLetterCounts(self):
+        """
+        @return: The number of modules of each letter in this pString (brackets included). Counted at each call.
+        @rtype: dict
+        """
+        return Counter(self.getLetters())
+
+    def getMatchingBracketIndex(self,i):
+        """
+        @return: The index of the bracket matching the bracket at index I, or None if it is not matched
+        @rtype: int
+        """
+        letters = self.letters
+        if i < 0 or i >= len(letters) or letters[i] not in (OPEN_BRACKET,CLOSE_BRACKET): return None
+        # Scan towards the matching bracket, forwards from '[' and backwards from ']'
+        step, opening = (1,OPEN_BRACKET) if letters[i] == OPEN_BRACKET else (-1,CLOSE_BRACKET)
+        end = len(letters) if step == 1 else -1
+        depth = 0
+        for j in range(i,end,step):
+            c = letters[j]
+            if c == opening: depth += 1
+            elif c == OPEN_BRACKET or c == CLOSE_BRACKET:
+                depth -= 1
+                if depth == 0: return j
+        return None
+
+    def containsLetter(self,letter):
+        if letter in ('[',']'): return False
+        return self.letters.find(letter.encode('latin-1')) >= 0
+
+    def containsLetterAtLeastCount(self,letter,count):
+        if letter in ('[',']'): return count <= 0
+        return self.countLetter(letter) >= count
+
+    def countLetter(self,letter):
+        """ The number of modules with the given letter """
+        return self.letters.count(ord(letter))
+
+    def hasBranches(self):
+        return self.countLetter('[') > 0 or self.countLetter(']') > 0
+
+    def lengthWithoutBrackets(self):
+        return len(self.letters) - self.countLetter('[') - self.countLetter(']')
+
+    def bracketsAreBalanced(self):
+        return self.countLetter('[') == self.countLetter(']')
+
+    def getActualModules(self):
+        letters = self.getLetters()
+        return [self.getModule(i) for i in range(len(letters)) if letters[i] not in ('[',']')]
+
+    def getFirstModuleOfLetter(self,letter):
+        if letter in ('[',']'): return None
+        i = self.letters.find(letter.encode('latin-1'))
+        if i < 0: return None
+        return self.getModule(i)
+
+    @staticmethod
+    def copyFrom(other_pString):
+        """
+        Copies a CompactParametricString and returns the copy.
+        """
+        new_pString = CompactParametricString()
+        new_pString.setGlobals(other_pString.globalDefines)
+        new_pString.letters = bytearray(other_pString.letters)
+        new_pString.values = array('d',other_pString.values)
+        new_pString.offsets = array('L',other_pString.offsets)
+        return new_pString
+
+
+if __name__ == "__main__":
+    print("Start testing CompactParametricString")
+
+    print("\nCreation")
+    ps = CompactParametricString.fromTextString("FF[F(1.5)]A(1,2)EEE")
+    print(ps)
+
+    print("\nAppend module with global parameter")
+    ps.setGlobals({"p":2.6})
+    ps.appendModule(ParametricModule("C",["p"]))
+    print(ps)
+
+    print("\nIndexing and iteration")
+    print(str(ps[3]) + " " + str(ps[-1]) + " " + " ".join([str(m) for m in ps]))
+
+    print("\nActual modules: " + " ".join([str(m) for m in ps.getActualModules()]))
+    print("Length without brackets: " + str(ps.lengthWithoutBrackets()))
+    print("Has branches? " + str(ps.hasBranches()))
+    print("Is balanced? " + str(ps.bracketsAreBalanced()))
+
+    print("\nRemove modules 2 to 5")
+    ps.removeModulesFromTo(2,5)
+    print(ps)
+
+    print("\nCopy")
+    print(CompactParametricString.copyFrom(ps))
+
+    print("\nInsert and replace modules, same as a ParametricString")
+    ps = CompactParametricString.fromTextString("F[+F(2)]F")
+    objectPs = ParametricString.fromTextString("F[+F(2)]F")
+    for pString in [ps, objectPs]:
+        pString.insertModule(2,ParametricModule("A",[1.5]))
+        pString.replaceModuleAt(4,ParametricModule("B",[3]))
+    print(str(ps) + " " + str(str(ps) == str(objectPs)))
+
+    print("\nQueries, same as a ParametricString")
+    for name, query in [("letter counts", lambda pString: sorted(pString.getLetterCounts().items())),
+                        ("matching brackets", lambda pString: [pString.getMatchingBracketIndex(i) for i in range(len(pString))]),
+                        ("contains '['", lambda pString: pString.containsLetter('[')),
+                        ("contains 1 ']'", lambda pString: pString.containsLetterAtLeastCount(']',1))]:
+        print(name + ": " + str(query(ps)) + " " + str(query(ps) == query(objectPs)))
+
+    print("\nBenchmark against ParametricString")
+    import timeit
+    import tracemalloc
+    import grammar.parametric.parametriclsystem
+    imp.reload(grammar.parametric.parametriclsystem)
+    from grammar.parametric.parametriclsystem import ParametricLSystem
+
+    def derive(compact):
+        pl = ParametricLSystem()
+        pl.compactDerivation = compact
+        pl.setAxiomFromString("A(1)")
+        pl.addProductionFromString("A(x):*->!(x)F(x)[+(30)A(x*0.9)][-(30)A(x*0.8)]L(x)")
+        pl.addProductionFromString("F(x):*->F(x*1.1)")
+        pl.addProductionFromString("!(x):*->!(x*1.2)")
+        return pl.iterate(10)
+
+    for compact in [False, True]:
+        name = "compact" if compact else "object"
+        time = timeit.timeit(lambda: derive(compact), number=1)
+        tracemalloc.start()
+        ps = derive(compact)
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(name + ": " + str(len(ps)) + " modules in " + "{0:.2f}".format(time) + "s, "
+              + "{0:.1f}".format(size/1e6) + " MB held (" + "{0:.1f}".format(peak/1e6) + " MB peak)")
+
+    print("\nFinish testing CompactParametricString")
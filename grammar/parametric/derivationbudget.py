@@ -0,0 +1,150 @@
+"""
+    @author: Michele Pirovano
+    @copyright: 2013-2015
+"""
+
+import time
+
+class DerivationBudget:
+    """
+    Limits on a single derivation of a pL-system. See ParametricLSystem.iterate.
+    Any limit can be None, meaning no limit.
+    The same budget can be used for any number of derivations.
+    """
+    CHECK_INTERVAL = 4096       # Modules rewritten between two checks
+
+    # Rough memory used by a single module (with its parameters) in each pString representation
+    OBJECT_MODULE_BYTES = 128
+    COMPACT_MODULE_BYTES = 16
+
+    def __init__(self, maxModules = None, maxMemory = None, timeout = None):
+        """
+        @param maxModules: Maximum number of modules of a pString (at any step)
+        @type maxModules: int
+
+        @param maxMemory: Maximum memory (in bytes) used by a pString (at any step), estimated from the number of modules
+        @type maxMemory: int
+
+        @param timeout: Maximum duration (in seconds) of the derivation
+        @type timeout: float
+        """
+        self.maxModules = maxModules
+        self.maxMemory = maxMemory
+        self.timeout = timeout
+
+    def check(self, startTime, step, nModules, moduleBytes = OBJECT_MODULE_BYTES):
+        """
+        Checks the state of a derivation against this budget.
+
+        @param startTime: When the derivation started (from time.time())
+        @param step: The current step of the derivation
+        @param nModules: The number of modules derived so far at this step
+        @param moduleBytes: The memory used by a single module
+
+        @return: None if the derivation can go on, or the reason to stop it
+        @rtype: BudgetExceededResult
+        """
+        elapsed = time.time() - startTime
+        if self.maxModules is not None and nModules > self.maxModules:
+            return BudgetExceededResult(BudgetExceededResult.MODULES, step, nModules, elapsed)
+        if self.maxMemory is not None and nModules*moduleBytes > self.maxMemory:
+            return BudgetExceededResult(BudgetExceededResult.MEMORY, step, nModules, elapsed)
+        if self.timeout is not None and elapsed > self.timeout:
+            return BudgetExceededResult(BudgetExceededResult.TIME, step, nModules, elapsed)
+        return None
+
+    def isWithin(self, other):
+        """
+        Checks whether each limit of this budget is no larger than the same limit of another budget.
+        A derivation that exceeded the other budget would then exceed this one too.
+
+        @param other: The other budget, or None for no limits
+        @type other: DerivationBudget
+
+        @rtype: bool
+        """
+        if other is None: return True
+        for limit, otherLimit in ((self.maxModules, other.maxModules), (self.maxMemory, other.maxMemory), (self.timeout, other.timeout)):
+            if otherLimit is None: continue
+            if limit is None or limit > otherLimit: return False
+        return True
+
+    def __str__(self):
+        return "Budget: max modules " + str(self.maxModules) + " max memory " + str(self.maxMemory) + " timeout " + str(self.timeout)
+
+
+class BudgetExceededResult:
+    """
+    The result of a derivation stopped because it exceeded its DerivationBudget. It is returned instead of the pString.
+    """
+    MODULES = "modules"
+    MEMORY = "memory"
+    TIME = "time"
+
+    def __init__(self, reason, step, nModules, elapsed):
+        """
+        @param reason: What limit was exceeded (MODULES, MEMORY or TIME)
+        @param step: The step (starting from 0) at which the derivation was stopped
+        @param nModules: How many modules were derived at that step
+        @param elapsed: Duration of the derivation (in seconds)
+        """
+        self.reason = reason
+        self.step = step
+        self.nModules = nModules
+        self.elapsed = elapsed
+
+    def __str__(self):
+        return "Derivation budget exceeded (" + self.reason + ") at step " + str(self.step) + " with " + str(self.nModules) + " modules after " + "{0:.2f}".format(self.elapsed) + "s"
+
+
+class BudgetExceededError(Exception):
+    """
+    Raised to stop a derivation from deep inside it. The derivation then returns its BudgetExceededResult.
+    """
+    def __init__(self, result):
+        Exception.__init__(self, str(result))
+        self.result = result
+
+
+if __name__ == "__main__":
+    print("Start testing DerivationBudget")
+
+    import imp
+    import grammar.parametric.parametriclsystem
+    imp.reload(grammar.parametric.parametriclsystem)
+    from grammar.parametric.parametriclsystem import ParametricLSystem
+    from grammar.parametric.derivationbudget import DerivationBudget    # The same class the lsystem uses
+
+    pl = ParametricLSystem()
+    pl.setAxiomFromString("F")
+    pl.addProductionFromString("F:*->F[+F]F[-F]F")
+
+    print("\nWithin budget")
+    print(len(pl.iterate(3,DerivationBudget(maxModules = 10000))))
+
+    print("\nExceeding the number of modules")
+    print(pl.iterate(10,DerivationBudget(maxModules = 10000)))
+
+    print("\nExceeding the memory")
+    pl.compactDerivation = True
+    print(pl.iterate(10,DerivationBudget(maxMemory = 1000000)))
+    pl.compactDerivation = False
+
+    print("\nExceeding the time")
+    print(pl.iterate(10,DerivationBudget(timeout = 0.1)))
+
+    print("\nShared derivation")
+    pl.sharedDerivation = True
+    print(pl.iterate(20,DerivationBudget(maxModules = 10**9)))
+    pl.sharedDerivation = False
+
+    print("\nCached results with different budgets")
+    pl.setIterations(6)
+    print(pl.getResultPString(DerivationBudget(maxModules = 100)))
+    print(pl.getResultPString(DerivationBudget(maxModules = 50)))
+    print(len(pl.getResultPString(DerivationBudget(maxModules = 10**7))))
+    pl.clearResultPString()
+    print(pl.getResultPString(DerivationBudget(maxModules = 100)))
+    print(len(pl.getResultPString()))
+
+    print("\nFinish testing DerivationBudget")
@@ -0,0 +1,124 @@
+"""
+    @author: Michele Pirovano
+    @copyright: 2013-2015
+"""
+
+from collections import OrderedDict
+import threading
+
+class DerivationCheckpoints:
+    """
+    The pStrings derived at each step of the derivations of pL-systems, so that a later derivation of the same grammar
+    can go on from the last checkpoint instead of starting from the axiom. See ParametricLSystem.iterate.
+
+    Checkpoints are keyed on the structure of the grammar (see ParametricLSystem.getDerivationKey) and on the step,
+    so the same checkpoints can be used by any number of lsystems (copies of a lsystem, for example).
+    When the estimated memory of the checkpoints exceeds the limit, the least recently used ones are evicted.
+    Checkpoints can be used by lsystems derived in different threads.
+
+    @note: The checkpointed pStrings must not be modified. Derivations return a copy of them.
+    """
+    DEFAULT_MAX_MEMORY = 256*1024*1024
+
+    def __init__(self, maxMemory = DEFAULT_MAX_MEMORY, maxCheckpoints = None):
+        """
+        @param maxMemory: Maximum memory (in bytes) used by all checkpoints, estimated from their number of modules as in DerivationBudget
+        @type maxMemory: int
+
+        @param maxCheckpoints: Optional. Maximum number of checkpoints
+        @type maxCheckpoints: int
+        """
+        self.maxMemory = maxMemory
+        self.maxCheckpoints = maxCheckpoints
+        self.checkpoints = OrderedDict()    # (key, step) -> (pString, memory), least recently used first
+        self.memory = 0
+        self.lock = threading.Lock()
+
+    def getLatest(self, key, N):
+        """
+        Finds the checkpoint of the given grammar with the highest step not after N.
+
+        @return: The step of the checkpoint (0 if there is none) and its pString (None if there is none)
+        @rtype: tuple
+        """
+        with self.lock:
+            for step in range(N,0,-1):
+                checkpoint = self.checkpoints.get((key,step))
+                if checkpoint is not None:
+                    self.checkpoints.move_to_end((key,step))
+                    return step, checkpoint[0]
+        return 0, None
+
+    def store(self, key, step, pString, moduleBytes):
+        """
+        Stores the pString derived at a given step, evicting older checkpoints if needed.
+        A pString that alone exceeds the memory limit is not stored.
+        """
+        memory = len(pString)*moduleBytes
+        if memory > self.maxMemory: return
+        with self.lock:
+            self.removeUnlocked(key,step)
+            self.checkpoints[(key,step)] = (pString, memory)
+            self.memory += memory
+            while self.memory > self.maxMemory or (self.maxCheckpoints is not None and len(self.checkpoints) > self.maxCheckpoints):
+                self.memory -= self.checkpoints.popitem(last = False)[1][1]
+
+    def remove(self, key, step):
+        with self.lock: self.removeUnlocked(key,step)
+
+    def removeUnlocked(self, key, step):
+        checkpoint = self.checkpoints.pop((key,step),None)
+        if checkpoint is not None: self.memory -= checkpoint[1]
+
+    def clear(self):
+        with self.lock:
+            self.checkpoints = OrderedDict()
+            self.memory = 0
+
+    def __len__(self):
+        return len(self.checkpoints)
+
+    def __str__(self):
+        return "Checkpoints: " + str(len(self.checkpoints)) + " using " + str(self.memory) + " bytes (max " + str(self.maxMemory) + ")"
+
+
+if __name__ == "__main__":
+    print("Start testing DerivationCheckpoints")
+
+    import imp
+    import grammar.parametric.parametriclsystem
+    imp.reload(grammar.parametric.parametriclsystem)
+    from grammar.parametric.parametriclsystem import ParametricLSystem
+    from grammar.parametric.derivationcheckpoints import DerivationCheckpoints    # The same class the lsystem uses
+    import timeit
+
+    def createLSystem(checkpoints = None):
+        pl = ParametricLSystem(checkpoints = checkpoints)
+        pl.setAxiomFromString("F(1)")
+        pl.addProductionFromString("F(x):*->F(x*2)[+(30)F(x)]F(x)[-(30)F(x)]F(x)")
+        return pl
+
+    print("\nSame derivations")
+    checkpoints = DerivationCheckpoints()
+    pl = createLSystem(checkpoints)
+    print(all(str(pl.iterate(i)) == str(createLSystem().iterate(i)) for i in [3,2,4,4,1,5]))
+    print(checkpoints)
+
+    print("\nChanging the grammar")
+    pl.addProductionFromString("A:*->F")
+    print(str(pl.iterate(2)) == str(createLSystem().iterate(2)))
+    print(checkpoints)
+
+    print("\nEviction")
+    checkpoints = DerivationCheckpoints(maxMemory = 10000)
+    pl = createLSystem(checkpoints)
+    pl.iterate(4)
+    print(checkpoints)
+
+    print("\nBenchmark growth")
+    for checkpoints in [None, DerivationCheckpoints()]:
+        pl = createLSystem(checkpoints)
+        time = timeit.timeit(lambda: [pl.iterate(i+1) for i in range(7)], number=1)
+        print(("With" if checkpoints is not None else "Without") + " checkpoints: " + "{0:.4f}".format(time) + "s")
+
+    print("\nFinish testing DerivationCheckpoints")
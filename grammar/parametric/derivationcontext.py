@@ -0,0 +1,45 @@
+"""
+    @author: Michele Pirovano
+    @copyright: 2013-2015
+"""
+
+class DerivationContext:
+    """
+    The state of a single derivation of a pL-system: the production that rewrites each letter, and the random generator of stochastic productions.
+    See ParametricLSystem.createDerivationContext.
+
+    Each derivation creates its own context, while the lsystem and its productions are only read,
+    so any number of lsystems (or copies of the same lsystem) can be derived at the same time in different threads.
+
+    @note: The successors are compiled when the context is created (see ParametricProduction.compileSuccessor).
+    Productions shared between copies may be compiled by more than one thread, which build the same compiled successor.
+    """
+
+    def __init__(self, chosenProductions, productionTables, rnd = None):
+        """
+        @param chosenProductions: The production that rewrites each letter, if it does not depend on the rewritten module
+        @type chosenProductions: dict
+
+        @param productionTables: The table that chooses the production of each module, for the other letters
+        @type productionTables: dict
+
+        @param rnd: Optional. The random generator used by stochastic production tables
+        @type rnd: random.Random
+        """
+        self.chosenProductions = chosenProductions
+        self.productionTables = productionTables
+        self.rnd = rnd
+
+    def chooseProduction(self, letter, values):
+        """
+        @param letter: The letter of the rewritten module
+        @param values: The parameter values of the rewritten module
+
+        @return: The production that rewrites the module, or None if it is not rewritten
+        @rtype: ParametricProduction
+        """
+        prod = self.chosenProductions.get(letter)
+        if prod is None and self.productionTables:
+            table = self.productionTables.get(letter)
+            if table is not None: prod = table.choose(values,self.rnd)
+        return prod
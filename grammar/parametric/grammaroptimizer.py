@@ -0,0 +1,260 @@
+"""
+    @author: Michele Pirovano
+    @copyright: 2013-2015
+"""
+
+# This code needed for blender to load correctly updated source files
+import grammar.parametric.parametriclsystem
+import grammar.parametric.parametricmodule
+
+import imp
+imp.reload(grammar.parametric.parametriclsystem)
+imp.reload(grammar.parametric.parametricmodule)
+
+from grammar.parametric.parametriclsystem import ParametricLSystem
+from grammar.parametric.parametricmodule import ParametricModule
+
+class GrammarOptimizer:
+    """
+    Simplifies a pL-system before it is derived, so that its derivation creates fewer modules, while the Turtle draws the same structure.
+
+    The optimizer works on a copy of the lsystem, in four passes:
+        - dead productions are removed: those that are never used (after a production that always holds for the same letter, or rewriting brackets)
+            and those of letters that cannot be derived from the axiom.
+        - constant parameter expressions of the successors (e.g. 'd1*2+0.5') are folded into numbers.
+        - only with allowApproximateMerge, adjacent rotations of the same kind (e.g. '+(10)+(20)') are merged into one ('+(30)'), if their letter is never rewritten.
+        - modules that the Turtle does not read are erased from the derived pString, once all the steps are applied (see ParametricLSystem.setErasedLetters).
+
+    @note: By default, the Turtle draws exactly the same structure from the optimized lsystem.
+    Merged rotations are summed before being converted to radians, so they give the same output only up to floating point rounding,
+    and only without length and angle noise, since the Turtle's random values depend on the position of each character.
+    Set allowApproximateMerge only for turtles that draw without noise.
+    Folded expressions use the current global defines: optimize the lsystem again if they change.
+
+    @note: This is an opt-in tool, for lsystems that are derived many times with the same parameters (e.g. when rendering a genome repeatedly).
+    The GeneticEvolver and the PlantRenderManager do not call it. The fitness functions count the modules and rotations of the pString, which the optimizer changes,
+    and the rendered instances reuse the result pString that their fitness already derived.
+    On the genomes to render the gain is small (0.33s to 0.30s for derivation and drawing, see the self-test).
+    """
+
+    # Characters the Turtle reads, see Turtle.draw
+    GRAPHICAL_LETTERS = frozenset('F+-|&^\\/[]!LBKR')
+    ROTATION_LETTERS = frozenset('+-&^\\/')
+
+    def __init__(self, verbose = False, allowApproximateMerge = False):
+        self.verbose = verbose
+        self.allowApproximateMerge = allowApproximateMerge  # If True, adjacent rotations are merged, which changes the Turtle output with noise (see mergeRotations)
+        self.clearStatistics()
+
+    def clearStatistics(self):
+        self.removedProductions = 0
+        self.foldedExpressions = 0
+        self.mergedModules = 0
+        self.erasedLetters = frozenset()
+
+    def optimize(self, lsystem):
+        """
+        @param lsystem: The lsystem to optimize. It is not modified.
+        @type lsystem: ParametricLSystem
+
+        @return: An optimized copy of the lsystem
+        @rtype: ParametricLSystem
+        """
+        self.clearStatistics()
+        optimized = ParametricLSystem.copyFrom(lsystem)
+        self.removeDeadProductions(optimized)
+        self.foldConstants(optimized)
+        if self.allowApproximateMerge: self.mergeRotations(optimized)
+        self.eraseNonGraphicalModules(optimized)
+        if self.verbose: print(str(self))
+        return optimized
+
+    def removeDeadProductions(self, lsystem):
+        """
+        Removes the productions that are never used when deriving the lsystem.
+        """
+        usedProductions = {}
+        for letter, prods in lsystem.buildProductionsTable().items():
+            usedProductions[letter] = ParametricLSystem.getUsedProductions(prods)
+
+        # Letters derived from the axiom
+        reachedLetters = set()
+        pendingLetters = [m.letter for m in lsystem.axiom]
+        while pendingLetters:
+            letter = pendingLetters.pop()
+            if letter in reachedLetters: continue
+            reachedLetters.add(letter)
+            for prod in usedProductions.get(letter,[]):
+                pendingLetters.extend([m.letter for m in prod.successor])
+
+        liveProductions = set()
+        for letter, prods in usedProductions.items():
+            if letter in reachedLetters: liveProductions.update(prods)
+        for i in range(len(lsystem.productions)-1,-1,-1):
+            if lsystem.productions[i] not in liveProductions:
+                if self.verbose: print("Removing production " + str(lsystem.productions[i]))
+                lsystem.removeProduction(i)
+                self.removedProductions += 1
+
+    def foldConstants(self, lsystem):
+        """
+        Replaces the parameter expressions of the successors that do not depend on the predecessor's parameters with their value.
+        """
+        for i in range(len(lsystem.productions)):
+            prod = lsystem.productions[i]
+            foldedModules = [self.foldModule(prod,m) for m in prod.successor]
+            if any(folded is not m for folded, m in zip(foldedModules,prod.successor)):
+                prod = lsystem.getModifiableProduction(i)
+                prod.successor.modulesList = foldedModules
+
+    def foldModule(self, prod, m):
+        """
+        @return: The module with its constant parameter expressions folded, or the module itself if none is folded
+        @rtype: ParametricModule
+        """
+        params = list(m.params)
+        for j in range(len(params)):
+            if not isinstance(params[j],str): continue
+            try:
+                # Without parameter indices, an expression that uses the predecessor's parameters fails to evaluate
+                value = prod.compileExpression(params[j],{})([])
+            except (KeyError,ArithmeticError):
+                continue
+            if isinstance(value,float):
+                params[j] = value
+                self.foldedExpressions += 1
+        if params == m.params: return m
+        folded = ParametricModule(m.letter,params)
+        folded.setGlobals(m.globalDefines)
+        return folded
+
+    def mergeRotations(self, lsystem):
+        """
+        Merges adjacent rotations of the same kind with numeric angles, in the axiom and in the successors.
+        Rotations whose letter is rewritten by a production are never merged.
+        @note: The Turtle draws the same structure only up to floating point rounding, and only without noise.
+        """
+        mergeableLetters = GrammarOptimizer.ROTATION_LETTERS.difference([prod.predecessor.letter for prod in lsystem.productions])
+        if not mergeableLetters: return
+
+        mergedModules = self.mergeModules(lsystem.axiom,mergeableLetters)
+        if mergedModules is not None: lsystem.getModifiableAxiom().modulesList = mergedModules
+
+        for i in range(len(lsystem.productions)):
+            mergedModules = self.mergeModules(lsystem.productions[i].successor,mergeableLetters)
+            if mergedModules is not None: lsystem.getModifiableProduction(i).successor.modulesList = mergedModules
+
+    def mergeModules(self, pString, mergeableLetters):
+        """
+        @return: The modules of the pString with the adjacent rotations merged, or None if none is merged
+        @rtype: list
+        """
+        def isMergeable(m):
+            return m.letter in mergeableLetters and len(m.params) == 1 and isinstance(m.params[0],float)
+
+        mergedModules = []
+        merged = False
+        for m in pString:
+            if mergedModules and isMergeable(m) and isMergeable(mergedModules[-1]) and mergedModules[-1].letter == m.letter:
+                last = mergedModules[-1]
+                mergedModules[-1] = ParametricModule.fromValues(m.letter,[last.params[0]+m.params[0]])
+                mergedModules[-1].setGlobals(m.globalDefines)
+                self.mergedModules += 1
+                merged = True
+            else:
+                mergedModules.append(m)
+        return mergedModules if merged else None
+
+    def eraseNonGraphicalModules(self, lsystem):
+        """
+        Erases the modules that the Turtle does not read from the derived pString.
+        Modules are kept if their parameters contain characters that the Turtle reads (e.g. the '-' of a negative number).
+        """
+        letters = set([m.letter for m in lsystem.axiom])
+        for prod in lsystem.productions: letters.update([m.letter for m in prod.successor])
+        self.erasedLetters = frozenset(letters.difference(GrammarOptimizer.GRAPHICAL_LETTERS))
+        if self.erasedLetters: lsystem.setErasedLetters(self.erasedLetters,GrammarOptimizer.GRAPHICAL_LETTERS)
+
+    def __str__(self):
+        return ("Optimizer: removed " + str(self.removedProductions) + " productions, folded " + str(self.foldedExpressions)
+                + " expressions, merged " + str(self.mergedModules) + " modules, erasing " + "".join(sorted(self.erasedLetters)))
+
+
+if __name__ == "__main__":
+    print("Start testing GrammarOptimizer")
+
+    import os
+    import timeit
+    import turtles.turtle
+    imp.reload(turtles.turtle)
+    from turtles.turtle import Turtle
+
+    def derive(pl):
+        """ Derives a copy of the lsystem, so that stochastic lsystems always draw the same random values """
+        return ParametricLSystem.copyFrom(pl).iterate()
+
+    def sameDrawing(pString, otherPString, tolerance = 0, noise = 0):
+        """ True if the Turtle draws the same structure from both pStrings """
+        turtle = Turtle()
+        turtle.lengthNoise = turtle.angleNoise = noise
+        turtle.randomSeed = 1
+        result = turtle.draw(str(pString))
+        otherResult = turtle.draw(str(otherPString))
+        def close(vectors, otherVectors):
+            return len(vectors) == len(otherVectors) and all(abs(a-b) <= tolerance for v, w in zip(vectors,otherVectors) for a, b in zip((v.x,v.y,v.z),(w.x,w.y,w.z)))
+        return (close(result.verts,otherResult.verts) and result.edges == otherResult.edges and result.radii == otherResult.radii
+                and all(close([q.pos for q in details],[q.pos for q in otherDetails]) and close([q.eul for q in details],[q.eul for q in otherDetails])
+                        for details, otherDetails in [(result.leaves,otherResult.leaves),(result.bulbs,otherResult.bulbs),
+                                                      (result.flowers,otherResult.flowers),(result.fruits,otherResult.fruits)]))
+
+    optimizer = GrammarOptimizer(verbose = True)
+
+    print("\nOptimizing")
+    pl = ParametricLSystem(randomSeed = 1)
+    pl.addGlobalDefine("d1",10)
+    pl.setAxiomFromString("A(1)")
+    pl.addProductionFromString("A(x):*->F(x)[+(d1*2)+(5)A(x*0.5)]-(d1)-(d1)B(x)A(x)")
+    pl.addProductionFromString("A(x):*->F(x)")
+    pl.addProductionFromString("C(x):*->F(x)C(x)")
+    pl.addProductionFromString("B(x):0.5->L(x)")
+    pl.addProductionFromString("B(x):0.5->F(x)")
+    pl.niterations = 4
+    optimizedPl = optimizer.optimize(pl)
+    print(optimizedPl)
+    print("Modules: " + str(len(derive(pl))) + " -> " + str(len(derive(optimizedPl))))
+    print("Same drawing: " + str(sameDrawing(derive(pl),derive(optimizedPl))))
+    print("Same drawing (with noise): " + str(sameDrawing(derive(pl),derive(optimizedPl),noise = 0.2)))
+    print("Same drawing (stream): " + str(sameDrawing(derive(pl),"".join([str(m) for m in ParametricLSystem.copyFrom(optimizedPl).iterateModules()]))))
+    for derivationMode in ["compactDerivation","sharedDerivation"]:
+        modePl = ParametricLSystem.copyFrom(optimizedPl)
+        setattr(modePl,derivationMode,True)
+        print("Same drawing (" + derivationMode + "): " + str(sameDrawing(derive(pl),modePl.iterate())))
+
+    print("\nOptimizing with approximate merge")
+    mergedPl = GrammarOptimizer(verbose = True, allowApproximateMerge = True).optimize(pl)
+    print(mergedPl)
+    print("Modules: " + str(len(derive(pl))) + " -> " + str(len(derive(mergedPl))))
+    print("Same drawing (up to rounding): " + str(sameDrawing(derive(pl),derive(mergedPl),tolerance = 1e-6)))
+    print("Same drawing (with noise): " + str(sameDrawing(derive(pl),derive(mergedPl),noise = 0.2)))
+
+    print("\nGenomes to render")
+    genomesPath = os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","..","blender","imagegeneration","genomes_to_render.txt")
+    optimizer.verbose = False
+    lsystems = []
+    with open(genomesPath) as genomesFile:
+        for line in genomesFile:
+            if line.strip() == "": continue
+            pl = ParametricLSystem()
+            pl.fromGenomeRepresentation(line.strip().split("||||")[0])
+            lsystems.append((pl,optimizer.optimize(pl)))
+    for pl, optimizedPl in lsystems:
+        print("Modules: " + str(len(derive(pl))) + " -> " + str(len(derive(optimizedPl)))
+              + " | Same drawing: " + str(sameDrawing(derive(pl),derive(optimizedPl))))
+
+    print("\nBenchmark derivation and drawing")
+    for index in [0,1]:
+        turtle = Turtle()
+        time = timeit.timeit(lambda: [turtle.draw(str(pair[index].iterate())) for pair in lsystems], number=3)
+        print(("Optimized" if index == 1 else "Original") + ": " + "{0:.4f}".format(time) + "s")
+
+    print("\nFinish testing GrammarOptimizer")
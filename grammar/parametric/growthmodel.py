@@ -0,0 +1,152 @@
+"""
+    @author: Michele Pirovano
+    @copyright: 2013-2015
+"""
+
+class GrowthModel:
+    """
+    Predicts how many modules of each letter a pL-system derives, without deriving it.
+    Each production is reduced to the letter counts of its successor, giving a growth matrix:
+    the counts after a step are the counts before it multiplied by the matrix.
+
+    Stochastic productions are weighted by their probabilities, so the prediction is the expected count.
+    Parametric conditions cannot be known in advance, and are assumed to hold half of the times.
+    The upper bound instead uses, for each letter, the largest count among all productions that may be chosen.
+    Without stochastic or parametric conditions, both are exact.
+    """
+
+    def __init__(self, lsystem):
+        """
+        @param lsystem: The lsystem to analyse. The model must be built again if the lsystem changes.
+        @type lsystem: ParametricLSystem
+        """
+        self.niterations = lsystem.niterations
+
+        self.axiomCounts = {}
+        for m in lsystem.axiom:
+            self.axiomCounts[m.letter] = self.axiomCounts.get(m.letter,0) + 1
+
+        # For each letter, its possible successors (as letter counts) with their probability
+        alternatives = {}
+        remaining = {}    # Probability that no production has been chosen yet
+        covered = {}      # Random values already covered by previous stochastic productions
+        totalCondition = {}
+        for prod in lsystem.productions:
+            letter = prod.predecessor.letter
+            if letter in ('[',']'): continue     # Brackets are never rewritten
+            if letter not in alternatives:
+                alternatives[letter] = []
+                remaining[letter] = 1
+                covered[letter] = 0
+                totalCondition[letter] = 0
+
+            # Same as StochasticProductionTable: the probabilities of the stochastic productions of a letter accumulate
+            if prod.condition.type == "*":
+                probability = remaining[letter]
+            elif prod.condition.type == "#":
+                totalCondition[letter] += prod.condition.value
+                upper = min(1,totalCondition[letter])
+                if covered[letter] < 1: probability = remaining[letter]*max(0,upper-covered[letter])/(1-covered[letter])
+                else: probability = 0
+                covered[letter] = max(covered[letter],upper)
+            else:
+                probability = remaining[letter]*0.5
+            remaining[letter] -= probability
+
+            successorCounts = {}
+            for m in prod.successor:
+                successorCounts[m.letter] = successorCounts.get(m.letter,0) + 1
+            alternatives[letter].append((probability,successorCounts))
+
+        # Letters without a chosen production are kept as they are
+        for letter in alternatives:
+            if remaining[letter] > 0: alternatives[letter].append((remaining[letter],{letter:1}))
+
+        self.expectedMatrix = {}
+        self.upperBoundMatrix = {}
+        for letter in alternatives:
+            expectedRow = {}
+            upperBoundRow = {}
+            for probability, successorCounts in alternatives[letter]:
+                if probability <= 0: continue
+                for successorLetter, count in successorCounts.items():
+                    expectedRow[successorLetter] = expectedRow.get(successorLetter,0) + probability*count
+                    upperBoundRow[successorLetter] = max(upperBoundRow.get(successorLetter,0),count)
+            self.expectedMatrix[letter] = expectedRow
+            self.upperBoundMatrix[letter] = upperBoundRow
+
+    def predictLetterCounts(self, N = None, upperBound = False):
+        """
+        @param N: Number of iterations. Defaults to the lsystem's iterations.
+        @type N: int
+
+        @param upperBound: If True, returns an upper bound instead of the expected counts.
+        @type upperBound: bool
+
+        @return: The number of modules of each letter after N iterations
+        @rtype: dict
+        """
+        if N is None: N = self.niterations
+        matrix = self.upperBoundMatrix if upperBound else self.expectedMatrix
+        counts = dict(self.axiomCounts)
+        for i in range(N):
+            newCounts = {}
+            for letter, count in counts.items():
+                if letter in matrix:
+                    for successorLetter, successorCount in matrix[letter].items():
+                        newCounts[successorLetter] = newCounts.get(successorLetter,0) + count*successorCount
+                else:
+                    newCounts[letter] = newCounts.get(letter,0) + count
+            counts = newCounts
+        return counts
+
+    def predictLength(self, N = None, upperBound = False, withBrackets = True):
+        """
+        @return: The number of modules after N iterations (see predictLetterCounts)
+        @rtype: float
+        """
+        counts = self.predictLetterCounts(N, upperBound)
+        length = sum(counts.values())
+        if not withBrackets: length -= counts.get('[',0) + counts.get(']',0)
+        return length
+
+
+if __name__ == "__main__":
+    print("Start testing GrowthModel")
+
+    import imp
+    import grammar.parametric.parametriclsystem
+    imp.reload(grammar.parametric.parametriclsystem)
+    from grammar.parametric.parametriclsystem import ParametricLSystem
+
+    print("\nDeterministic lsystem (exact)")
+    pl = ParametricLSystem()
+    pl.setAxiomFromString("A(1)")
+    pl.addProductionFromString("A(x):*->F(x)[+A(x*0.5)][-A(x*0.5)]L")
+    pl.addProductionFromString("F(x):*->F(x*1.1)F(x)")
+    pl.setIterations(5)
+    model = GrowthModel(pl)
+    print("Predicted: " + str(model.predictLength()) + " F: " + str(model.predictLetterCounts()['F']))
+    ps = pl.iterate()
+    print("Derived: " + str(len(ps)) + " F: " + str(len([m for m in ps if m.letter == 'F'])))
+
+    print("\nStochastic lsystem")
+    pl = ParametricLSystem()
+    pl.setAxiomFromString("A")
+    pl.addProductionFromString("A:0.3->F[+A][-A]")
+    pl.addProductionFromString("A:0.7->FA")
+    pl.setIterations(6)
+    model = GrowthModel(pl)
+    print("Expected: " + str(model.predictLength()) + " Upper bound: " + str(model.predictLength(upperBound = True)))
+    lengths = []
+    for seed in range(200):
+        pl.rnd.seed(seed)
+        lengths.append(len(pl.iterate()))
+    print("Derived average: " + str(sum(lengths)/len(lengths)) + " max: " + str(max(lengths)))
+
+    print("\nBenchmark")
+    import timeit
+    print("Prediction: " + "{0:.6f}".format(timeit.timeit(lambda: GrowthModel(pl).predictLength(), number=100)/100) + "s")
+    print("Derivation: " + "{0:.6f}".format(timeit.timeit(lambda: pl.iterate(), number=100)/100) + "s")
+
+    print("\nFinish testing GrowthModel")
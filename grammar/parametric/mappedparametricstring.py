@@ -0,0 +1,213 @@
+"""
+    @author: Michele Pirovano
+    @copyright: 2013-2015
+"""
+
+# This code needed for blender to load correctly updated source files
+import grammar.parametric.parametricmodule
+import grammar.parametric.compactparametricstring
+
+import imp
+imp.reload(grammar.parametric.parametricmodule)
+imp.reload(grammar.parametric.compactparametricstring)
+
+from grammar.parametric.parametricmodule import ParametricModule
+from grammar.parametric.compactparametricstring import CompactParametricString
+
+from array import array
+import mmap
+import os
+import shutil
+import tempfile
+import weakref
+
+class MappedParametricString(CompactParametricString):
+    """
+    A CompactParametricString whose letters, offsets and values are kept in files on disk, and memory-mapped.
+    Its size is bounded by the disk instead of the memory, and the operating system pages in only the parts being read.
+    It is used for out-of-core derivations (see ParametricLSystem.iterate_loop).
+
+    The pString is first written, a module at a time, with appendLetterAndValues: modules are buffered and appended to the files.
+    Once finish is called, the files are mapped and the pString can only be read, sequentially for best performance.
+    Iterating it streams the modules (for example, to the Turtle) without ever loading the whole pString.
+
+    @note: The files are removed when the pString is closed or garbage collected. On POSIX systems, they are removed as soon as they are mapped.
+    """
+    FLUSH_MODULES = 65536       # Modules buffered before being written to the files
+    READ_CHUNK_MODULES = 65536  # Letters decoded at a time when iterating
+
+    def __init__(self, directory = None):
+        """
+        @param directory: Optional. The directory of the files. Defaults to the temporary directory of the system.
+        @type directory: str
+        """
+        self.globalDefines = None
+        self.cachedString = None
+        self.version = 0
+
+        self.path = tempfile.mkdtemp(prefix = "pstring", dir = directory)
+        self.removeFiles = weakref.finalize(self, shutil.rmtree, self.path, True)
+        self.files = [open(os.path.join(self.path,name),'wb') for name in ('letters','offsets','values')]
+        self.maps = []
+        self.writtenModules = 0
+        self.writtenValues = 0
+
+        # Buffers, while writing
+        self.letters = bytearray()
+        self.values = array('d')
+        self.offsets = array('L',[0])
+
+    ################
+    # Writing
+    ################
+
+    def appendLetterAndValues(self,letter,values):
+        if self.files is None: raise Exception("A mapped pString cannot be modified once finished!")
+        self.letters.append(ord(letter))
+        self.values.extend(values)
+        self.offsets.append(self.writtenValues + len(self.values))
+        if len(self.letters) >= self.FLUSH_MODULES: self.flush()
+
+    def flush(self):
+        """ Appends the buffered modules to the files """
+        self.files[0].write(self.letters)
+        self.files[1].write(self.offsets)
+        self.files[2].write(self.values)
+        self.writtenModules += len(self.letters)
+        self.writtenValues += len(self.values)
+        self.letters = bytearray()
+        self.values = array('d')
+        self.offsets = array('L')
+
+    def finish(self):
+        """
+        Ends the writing, and maps the files to be read.
+
+        @return: This pString
+        @rtype: MappedParametricString
+        """
+        self.flush()
+        for f in self.files: f.close()
+        self.files = None
+        self.letters = self.mapFile('letters',None)
+        self.offsets = self.mapFile('offsets','L')
+        self.values = self.mapFile('values','d')
+        if os.name == "posix": self.removeFiles()   # The mapped data stays available until it is unmapped
+        return self
+
+    def mapFile(self,name,typecode):
+        """ Maps a file as bytes, or as an array of the given type """
+        path = os.path.join(self.path,name)
+        if os.path.getsize(path) == 0: return bytes() if typecode is None else array(typecode)
+        with open(path,'rb') as f:
+            mappedFile = mmap.mmap(f.fileno(),0,access = mmap.ACCESS_READ)
+        self.maps.append(mappedFile)
+        if typecode is None: return mappedFile
+        return memoryview(mappedFile).cast(typecode)
+
+    def close(self):
+        """ Unmaps the pString and removes its files. The pString cannot be used anymore. """
+        if self.files is not None:
+            for f in self.files: f.close()
+            self.files = None
+        for view in (self.offsets,self.values):
+            if isinstance(view,memoryview): view.release()
+        self.letters, self.values, self.offsets = bytes(), array('d'), array('L',[0])
+        for mappedFile in self.maps: mappedFile.close()
+        self.maps = []
+        self.removeFiles()
+
+    ################
+    # Reading
+    ################
+
+    def __len__(self):
+        if self.files is not None: return self.writtenModules + len(self.letters)
+        return len(self.letters)
+
+    def __iter__(self):
+        values = self.values
+        offsets = self.offsets
+        nModules = len(self.letters)
+        for start in range(0,nModules,self.READ_CHUNK_MODULES):
+            letters = self.letters[start:start+self.READ_CHUNK_MODULES].decode('latin-1')
+            for i in range(len(letters)):
+                yield ParametricModule.fromValues(letters[i],values[offsets[start+i]:offsets[start+i+1]].tolist())
+
+    def countLetter(self,letter):
+        code = ord(letter)
+        return sum([self.letters[start:start+self.READ_CHUNK_MODULES].count(code) for start in range(0,len(self.letters),self.READ_CHUNK_MODULES)])
+
+    def appendModule(self,m):
+        values = []
+        for p in m.params:
+            if self.globalDefines is not None and p in self.globalDefines: p = self.globalDefines[p]
+            values.append(float(p))
+        self.appendLetterAndValues(m.letter,values)
+
+    @property
+    def modulesList(self):
+        """ A list of the modules of this pString. It is a copy, so it takes as much memory as a ParametricString. """
+        return list(self)
+
+    @modulesList.setter
+    def modulesList(self,modules):
+        raise Exception("A mapped pString can only be appended to!")
+
+    def removeModulesFromTo(self,start_index,end_index):
+        raise Exception("A mapped pString can only be appended to!")
+
+    def setParameterToModulesOfLetter(self,letter,param_value):
+        raise Exception("A mapped pString can only be appended to!")
+
+
+if __name__ == "__main__":
+    print("Start testing MappedParametricString")
+
+    print("\nWriting and reading")
+    ps = MappedParametricString()
+    ps.FLUSH_MODULES = 3
+    compact = CompactParametricString.fromTextString("FF[F(1.5)]A(1,2)EEE")
+    for m in compact: ps.appendModule(m)
+    print(len(ps))
+    ps.finish()
+    print(str(ps) == str(compact) and len(ps) == len(compact))
+    print(str(ps[3]) + " " + str(ps[-1]) + " " + " ".join([str(m) for m in ps]))
+    print("Has branches? " + str(ps.hasBranches()) + " Is balanced? " + str(ps.bracketsAreBalanced()) + " Length without brackets: " + str(ps.lengthWithoutBrackets()))
+    ps.close()
+    print("Files removed? " + str(not os.path.exists(ps.path)))
+
+    print("\nOut-of-core derivation")
+    import grammar.parametric.parametriclsystem
+    imp.reload(grammar.parametric.parametriclsystem)
+    from grammar.parametric.parametriclsystem import ParametricLSystem
+    import turtles.turtle
+    imp.reload(turtles.turtle)
+    from turtles.turtle import Turtle
+    import timeit
+    import tracemalloc
+
+    def createLSystem(mappedDirectory = None):
+        pl = ParametricLSystem(compactDerivation = True, mappedDirectory = mappedDirectory)
+        pl.setAxiomFromString("A(1)")
+        pl.addProductionFromString("A(x):*->!(x)F(x)[+(30)A(x*0.9)][-(30)A(x*0.8)]L(x)")
+        pl.addProductionFromString("F(x):*->F(x*1.1)")
+        return pl
+
+    mappedPString = createLSystem(tempfile.gettempdir()).iterate(6)
+    print(type(mappedPString).__name__ + ": " + str(str(mappedPString) == str(createLSystem().iterate(6))))
+    turtle = Turtle()
+    print("Drawn as a stream: " + str(len(turtle.draw(mappedPString).verts) == len(turtle.draw(str(mappedPString)).verts)))
+
+    print("\nBenchmark against CompactParametricString")
+    for mappedDirectory in [None, tempfile.gettempdir()]:
+        name = "mapped" if mappedDirectory is not None else "compact"
+        time = timeit.timeit(lambda: createLSystem(mappedDirectory).iterate(15), number=1)
+        tracemalloc.start()
+        ps = createLSystem(mappedDirectory).iterate(15)
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(name + ": " + str(len(ps)) + " modules in " + "{0:.2f}".format(time) + "s, "
+              + "{0:.1f}".format(size/1e6) + " MB held (" + "{0:.1f}".format(peak/1e6) + " MB peak)")
+
+    print("\nFinish testing MappedParametricString")
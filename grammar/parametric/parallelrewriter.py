@@ -0,0 +1,269 @@
+"""
+    @author: Michele Pirovano
+    @copyright: 2013-2015
+"""
+
+# This code needed for blender to load correctly updated source files
+import grammar.parametric.compactparametricstring
+
+import imp
+imp.reload(grammar.parametric.compactparametricstring)
+
+from grammar.parametric.compactparametricstring import CompactParametricString
+
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import multiprocessing
+import os
+
+OFFSET_BYTES = array('L').itemsize
+VALUE_BYTES = array('d').itemsize
+
+def getBufferLayout(nModules, nValues):
+    """
+    The layout of a compact pString in a shared memory buffer: the letters, then the offsets (aligned), then the values.
+
+    @return: The start of the offsets, the start of the values and the total size, in bytes
+    @rtype: tuple
+    """
+    offsetsStart = (nModules + 7)//8*8
+    valuesStart = offsetsStart + (nModules+1)*OFFSET_BYTES
+    return offsetsStart, valuesStart, valuesStart + nValues*VALUE_BYTES
+
+# The lsystems rebuilt by a worker process, by derivation key (see ParametricLSystem.getDerivationKey)
+workerLSystems = {}
+
+def getWorkerLSystem(grammarDefinition):
+    """ Rebuilds the lsystem in a worker process, once for each grammar """
+    key, globalDefines, productionGenomes = grammarDefinition
+    lsystem = workerLSystems.get(key)
+    if lsystem is None:
+        import grammar.parametric.parametriclsystem
+        from grammar.parametric.parametriclsystem import ParametricLSystem
+        lsystem = ParametricLSystem(compactDerivation = True)
+        lsystem.globalDefines = globalDefines
+        for genome in productionGenomes: lsystem.addProductionFromGenomeRepresentation(genome)
+        workerLSystems.clear()      # Usually a single grammar is derived at a time
+        workerLSystems[key] = lsystem
+    return lsystem
+
+def rewriteChunk(grammarDefinition, inputName, nModules, nValues, start, end, outputName, outputStart, maxModules, maxValues):
+    """
+    Rewrites the modules from start to end (excluded) of a compact pString in shared memory, in a worker process.
+    The rewritten modules are written to their region of the output shared memory.
+
+    @return: The number of rewritten modules and values
+    @rtype: tuple
+    """
+    lsystem = getWorkerLSystem(grammarDefinition)
+
+    inputMemory = shared_memory.SharedMemory(name = inputName)
+    offsetsStart, valuesStart, size = getBufferLayout(nModules,nValues)
+    offsets = inputMemory.buf[offsetsStart:valuesStart].cast('L')
+    firstValue, lastValue = offsets[start], offsets[end]
+    chunk = CompactParametricString()
+    chunk.letters = bytearray(inputMemory.buf[start:end])
+    chunk.values = array('d')
+    chunk.values.frombytes(inputMemory.buf[valuesStart+firstValue*VALUE_BYTES:valuesStart+lastValue*VALUE_BYTES])
+    chunk.offsets = array('L',[o-firstValue for o in offsets[start:end+1]])
+    del offsets
+    inputMemory.close()
+
+    rewritten = lsystem.rewriteCompact(chunk,lsystem.createDerivationContext())
+    assert len(rewritten) <= maxModules and len(rewritten.values) <= maxValues, "The output region is too small!"
+
+    outputMemory = shared_memory.SharedMemory(name = outputName)
+    offsetsStart, valuesStart, size = getBufferLayout(maxModules,maxValues)
+    region = outputMemory.buf[outputStart:outputStart+size]
+    region[0:len(rewritten)] = rewritten.letters
+    region[offsetsStart:offsetsStart+len(rewritten.offsets)*OFFSET_BYTES] = memoryview(rewritten.offsets).cast('B')
+    region[valuesStart:valuesStart+len(rewritten.values)*VALUE_BYTES] = memoryview(rewritten.values).cast('B')
+    del region
+    outputMemory.close()
+    return len(rewritten), len(rewritten.values)
+
+
+class ParallelRewriter:
+    """
+    Rewrites large compact pStrings in parallel, in a pool of worker processes. See ParametricLSystem.iterate_loop.
+
+    Context-free rewriting is independent for each module, so the pString is split into chunks that are rewritten by the workers,
+    and the rewritten chunks are then concatenated in order.
+    The letters, offsets and values of the compact pString are passed through shared memory, and so are the rewritten ones:
+    only the grammar (once per worker) and the chunk bounds are sent to the workers.
+
+    Only pStrings with at least minModules modules are rewritten in parallel, since smaller ones take less time than sending them to the workers.
+    Derivations of ParametricStrings switch to compact pStrings when they reach minModules modules.
+    Nothing is rewritten in parallel with a single worker.
+    Stochastic lsystems are always rewritten serially, since each module draws from the random stream of the derivation in order.
+
+    @note: The pool is started when first needed. Its owner must call close when done with it; the pool is started again if needed.
+    Embedded interpreters (e.g. Blender) must give the executable of a Python interpreter for the worker processes.
+    """
+    DEFAULT_MIN_MODULES = 200000
+
+    def __init__(self, workers = None, minModules = DEFAULT_MIN_MODULES, chunksPerWorker = 4, executable = None):
+        """
+        @param workers: Optional. Number of worker processes. Defaults to the number of CPUs.
+        @type workers: int
+
+        @param minModules: Minimum number of modules of a pString rewritten in parallel
+        @type minModules: int
+
+        @param chunksPerWorker: Number of chunks rewritten by each worker, to balance the work
+        @type chunksPerWorker: int
+
+        @param executable: Optional. The Python interpreter that runs the worker processes, if this process is not one (e.g. bpy.app.binary_path_python in Blender)
+        @type executable: str
+        """
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.minModules = minModules
+        self.chunksPerWorker = chunksPerWorker
+        self.executable = executable
+        self.executor = None
+
+    def canRewrite(self, lsystem, pString):
+        """
+        True if the pString is rewritten in parallel.
+        A single worker is never faster than serial rewriting, so it is never used.
+        """
+        if self.workers <= 1 or len(pString) < self.minModules or lsystem.isStochastic(): return False
+        return True
+
+    def rewrite(self, lsystem, inputPString, checkBudget = None):
+        """
+        Same as ParametricLSystem.rewriteCompact, in parallel.
+        The budget is checked after each rewritten chunk is concatenated.
+
+        @rtype: CompactParametricString or BudgetExceededResult
+        """
+        if self.executor is None:
+            mpContext = None
+            if self.executable is not None:
+                mpContext = multiprocessing.get_context("spawn")
+                mpContext.set_executable(self.executable)
+            self.executor = ProcessPoolExecutor(max_workers = self.workers, mp_context = mpContext)
+        grammarDefinition = (lsystem.getDerivationKey(), lsystem.globalDefines, [prod.toGenomeRepresentation() for prod in lsystem.productions])
+
+        nModules, nValues = len(inputPString), len(inputPString.values)
+        nChunks = min(self.workers*self.chunksPerWorker,nModules)
+        bounds = [nModules*k//nChunks for k in range(nChunks+1)]
+
+        # Each chunk gets an output region large enough for the longest successors of its letters
+        maxSuccessorModules = {}
+        maxSuccessorValues = {}
+        for prod in lsystem.productions:
+            letter = prod.predecessor.letter
+            maxSuccessorModules[letter] = max(maxSuccessorModules.get(letter,0),len(prod.successor))
+            maxSuccessorValues[letter] = max(maxSuccessorValues.get(letter,0),sum([len(m.params) for m in prod.successor]))
+        regions = []
+        outputSize = 0
+        for k in range(nChunks):
+            letters = inputPString.letters[bounds[k]:bounds[k+1]]
+            counts = [(letters.count(ord(letter)),letter) for letter in maxSuccessorModules]
+            maxModules = len(letters) + sum([count*maxSuccessorModules[letter] for count, letter in counts])
+            maxValues = inputPString.offsets[bounds[k+1]] - inputPString.offsets[bounds[k]] + sum([count*maxSuccessorValues[letter] for count, letter in counts])
+            regions.append((outputSize,maxModules,maxValues))
+            outputSize += getBufferLayout(maxModules,maxValues)[2]
+
+        offsetsStart, valuesStart, inputSize = getBufferLayout(nModules,nValues)
+        inputMemory = shared_memory.SharedMemory(create = True, size = max(1,inputSize))
+        outputMemory = shared_memory.SharedMemory(create = True, size = max(1,outputSize))
+        try:
+            inputMemory.buf[0:nModules] = inputPString.letters
+            inputMemory.buf[offsetsStart:valuesStart] = memoryview(inputPString.offsets).cast('B')
+            inputMemory.buf[valuesStart:inputSize] = memoryview(inputPString.values).cast('B')
+
+            futures = [self.executor.submit(rewriteChunk,grammarDefinition,inputMemory.name,nModules,nValues,bounds[k],bounds[k+1],
+                                            outputMemory.name,regions[k][0],regions[k][1],regions[k][2]) for k in range(nChunks)]
+
+            outputPString = type(inputPString)()    # The class the lsystem uses
+            outputPString.setGlobals(inputPString.globalDefines)
+            for future, (regionStart, maxModules, maxValues) in zip(futures,regions):
+                chunkModules, chunkValues = future.result()
+                offsetsStart, valuesStart, size = getBufferLayout(maxModules,maxValues)
+                region = outputMemory.buf[regionStart:regionStart+size]
+                chunkOffsets = region[offsetsStart:offsetsStart+(chunkModules+1)*OFFSET_BYTES].cast('L')
+                firstValue = len(outputPString.values)
+                outputPString.letters += region[0:chunkModules]
+                outputPString.values.frombytes(region[valuesStart:valuesStart+chunkValues*VALUE_BYTES])
+                outputPString.offsets.extend([o+firstValue for o in chunkOffsets[1:]])
+                del chunkOffsets, region
+                if checkBudget is not None:
+                    exceededResult = checkBudget(len(outputPString))
+                    if exceededResult is not None:
+                        for future in futures: future.cancel()
+                        for future in futures:
+                            if not future.cancelled(): future.exception()   # The shared memory is released once the workers are done with it
+                        return exceededResult
+            return outputPString
+        finally:
+            inputMemory.close()
+            inputMemory.unlink()
+            outputMemory.close()
+            outputMemory.unlink()
+
+    def close(self):
+        """ Stops the worker processes """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __str__(self):
+        return "Parallel rewriter: " + str(self.workers) + " workers, from " + str(self.minModules) + " modules"
+
+
+if __name__ == "__main__":
+    print("Start testing ParallelRewriter")
+
+    import grammar.parametric.parametriclsystem
+    imp.reload(grammar.parametric.parametriclsystem)
+    from grammar.parametric.parametriclsystem import ParametricLSystem
+    from grammar.parametric.parallelrewriter import ParallelRewriter    # The same class the lsystem uses
+    import timeit
+
+    def createLSystem(parallelRewriter = None, compactDerivation = True):
+        pl = ParametricLSystem(compactDerivation = compactDerivation, parallelRewriter = parallelRewriter)
+        pl.addGlobalDefine("d",0.9)
+        pl.setAxiomFromString("A(1)")
+        pl.addProductionFromString("A(x):*->F(x)[+(25)A(x*d)][-(25)A(x*0.8)]B(x)A(x*d)")
+        pl.addProductionFromString("B(x):x<0.5->L(x)")
+        pl.addProductionFromString("B(x):*->B(x*d)")
+        pl.addProductionFromString("F(x):*->F(x*1.1)")
+        return pl
+
+    print("\nSame derivation")
+    parallelRewriter = ParallelRewriter(workers = 2, minModules = 100)
+    print(parallelRewriter)
+    for n in [3,6]:
+        print(str(createLSystem(parallelRewriter).iterate(n)) == str(createLSystem().iterate(n)))
+
+    print("\nSame derivation, switching from a ParametricString")
+    for n in [3,6]:
+        pString = createLSystem(parallelRewriter, compactDerivation = False).iterate(n)
+        print(type(pString).__name__ + " " + str(str(pString) == str(createLSystem(compactDerivation = False).iterate(n))))
+
+    print("\nBudget")
+    import grammar.parametric.derivationbudget
+    from grammar.parametric.derivationbudget import DerivationBudget
+    print(createLSystem(parallelRewriter).iterate(8,DerivationBudget(maxModules = 10000)))
+    parallelRewriter.close()
+
+    print("\nScaling benchmark (" + str(os.cpu_count()) + " CPUs)")
+    N = 10
+    print("Modules: " + str(len(createLSystem().iterate(N))))
+    for compactDerivation in [True, False]:
+        serialTime = min(timeit.repeat(lambda: createLSystem(compactDerivation = compactDerivation).iterate(N), number=1, repeat=3))
+        print(("Compact" if compactDerivation else "ParametricString") + " serial: " + "{0:.4f}".format(serialTime) + "s")
+        workersCounts = [w for w in [2,4,8,16] if w <= (os.cpu_count() or 1)]
+        if not workersCounts: print("Scaling needs several CPUs")
+        for workers in workersCounts:
+            parallelRewriter = ParallelRewriter(workers = workers, minModules = 10000)
+            pl = createLSystem(parallelRewriter, compactDerivation = compactDerivation)
+            pl.iterate(N)   # Starts the workers
+            time = min(timeit.repeat(lambda: pl.iterate(N), number=1, repeat=3))
+            print(str(workers) + " workers: " + "{0:.4f}".format(time) + "s, speedup " + "{0:.2f}".format(serialTime/time) + "x")
+            parallelRewriter.close()
+
+    print("\nFinish testing ParallelRewriter")
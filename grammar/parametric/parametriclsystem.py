@@ -9,17 +9,41 @@
 """
 
 # This code needed for blender to load correctly updated source files
+import grammar.parametric.parametricmodule
 import grammar.parametric.parametricproduction
 import grammar.parametric.parametricstring
+import grammar.parametric.compactparametricstring
+import grammar.parametric.mappedparametricstring
+import grammar.parametric.sharedparametricstring
+import grammar.parametric.derivationbudget
+import grammar.parametric.derivationcheckpoints
+import grammar.parametric.derivationcontext
 
 import imp
+imp.reload(grammar.parametric.parametricmodule)
 imp.reload(grammar.parametric.parametricproduction)
 imp.reload(grammar.parametric.parametricstring)
-
-from grammar.parametric.parametricproduction import ParametricProduction
+imp.reload(grammar.parametric.compactparametricstring)
+imp.reload(grammar.parametric.mappedparametricstring)
+imp.reload(grammar.parametric.sharedparametricstring)
+imp.reload(grammar.parametric.derivationbudget)
+imp.reload(grammar.parametric.derivationcheckpoints)
+imp.reload(grammar.parametric.derivationcontext)
+
+from grammar.parametric.parametricmodule import ParametricModule
+from grammar.parametric.parametricproduction import ParametricProduction, StochasticProductionTable, ConditionalProductionTable
 from grammar.parametric.parametricstring import ParametricString
-
+from grammar.parametric.compactparametricstring import CompactParametricString
+from grammar.parametric.mappedparametricstring import MappedParametricString
+from grammar.parametric.sharedparametricstring import SharedParametricString, DerivationNode
+from grammar.parametric.derivationbudget import DerivationBudget, BudgetExceededResult, BudgetExceededError
+from grammar.parametric.derivationcheckpoints import DerivationCheckpoints
+from grammar.parametric.derivationcontext import DerivationContext
+
+from itertools import islice, chain
 import random
+import time
+import io
 #import os
 #import multiprocessing
 
@@ -27,18 +51,51 @@ class ParametricLSystem:
     """
     Defines a complete P-Lsystem.
     See "The Algorithmic Beauty of Plants"
+
+    Copies share their axiom and productions with the original (copy-on-write):
+    whatever is going to be modified must be obtained through getModifiableAxiom and getModifiableProduction,
+    which duplicate it first if it is shared. The global defines dictionary is replaced, never modified, when a define changes.
+
+    The version of the lsystem is increased by all the methods that modify it, including getModifiableAxiom and getModifiableProduction.
+    Together with the versions of its axiom and productions (see getVersion), it tells whether the result pString is still valid.
+
+    Each derivation keeps its state in its own DerivationContext, so lsystems can be derived concurrently in different threads.
+    Each derivation of a stochastic lsystem draws its seed from the lsystem's random generator:
+    derive copies of the lsystem (which start from the same seed) to get the same results in any order.
     """
     OUTPUT_PATH = "C:\\Users\\Michele\\Desktop\\"
 
-    def __init__(self, randomSeed = 0, verbose = False):
+    def __init__(self, randomSeed = 0, verbose = False, compactDerivation = False, sharedDerivation = False, checkpoints = None, parallelRewriter = None, mappedDirectory = None):
         """
         @param randomSeed: The seed with which to initialise the random distribution
         @type randomSeed: int
 
         @param verbose: Optional. If True, the system will print data to the console.
         @type verbose: bool
+
+        @param compactDerivation: Optional. If True, derivations are performed on (and return) a CompactParametricString, which uses much less memory.
+        @type compactDerivation: bool
+
+        @param sharedDerivation: Optional. If True, iterate returns a SharedParametricString, in which identical expansions are computed and stored only once.
+        @type sharedDerivation: bool
+
+        @param checkpoints: Optional. If not None, the pStrings derived at each step are kept there, and later derivations go on from them (see iterate_loop).
+        @type checkpoints: DerivationCheckpoints
+
+        @param parallelRewriter: Optional. If not None, large compact pStrings are rewritten in parallel by its worker processes (see ParallelRewriter).
+        @type parallelRewriter: ParallelRewriter
+
+        @param mappedDirectory: Optional. If not None, derivations are performed out of core: each step is written to memory-mapped files in this directory,
+        and iterate returns a MappedParametricString (see MappedParametricString).
+        @type mappedDirectory: str
         """
         self.verbose = verbose
+        self.compactDerivation = compactDerivation
+        self.sharedDerivation = sharedDerivation
+        self.checkpoints = checkpoints
+        self.parallelRewriter = parallelRewriter
+        self.mappedDirectory = mappedDirectory
+        self.version = 0
 
         # Empty LSystem
         self.clear()
@@ -57,19 +114,93 @@ class ParametricLSystem:
         self.clearProductions()
         self.niterations = 1
         self.resultPString = None
+        self.resultVersion = None
+        self.resultBudget = None
+        self.setErasedLetters([])
 
     def clearProductions(self):
         self.productions = []
+        self.sharedProductions = set()  # Productions that are also used by copies of this lsystem
+        self.version += 1
+
+    @property
+    def axiom(self):
+        return self._axiom
+
+    @axiom.setter
+    def axiom(self,pstring):
+        self._axiom = pstring
+        self.version += 1
+
+    def setErasedLetters(self,letters,keptCharacters = ""):
+        """
+        Modules with the given letters are removed from the derived pString, once all steps are applied (see GrammarOptimizer).
+
+        @param letters: The letters to remove
+        @param keptCharacters: Optional. A module is kept anyway if its text form contains any of these characters
+        """
+        self.erasedLetters = frozenset(letters)
+        self.keptCharacters = frozenset(keptCharacters)
+        self.version += 1
+
+    def isErasedModule(self,m):
+        """ True if the module is removed from the derived pString (see setErasedLetters) """
+        if m.letter not in self.erasedLetters: return False
+        if len(m.params) == 0: return True
+        return not any(c in self.keptCharacters for c in str(m))
+
+    def eraseModules(self,pString):
+        """
+        Returns a copy of a derived pString without the modules removed by setErasedLetters.
+        """
+        if isinstance(pString,CompactParametricString):
+            mapped = isinstance(pString,MappedParametricString)
+            erasedPString = MappedParametricString(self.mappedDirectory) if mapped else CompactParametricString()
+            erasedPString.setGlobals(pString.globalDefines)
+            values = pString.values
+            offsets = pString.offsets
+            for start in range(0,len(pString),MappedParametricString.READ_CHUNK_MODULES):
+                letters = pString.letters[start:start+MappedParametricString.READ_CHUNK_MODULES].decode('latin-1')
+                for j in range(len(letters)):
+                    i = start+j
+                    if letters[j] in self.erasedLetters:
+                        if offsets[i] == offsets[i+1]: continue
+                        if not any(c in self.keptCharacters for c in pString.modulesToString(i,i+1)): continue
+                    erasedPString.appendLetterAndValues(letters[j],values[offsets[i]:offsets[i+1]])
+            if mapped:
+                pString.close()
+                erasedPString.finish()
+            return erasedPString
+        erasedPString = ParametricString()
+        erasedPString.setGlobals(pString.globalDefines)
+        erasedPString.modulesList = [m for m in pString.modulesList if not self.isErasedModule(m)]
+        return erasedPString
+
+    def isStochastic(self):
+        """ True if some production is stochastic, so that each derivation may give a different pString """
+        return any(prod.condition.type == "#" for prod in self.productions)
+
+    def getVersion(self):
+        """
+        Returns the version of this lsystem, of its axiom and of its productions.
+        The version changes whenever any of them is modified, so that results computed for a version can be kept until it changes.
+        @note: Copies of a lsystem start with the same version.
+        @rtype: tuple
+        """
+        return (self.version,
+                (self.axiom.version if self.axiom is not None else None),
+                tuple([(prod.version, (prod.successor.version if prod.successor is not None else None)) for prod in self.productions]))
 
     def setIterations(self,niterations):
         """
         Defines the number of iterations for this L-System.
-        @warning: Do not put a high number here, or the system will take AGES to iterate
+        @warning: Do not put a high number here, or the system will take AGES to iterate (unless iterating with a DerivationBudget)
 
         @param niterations: The number of iterations to perform
         @type niterations: int
         """
         self.niterations = niterations
+        self.version += 1
 
     #################
     # Globals
@@ -86,7 +217,9 @@ class ParametricLSystem:
         @param value: The value of the global define
         @type value: float
         """
+        self.globalDefines = dict(self.globalDefines)     # Copies may still use the old defines
         self.globalDefines[name] = value
+        self.version += 1
         self.refreshGlobals()
         return name,value
 
@@ -95,14 +228,16 @@ class ParametricLSystem:
         Overrides an existing global parameter.
         """
         if name in self.globalDefines:
+            self.globalDefines = dict(self.globalDefines)     # Copies may still use the old defines
             self.globalDefines[name] = value
+            self.version += 1
             self.refreshGlobals()
         else:
             raise Exception("Trying to override inexistent define!")
 
     def refreshGlobals(self):
-        if self.axiom is not None: self.axiom.setGlobals(self.globalDefines)
-        for prod in self.productions: prod.setGlobals(self.globalDefines)
+        if self.axiom is not None: self.getModifiableAxiom().setGlobals(self.globalDefines)
+        for i in range(len(self.productions)): self.getModifiableProduction(i).setGlobals(self.globalDefines)
 
 
     #################
@@ -117,6 +252,7 @@ class ParametricLSystem:
         newPString = ParametricString.fromTextString(textString)
         newPString.setGlobals(self.globalDefines)
         self.axiom = newPString
+        self.sharedAxiom = False
 
     def setAxiomFromPstring(self,pstring):
         """
@@ -125,6 +261,19 @@ class ParametricLSystem:
         """
         pstring.setGlobals(self.globalDefines)
         self.axiom = pstring
+        self.sharedAxiom = False
+
+    def getModifiableAxiom(self):
+        """
+        Returns the axiom, ready to be modified in place.
+        If the axiom is shared with a copy of this lsystem, it is duplicated first.
+        """
+        if self.sharedAxiom:
+            self.axiom = ParametricString.copyFrom(self.axiom)
+            self.axiom.setGlobals(self.globalDefines)
+            self.sharedAxiom = False
+        self.version += 1
+        return self.axiom
 
     def addNewProduction(self):
         """
@@ -133,6 +282,7 @@ class ParametricLSystem:
         newProduction = ParametricProduction()
         newProduction.setGlobals(self.globalDefines)
         self.productions.append(newProduction)
+        self.version += 1
         return newProduction
 
     def addProductionFromString(self,string):
@@ -155,13 +305,36 @@ class ParametricLSystem:
     def addExistingProduction(self,prod):
         prod.setGlobals(self.globalDefines)
         self.productions.append(prod)
+        self.version += 1
 
     def overrideProduction(self,i,pre,cond,sub):
-        self.productions[i].setElements(pre,cond,sub)
+        self.getModifiableProduction(i).setElements(pre,cond,sub)
 
     def getProduction(self,i):
+        """ Returns a production. It may be shared with copies of this lsystem: do not modify it (see getModifiableProduction). """
         return self.productions[i]
 
+    def getModifiableProduction(self,i):
+        """
+        Returns a production, ready to be modified in place.
+        If the production is shared with a copy of this lsystem, it is duplicated first.
+        """
+        prod = self.productions[i]
+        if prod in self.sharedProductions:
+            self.sharedProductions.discard(prod)
+            prod = ParametricProduction.copyFrom(prod)
+            prod.setGlobals(self.globalDefines)
+            self.productions[i] = prod
+        self.version += 1
+        return prod
+
+    def removeProduction(self,i):
+        """ Removes a production, and returns it. """
+        prod = self.productions.pop(i)
+        self.sharedProductions.discard(prod)
+        self.version += 1
+        return prod
+
     def getProductionWithPredecessorLetter(self, letter):
         for prod in self.productions:
             if prod.predecessor.letter == letter:
@@ -169,95 +342,536 @@ class ParametricLSystem:
         return None
 
     def copyProductionFromExisting(self,old_prod):
-        new_prod = self.addProductionFromString(str(old_prod)) # This will copy the production, since we convert to string and back!
+        new_prod = ParametricProduction.copyFrom(old_prod)
+        self.addExistingProduction(new_prod)
 
         # We also make sure that the defines are consistent
-        new_prod.extendGlobalDefines(old_prod.globalDefines)
+        extendedDefines = dict(self.globalDefines)
+        extendedDefines.update(old_prod.globalDefines)
+        if extendedDefines != self.globalDefines:
+            self.globalDefines = extendedDefines
+            self.refreshGlobals()
+
+    def getDerivationKey(self):
+        """
+        Returns a key that identifies the structure of this lsystem (axiom, productions and global defines, but not the iterations),
+        so that two lsystems with the same key derive the same pStrings.
+        """
+        defines = ",".join([k + "=" + str(self.globalDefines[k]) for k in sorted(self.globalDefines.keys())])
+        productions = "||".join([prod.toGenomeRepresentation() for prod in self.productions])
+        return ("C" if self.compactDerivation else "") + str(self.axiom) + "||" + productions + "||" + defines
+
+    def iterate_loop(self, N, budget = None):
+        """
+        Derives the pString in N steps, one rewriting pass for each step.
 
-    def iterate_loop(self, N):
+        With checkpoints, the derivation starts from the latest pString derived at a step not after N for the same grammar,
+        and the pStrings derived at each step are stored. Stochastic grammars are never checkpointed, since each derivation draws its own productions.
+        @note: With checkpoints, the returned pString shares its modules with them: do not modify the modules in place.
+
+        With a parallelRewriter, steps whose input is large enough are rewritten in parallel (see ParallelRewriter.canRewrite).
+        A ParametricString is then converted to a compact one for the remaining steps, and converted back at the end.
+
+        Out of core (see mappedDirectory), each step reads the pString of the previous step from its memory-mapped files, and writes its own files sequentially.
+        The files of each step are removed as soon as the next step is written. Checkpoints and parallel rewriting are not used.
+        """
         if N is None: N = self.niterations
-        currentParametricString = ParametricString.copyFrom(self.axiom) # We create a copy so to not modify the axiom
-        #self.axiom.evaluateDefines()
-        #print(self)
-        #print(self.globalDefines)
-        for i in range(N):
+        startTime = time.time()
+        mapped = self.mappedDirectory is not None
+        compact = self.compactDerivation or mapped
+        moduleBytes = DerivationBudget.COMPACT_MODULE_BYTES if compact else DerivationBudget.OBJECT_MODULE_BYTES
+
+        checkpoints = self.checkpoints
+        if checkpoints is not None and self.isStochastic(): checkpoints = None
+        if mapped: checkpoints = None
+        startStep, currentParametricString = 0, None
+        if checkpoints is not None:
+            derivationKey = self.getDerivationKey()
+            startStep, currentParametricString = checkpoints.getLatest(derivationKey,N)
+            if currentParametricString is not None and budget is not None:
+                exceeded = budget.check(startTime,startStep-1,len(currentParametricString),moduleBytes)
+                if exceeded is not None: return exceeded
+        if currentParametricString is None:
+            # We create a copy so to not modify the axiom
+            if compact: currentParametricString = CompactParametricString.fromParametricString(self.axiom)
+            else: currentParametricString = ParametricString.copyFrom(self.axiom)
+
+        # Each derivation draws from its own random stream
+        context = self.createDerivationContext(random.Random(self.rnd.random()))
+
+        for i in range(startStep,N):
             if self.verbose: print("\nStep " + str(i+1))
-            currentParametricString.resetConversions()
-            # All productions are applied in parallel
-            for prod in self.productions:
-                if self.verbose: print("Rule: " + str(prod))
-                result = prod.check(currentParametricString,self.rnd)
-                #print("Rule evaluates: " +  str(result))
-                if result:  currentParametricString = prod.convert(currentParametricString)
+            # All productions are applied in parallel, rewriting the string in a single pass
+            checkBudget = None
+            if budget is not None: checkBudget = lambda nModules, step = i: budget.check(startTime,step,nModules,moduleBytes)
+            if mapped:
+                inputPString = currentParametricString
+                outputPString = MappedParametricString(self.mappedDirectory)
+                outputPString.setGlobals(inputPString.globalDefines)
+                currentParametricString = self.rewriteCompact(inputPString,context,checkBudget,outputPString)
+                if isinstance(inputPString,MappedParametricString): inputPString.close()
+                if isinstance(currentParametricString,BudgetExceededResult): outputPString.close()
+                else: outputPString.finish()
+            elif self.parallelRewriter is not None and self.parallelRewriter.canRewrite(self,currentParametricString):
+                if not isinstance(currentParametricString,CompactParametricString):
+                    # Large pStrings are derived compactly from here on, so that the workers can share them
+                    currentParametricString = CompactParametricString.fromParametricString(currentParametricString)
+                    compact, moduleBytes, checkpoints = True, DerivationBudget.COMPACT_MODULE_BYTES, None
+                currentParametricString = self.parallelRewriter.rewrite(self,currentParametricString,checkBudget)
+            else:
+                currentParametricString = self.rewrite(currentParametricString,context,checkBudget)
+            if isinstance(currentParametricString,BudgetExceededResult):
+                if self.verbose: print(str(currentParametricString))
+                return currentParametricString
             if self.verbose: print("String at step " + str(i+1) + " is " + str(currentParametricString))
-            ParametricProduction.resetStochasticState()
+            if checkpoints is not None: checkpoints.store(derivationKey,i+1,currentParametricString,moduleBytes)
+
+        # The checkpoint is kept as it is. Its modules can be shared, since evaluateDefines replaces modules instead of changing them.
+        if checkpoints is not None and N > 0:
+            if self.compactDerivation: currentParametricString = CompactParametricString.copyFrom(currentParametricString)
+            else:
+                checkpointPString = currentParametricString
+                currentParametricString = ParametricString()
+                currentParametricString.setGlobals(checkpointPString.globalDefines)
+                currentParametricString.modulesList = list(checkpointPString.modulesList)
+        if compact and not self.compactDerivation and not mapped:
+            # The derivation switched to compact pStrings for parallel rewriting
+            compactPString = currentParametricString
+            currentParametricString = ParametricString()
+            currentParametricString.setGlobals(compactPString.globalDefines)
+            currentParametricString.modulesList = compactPString.modulesList
         currentParametricString.evaluateDefines()
+        if self.erasedLetters: currentParametricString = self.eraseModules(currentParametricString)
         return currentParametricString
 
+    def createDerivationContext(self,rnd = None):
+        """
+        Creates the state of a new derivation. The productions that may rewrite each letter are found once, since conditions are checked for each module.
+
+        @param rnd: Optional. The random generator of the derivation, needed by stochastic productions
+        @type rnd: random.Random
+
+        @rtype: DerivationContext
+        """
+        for prod in self.productions: prod.compileSuccessor()
+        chosenProductions, productionTables = self.chooseProductions(self.buildProductionsTable())
+        return DerivationContext(chosenProductions,productionTables,rnd)
+
+    def buildProductionsTable(self):
+        """
+        Groups the productions by the letter of their predecessor, in order.
+
+        @return: A dictionary from a predecessor letter to the list of productions with that predecessor
+        @rtype: dict
+        """
+        productionsTable = {}
+        for prod in self.productions:
+            letter = prod.predecessor.letter
+            if letter in ('[',']'): continue     # Brackets are never rewritten
+            if letter not in productionsTable: productionsTable[letter] = []
+            productionsTable[letter].append(prod)
+        return productionsTable
+
+    def chooseProductions(self,productionsTable):
+        """
+        Chooses what production rewrites each letter.
+        The first production whose condition holds is used, as if productions were applied one after the other.
+        If that depends on the rewritten module, the productions of the letter are instead gathered in a table that chooses for each module:
+        a StochasticProductionTable if they are stochastic (with the following production as fallback),
+        or a ConditionalProductionTable if some have parametric conditions.
+
+        @return: A dictionary from a predecessor letter to the chosen production, and one from a predecessor letter to its table
+        @rtype: tuple
+        """
+        chosenProductions = {}
+        productionTables = {}
+        for letter, prods in productionsTable.items():
+            if self.verbose: print("Rules for " + letter + ": " + ", ".join([str(prod) for prod in prods]))
+            prods = ParametricLSystem.getUsedProductions(prods)
+            if prods[0].condition.type == "*":
+                chosenProductions[letter] = prods[0]
+            elif any(prod.condition.type == "P" for prod in prods):
+                table = ConditionalProductionTable()
+                for prod in prods: table.addProduction(prod)
+                productionTables[letter] = table
+            else:
+                table = StochasticProductionTable()
+                for prod in prods:
+                    if prod.condition.type == "#": table.addProduction(prod)
+                    else: table.fallbackProduction = prod
+                productionTables[letter] = table
+        return chosenProductions, productionTables
+
+    @staticmethod
+    def getUsedProductions(prods):
+        """
+        @param prods: The productions of a letter, in order
+        @return: The productions that may be used: those after the first one that always holds are never used
+        @rtype: list
+        """
+        for n in range(len(prods)):
+            if prods[n].condition.type == "*": return prods[:n+1]
+        return prods
+
+    def rewrite(self,inputPString,context,checkBudget = None):
+        """
+        Rewrites a pString in a single pass, creating a new pString.
+
+        @param inputPString: The pString to rewrite. It is not modified.
+        @type inputPString: ParametricString
+
+        @param context: The state of the derivation, with the production to use for each letter.
+        @type context: DerivationContext
+
+        @param checkBudget: Optional. Called with the number of output modules every DerivationBudget.CHECK_INTERVAL input modules. If it returns a result, the rewriting is stopped.
+        @type checkBudget: function
+
+        @return: The rewritten pString, or the result of checkBudget if the rewriting was stopped
+        @rtype: ParametricString or BudgetExceededResult
+        """
+        if isinstance(inputPString,CompactParametricString): return self.rewriteCompact(inputPString,context,checkBudget)
+
+        chosenProductions = context.chosenProductions
+        productionTables = context.productionTables
+        rnd = context.rnd
+
+        chunkSize = DerivationBudget.CHECK_INTERVAL if checkBudget is not None else max(1,len(inputPString))
+        outputModules = []
+        append = outputModules.append
+        inputModules = iter(inputPString.modulesList)
+        for start in range(0,len(inputPString),chunkSize):
+            for inputModule in islice(inputModules,chunkSize):
+                prod = chosenProductions.get(inputModule.letter)
+                if prod is None and productionTables:
+                    table = productionTables.get(inputModule.letter)
+                    if table is not None: prod = table.choose(inputModule.params,rnd)
+                if prod is None: append(inputModule)
+                else: prod.rewrite(inputModule,outputModules)
+            if checkBudget is not None:
+                exceededResult = checkBudget(len(outputModules))
+                if exceededResult is not None: return exceededResult
+
+        outputPString = ParametricString()
+        outputPString.setGlobals(inputPString.globalDefines)
+        outputPString.modulesList = outputModules
+        return outputPString
+
+    def rewriteCompact(self,inputPString,context,checkBudget = None,outputPString = None):
+        """
+        Same as rewrite, for a CompactParametricString. Modules are never created: letters and values are read and written directly.
 
-    def iterate_wrapper(self, queue, N):
-        result = self.iterate_loop(N)
-        queue.put(result)
-        queue.close()
+        @param outputPString: Optional. The empty pString the rewritten modules are appended to (a MappedParametricString, for example). Defaults to a new CompactParametricString.
+        @type outputPString: CompactParametricString
 
-    def iterate(self,N = None):
+        @rtype: CompactParametricString or BudgetExceededResult
+        """
+        chosenProductions = context.chosenProductions
+        productionTables = context.productionTables
+        rnd = context.rnd
+        if outputPString is None:
+            outputPString = CompactParametricString()
+            outputPString.setGlobals(inputPString.globalDefines)
+        append = outputPString.appendLetterAndValues
+        nModules = len(inputPString)
+        values = inputPString.values
+        offsets = inputPString.offsets
+        chunkSize = DerivationBudget.CHECK_INTERVAL if checkBudget is not None else max(1,nModules)
+        if isinstance(inputPString,MappedParametricString): chunkSize = min(chunkSize,MappedParametricString.READ_CHUNK_MODULES)
+        for start in range(0,nModules,chunkSize):
+            # Letters are decoded a chunk at a time, so that a mapped pString is never loaded at once
+            letters = inputPString.letters[start:start+chunkSize].decode('latin-1')
+            for j in range(len(letters)):
+                i = start+j
+                prod = chosenProductions.get(letters[j])
+                if prod is None and productionTables:
+                    table = productionTables.get(letters[j])
+                    if table is not None: prod = table.choose(values[offsets[i]:offsets[i+1]],rnd)
+                if prod is None: append(letters[j],values[offsets[i]:offsets[i+1]])
+                else: prod.rewriteValues(values[offsets[i]:offsets[i+1]],outputPString)
+            if checkBudget is not None:
+                exceededResult = checkBudget(len(outputPString))
+                if exceededResult is not None: return exceededResult
+        return outputPString
+
+    def iterate(self,N = None,budget = None):
         """
         Perform a set of iterations of the L-System
 
         @param N: Number of iterations
         @type N: int
 
-        @return: A pstring representing the resulting L-System output
-        @rtype: ParametricString
+        @param budget: Optional. Limits of the derivation. If any is exceeded, the derivation is stopped.
+        @type budget: DerivationBudget
+
+        @return: A pstring representing the resulting L-System output, or the reason why the budget was exceeded
+        @rtype: ParametricString or BudgetExceededResult
         """
-        result = self.iterate_loop(N)
+        if self.sharedDerivation: result = self.iterateShared(N,budget)
+        else: result = self.iterate_loop(N,budget)
         #self.writeToFile()
 
-        #TODO: We need a timeout for really long executions, but it won't work because it opens another blender instance! Fix this!
+        return result
+
+    def iterateModules(self,N = None):
         """
-        queue = multiprocessing.Queue(1) # Maximum size is 1
-        proc = multiprocessing.Process(target=self.iterate_wrapper, args=(self, queue, N))
-        proc.start()
+        Perform a set of iterations of the L-System, yielding the modules of the resulting pString one at a time.
+        Each module of the axiom is expanded depth-first, so the resulting pString is never stored:
+        only the successors along the current derivation path are kept in memory.
+        The modules are the same, and in the same order, as those of the pString returned by iterate.
+
+        @note: Stochastic productions are chosen for each module in the order of the string, so with them the string is derived as usual.
 
-        # Wait for TIMEOUT seconds
+        @param N: Number of iterations
+        @type N: int
+
+        @return: A generator of the modules of the resulting pString
+        @rtype: generator of ParametricModule
+        """
+        if N is None: N = self.niterations
+
+        if self.isStochastic():
+            for m in self.iterate_loop(N): yield m
+            return
+
+        context = self.createDerivationContext()
+
+        # Stack of (modules still to expand, number of steps already applied to them)
+        stack = [(iter(self.axiom.modulesList),0)]
+        while len(stack) > 0:
+            modules, depth = stack[-1]
+            for m in modules:
+                # A module not rewritten at a step is kept as it is, so it is not rewritten at the later steps either
+                prod = None
+                if depth < N: prod = context.chooseProduction(m.letter,m.params)
+                if prod is not None:
+                    outputModules = []
+                    prod.rewrite(m,outputModules)
+                    stack.append((iter(outputModules),depth+1))
+                    break
+                if len(stack) == 1: m = self.copyAxiomModule(m)
+                if self.erasedLetters and self.isErasedModule(m): continue
+                yield m
+            else:
+                stack.pop()
+
+    def iterateShared(self,N = None,budget = None):
+        """
+        Perform a set of iterations of the L-System, sharing identical expansions.
+        Each (module, step) pair is expanded only once: all modules with the same letter and parameters at the same step share the same DerivationNode.
+        For branching systems this takes about linear time and memory instead of exponential.
+
+        @note: Stochastic productions expand identical modules differently, so with them the string is derived as usual.
+
+        @param N: Number of iterations
+        @type N: int
+
+        @param budget: Optional. Limits of the derivation. The number of modules is that of the resulting pString, as if it was not shared.
+        @type budget: DerivationBudget
+
+        @return: A pstring representing the resulting L-System output, or the reason why the budget was exceeded
+        @rtype: SharedParametricString (ParametricString when falling back) or BudgetExceededResult
+        """
+        if N is None: N = self.niterations
+
+        if self.isStochastic():
+            return self.iterate_loop(N,budget)
+
+        startTime = time.time()
+        context = self.createDerivationContext()
+        expansions = {}    # (letter, parameters, step) -> DerivationNode
+
+        def expand(m,step):
+            # A module not rewritten at a step is kept as it is, so it is not rewritten at the later steps either
+            prod = None
+            if step < N: prod = context.chooseProduction(m.letter,m.params)
+            if prod is None:
+                if self.erasedLetters and self.isErasedModule(m): return None
+                return m
+            key = (m.letter,tuple(m.params),step)
+            node = expansions.get(key)
+            if node is None:
+                outputModules = []
+                prod.rewrite(m,outputModules)
+                node = DerivationNode([child for child in [expand(output_m,step+1) for output_m in outputModules] if child is not None])
+                expansions[key] = node
+                if budget is not None:
+                    exceededResult = budget.check(startTime,step,node.length)
+                    if exceededResult is not None: raise BudgetExceededError(exceededResult)
+            return node
+
+        children = []
         try:
-            result = queue.get(True, TIMEOUT)
-        except Queue.Empty:
-            # Deal with lack of data somehow
-            result = None
-            print("TIMEOUT reached! The pString is too long!")
-        finally:
-            proc.terminate()
-            """
+            for m in self.axiom:
+                child = expand(m,0)
+                if child is None: continue
+                if child is m: child = self.copyAxiomModule(m)
+                children.append(child)
+        except BudgetExceededError as e:
+            if self.verbose: print(str(e.result))
+            return e.result
+        result = SharedParametricString(DerivationNode(children))
+        result.setGlobals(self.globalDefines)
         return result
 
+    def iterateVariants(self,K,N = None,budget = None):
+        """
+        Derives K stochastic variants of the L-System at once. Variant k is the same pString that the k-th of K successive calls to iterate would return,
+        since each variant draws its own random stream from the lsystem's random generator.
+
+        The variants share their deterministic expansions, and fork only at stochastic choices.
+        Each variant is a list of segments (runs of modules) shared with the other variants. At each step:
+            - a segment without stochastic modules is rewritten once, for all the variants that contain it.
+            - in the other segments, each run of deterministic modules is rewritten once, while each stochastic module draws a production
+              from each variant's random stream, and is rewritten once for each chosen production.
+        For deterministic lsystems, all variants are the same, and they are derived only once.
+        Once the variants share less than half of their modules, the remaining steps of each variant are derived separately (see rewrite),
+        so grammars that are stochastic almost everywhere are not slower than K derivations.
+
+        @note: The variants share their modules: do not modify the modules in place. Variants are always ParametricString.
+
+        @param K: Number of variants
+        @type K: int
+
+        @param N: Number of iterations
+        @type N: int
+
+        @param budget: Optional. Limits of the derivation of each variant, checked after each step. A variant that exceeds it is not derived further.
+        @type budget: DerivationBudget
+
+        @return: A pString for each variant, or the reason why its budget was exceeded
+        @rtype: list of ParametricString or BudgetExceededResult
+        """
+        if N is None: N = self.niterations
+        startTime = time.time()
+        context = self.createDerivationContext()
+        stochasticLetters = set([letter for letter, table in context.productionTables.items()
+                                 if isinstance(table,StochasticProductionTable) or table.stochastic])
+        rnds = [random.Random(self.rnd.random()) for k in range(K)]
+
+        def createSegment(modules):
+            """ A segment is a tuple of modules, with the indices of its stochastic modules """
+            return (modules,tuple([i for i in range(len(modules)) if modules[i].letter in stochasticLetters]))
+
+        def rewriteRun(modules,start,end):
+            """ Rewrites the deterministic modules from start to end (excluded) """
+            outputModules = []
+            for m in modules[start:end]:
+                prod = context.chooseProduction(m.letter,m.params)
+                if prod is None: outputModules.append(m)
+                else: prod.rewrite(m,outputModules)
+            return createSegment(tuple(outputModules))
+
+        def rewriteModule(m,prod):
+            """ Rewrites a stochastic module with the chosen production """
+            if prod is None: return createSegment((m,))
+            outputModules = []
+            prod.rewrite(m,outputModules)
+            return createSegment(tuple(outputModules))
+
+        axiomSegment = createSegment(tuple(self.axiom.modulesList))
+        variants = [[axiomSegment] for k in range(K)]
+        results = [None]*K
+        step = 0
+        while step < N:
+            # Rewritten segments, by the identity of the rewritten modules (the previous segments are alive until the end of the step)
+            rewrittenSegments = {}
+            def getRewrittenSegment(key,rewrite):
+                segment = rewrittenSegments.get(key)
+                if segment is None:
+                    segment = rewrite()
+                    rewrittenSegments[key] = segment
+                return segment
+
+            newVariants = []
+            for k in range(K):
+                if results[k] is not None:
+                    newVariants.append(None)
+                    continue
+                newSegments = []
+                for modules, stochasticIndices in variants[k]:
+                    runStart = 0
+                    for i in stochasticIndices:
+                        if runStart < i: newSegments.append(getRewrittenSegment((id(modules),runStart,i),lambda: rewriteRun(modules,runStart,i)))
+                        m = modules[i]
+                        prod = context.productionTables[m.letter].choose(m.params,rnds[k])
+                        newSegments.append(getRewrittenSegment((id(modules),i,prod),lambda: rewriteModule(m,prod)))
+                        runStart = i+1
+                    if runStart < len(modules): newSegments.append(getRewrittenSegment((id(modules),runStart,len(modules)),lambda: rewriteRun(modules,runStart,len(modules))))
+                newVariants.append(newSegments)
+                if budget is not None:
+                    exceededResult = budget.check(startTime,step,sum([len(segment[0]) for segment in newSegments]))
+                    if exceededResult is not None: results[k] = exceededResult
+            variants = newVariants
+            step += 1
+
+            # Once the variants share little, splitting them in segments costs more than it saves
+            distinctModules = dict([(id(segment[0]),len(segment[0])) for segments in variants if segments is not None for segment in segments])
+            totalModules = sum([len(segment[0]) for segments in variants if segments is not None for segment in segments])
+            if totalModules < 2*sum(distinctModules.values()): break
+
+        for k in range(K):
+            if results[k] is not None: continue
+            pString = ParametricString()
+            pString.setGlobals(self.axiom.globalDefines)
+            pString.modulesList = list(chain.from_iterable([segment[0] for segment in variants[k]]))
+            # The remaining steps are derived separately, with the same random stream
+            variantContext = DerivationContext(context.chosenProductions,context.productionTables,rnds[k])
+            for i in range(step,N):
+                checkBudget = None
+                if budget is not None: checkBudget = lambda nModules, step = i: budget.check(startTime,step,nModules)
+                pString = self.rewrite(pString,variantContext,checkBudget)
+                if isinstance(pString,BudgetExceededResult): break
+            if isinstance(pString,BudgetExceededResult):
+                results[k] = pString
+                continue
+            pString.evaluateDefines()
+            if self.erasedLetters: pString = self.eraseModules(pString)
+            results[k] = pString
+        return results
+
+    def copyAxiomModule(self,m):
+        """ Copies a module of the axiom (so to not modify the axiom), evaluating its defines """
+        return ParametricModule.fromValues(m.letter,[(self.globalDefines[v] if v in self.globalDefines else v) for v in m.params])
+
     def __str__(self):
-        s = ""
-        s += "\nw " + str(self.axiom)
+        buffer = io.StringIO()
+        self.writeTo(buffer)
+        return buffer.getvalue()
+
+    def writeTo(self,fileLike):
+        """
+        Writes the text form of this lsystem (see __str__) to a file-like object.
+        The axiom and the successors are streamed, see ParametricString.writeTo.
+        """
+        fileLike.write("\nw ")
+        if self.axiom is None: fileLike.write(str(self.axiom))
+        else: self.axiom.writeTo(fileLike)
         for prod in self.productions:
-            s += "\n" + str(prod)
-        if len(self.globalDefines.keys()) > 0: s += "\n"
-        for k in self.globalDefines.keys():
-            s += "(" + k + " = " + str(self.globalDefines[k]) +") "
-        return s
+            fileLike.write("\n")
+            prod.writeTo(fileLike)
+        if len(self.globalDefines.keys()) > 0: fileLike.write("\n")
+        fileLike.write("".join(["(" + k + " = " + str(self.globalDefines[k]) +") " for k in self.globalDefines.keys()]))
 
     def writeToFile(self):
         #filepath = os.path.abspath("exported_lsystem.txt")
         filepath = OUTOUT_PATH + "exported_lsystem.txt"
-        file = open(filepath, 'w')
-        file.write(str(self))
-        file.close()
+        with open(filepath, 'w') as file:
+            self.writeTo(file)
 
 
     def toGenomeRepresentation(self):
         """ Defines compactly a complete lsystem """
-        s = ""
-        s += str(self.axiom)
-        s += "||"+str(self.niterations) # The iterations must be shown as well
+        # The iterations must be shown as well
+        return "||".join([str(self.axiom), str(self.niterations)] + [prod.toGenomeRepresentation() for prod in self.productions])
+
+    def writeGenomeRepresentation(self,fileLike):
+        """ Writes the genome representation (see toGenomeRepresentation) to a file-like object, without building it """
+        if self.axiom is None: fileLike.write(str(self.axiom))
+        else: self.axiom.writeTo(fileLike)
+        fileLike.write("||"+str(self.niterations))
         for prod in self.productions:
-            s += "||"
-            s += prod.toGenomeRepresentation()
-        return s
+            fileLike.write("||")
+            prod.writeGenomeRepresentation(fileLike)
 
     def fromGenomeRepresentation(self,genome):
         """ Defines compactly a complete lsystem """
@@ -270,25 +884,53 @@ class ParametricLSystem:
 
     @staticmethod
     def copyFrom(other_pSystem):
-        new_pSystem = ParametricLSystem(other_pSystem.randomSeed)
+        """
+        Copies a lsystem and returns the copy.
+        The axiom and the productions are shared between the two lsystems until either modifies them (see getModifiableProduction),
+        so copying costs almost nothing.
+        """
+        new_pSystem = ParametricLSystem(other_pSystem.randomSeed, compactDerivation = other_pSystem.compactDerivation, sharedDerivation = other_pSystem.sharedDerivation, checkpoints = other_pSystem.checkpoints, parallelRewriter = other_pSystem.parallelRewriter, mappedDirectory = other_pSystem.mappedDirectory)
         new_pSystem.setIterations(other_pSystem.niterations)
 
-        for def_name in list(other_pSystem.globalDefines.keys()):
-            new_pSystem.addGlobalDefine(def_name,other_pSystem.globalDefines[def_name])
-        for prod in list(other_pSystem.productions):
-            new_pSystem.copyProductionFromExisting(prod)
+        new_pSystem.globalDefines = dict(other_pSystem.globalDefines)
+
+        other_pSystem.sharedProductions.update(other_pSystem.productions)
+        new_pSystem.productions = list(other_pSystem.productions)
+        new_pSystem.sharedProductions = set(other_pSystem.productions)
 
-        new_pSystem.setAxiomFromString(str(other_pSystem.axiom))
+        other_pSystem.sharedAxiom = True
+        new_pSystem.axiom = other_pSystem.axiom
+        new_pSystem.sharedAxiom = True
+
+        new_pSystem.setErasedLetters(other_pSystem.erasedLetters,other_pSystem.keptCharacters)
+
+        # The copy is the same lsystem, so it also shares the result
+        new_pSystem.version = other_pSystem.version
+        new_pSystem.resultPString = other_pSystem.resultPString
+        new_pSystem.resultVersion = other_pSystem.resultVersion
+        new_pSystem.resultBudget = other_pSystem.resultBudget
         return new_pSystem
 
-    def getResultPString(self):
-        """ Returns the pString that results from iterating this lsystem. Computes it, if needed. """
-        # TODO: WARNING!!! Make sure the resultPstring is emptied if we do some modification to the lsystem!! OR THIS WILL BEHAVE INCORRECTLY!
-        if self.resultPString == None:  self.resultPString = self.iterate()
+    def getResultPString(self,budget = None):
+        """
+        Returns the pString that results from iterating this lsystem. Computes it, if needed.
+        With a budget, this may be a BudgetExceededResult instead (see iterate).
+        The result is kept until the lsystem is modified (see getVersion).
+        A BudgetExceededResult is kept only for budgets within the one that was exceeded:
+        with a larger budget, or no budget, the lsystem is derived again.
+        """
+        version = self.getVersion()
+        if self.resultPString is None or self.resultVersion != version or \
+            (isinstance(self.resultPString, BudgetExceededResult) and (budget is None or not budget.isWithin(self.resultBudget))):
+            self.resultPString = self.iterate(budget = budget)
+            self.resultVersion = version
+            self.resultBudget = budget
         return self.resultPString
 
     def clearResultPString(self):
         self.resultPString = None
+        self.resultVersion = None
+        self.resultBudget = None
 
     def printGlobalDefinesStatus(self):
         print("Global defines status:")
@@ -323,8 +965,8 @@ if __name__ == "__main__":
     import timeit
 
     numberOfTests = 1
-    time = timeit.timeit("test()", setup="from __main__ import test", number=numberOfTests)/numberOfTests
-    print("Average time for " + str(numberOfTests) + " test iterations: " + str(time))
+    averageTime = timeit.timeit("test()", setup="from __main__ import test", number=numberOfTests)/numberOfTests
+    print("Average time for " + str(numberOfTests) + " test iterations: " + str(averageTime))
 
     ######################
     # Specific tests
@@ -357,4 +999,83 @@ if __name__ == "__main__":
     print("\nCheck all global defines")
     pl.printGlobalDefinesStatus()
 
+    print("\nIterate modules depth-first (same result as iterate)")
+    pl = ParametricLSystem(randomSeed=3)
+    pl.setAxiomFromString("A(1)")
+    pl.addProductionFromString("A(x):0.5->F(x)[+A(x*0.5)]A(x*0.9)")
+    pl.addProductionFromString("A(x):0.5->F(x)[-A(x*0.5)]L")
+    pl.addProductionFromString("F(x):*->F(x*1.1)")
+    streamed = "".join([str(m) for m in pl.iterateModules(6)])
+    pl.rnd.seed(3)
+    print(streamed == str(pl.iterate(6)))
+
+    print("\nParametric conditions (checked for each module)")
+    conditional_pl = ParametricLSystem()
+    conditional_pl.setAxiomFromString("A(1)B(5)A(3)")
+    conditional_pl.addProductionFromString("A(x):x<2->A(x+1)F(x)")
+    conditional_pl.addProductionFromString("A(x):*->L(x)")
+    conditional_pl.addProductionFromString("B(x):x>4->B(x-1)[A(x*0.1)]")
+    print(conditional_pl.iterate(4))
+
+    print("\nCopy (shared until modified)")
+    pl.addGlobalDefine("d",0.5)
+    copied = ParametricLSystem.copyFrom(pl)
+    print("Same as original? " + str(str(copied) == str(pl)))
+    copied.getModifiableProduction(0).setConditionFromString("0.2")
+    copied.overrideGlobalDefine("d",0.7)
+    print("Copy: " + str(copied))
+    print("Original unchanged? " + str(copied.getProduction(0) is not pl.getProduction(0) and pl.getProduction(0).condition.value == 0.5 and pl.globalDefines["d"] == 0.5))
+
+    print("\nBenchmark copy")
+    import timeit
+    def copyByString(other):
+        new_pl = ParametricLSystem()
+        for k, v in other.globalDefines.items(): new_pl.addGlobalDefine(k,v)
+        for prod in other.productions:
+            new_prod = new_pl.addProductionFromString(str(prod))
+            new_prod.extendGlobalDefines(prod.globalDefines)
+        new_pl.setAxiomFromString(str(other.axiom))
+        return new_pl
+    print("Through strings: " + "{0:.6f}".format(timeit.timeit(lambda: copyByString(pl), number=1000)/1000) + "s")
+    print("Shared: " + "{0:.6f}".format(timeit.timeit(lambda: ParametricLSystem.copyFrom(pl), number=1000)/1000) + "s")
+
+    print("\nStochastic variants (same results as successive derivations)")
+    variants_pl = ParametricLSystem(randomSeed=5)
+    variants_pl.setAxiomFromString("A(1)B(1)")
+    variants_pl.addProductionFromString("A(x):0.5->F(x)[+(20)A(x*0.7)]F(x)A(x*0.9)")
+    variants_pl.addProductionFromString("A(x):0.3->F(x)[-(20)A(x*0.7)]A(x*0.9)")
+    variants_pl.addProductionFromString("B(x):x<4->F(x)[&(30)F(x)L(x)]B(x+1)")
+    variants_pl.addProductionFromString("F(x):*->F(x*1.1)")
+    variants_pl.niterations = 9
+    variants = ParametricLSystem.copyFrom(variants_pl).iterateVariants(8)
+    successive_pl = ParametricLSystem.copyFrom(variants_pl)
+    print(all(str(variant) == str(successive_pl.iterate()) for variant in variants))
+    print("Different variants: " + str(len(set([str(variant) for variant in variants]))))
+    print("Separate: " + "{0:.4f}".format(timeit.timeit(lambda: [successive_pl.iterate() for k in range(8)], number=1)) + "s")
+    print("Together: " + "{0:.4f}".format(timeit.timeit(lambda: successive_pl.iterateVariants(8), number=1)) + "s")
+
+    print("\nConcurrent derivations (same results as serial derivations)")
+    from concurrent.futures import ThreadPoolExecutor
+    lsystems = [pl, conditional_pl]
+    for seed in range(8):
+        stochastic_pl = ParametricLSystem(randomSeed=seed)
+        stochastic_pl.addGlobalDefine("d",0.5+seed*0.1)
+        stochastic_pl.setAxiomFromString("A(1)B(2)")
+        stochastic_pl.addProductionFromString("A(x):0.4->F(x)[+(20)A(x*d)B(x)]A(x)")
+        stochastic_pl.addProductionFromString("A(x):0.6->F(x)[-(20)A(x*d)]")
+        stochastic_pl.addProductionFromString("B(x):x<3->L(x)B(x+1)")
+        stochastic_pl.addProductionFromString("B(x):*->F(d)")
+        stochastic_pl.niterations = 7
+        lsystems.append(stochastic_pl)
+    for checkpoints in [None, DerivationCheckpoints()]:
+        copies = []
+        for l in lsystems*4:
+            copied = ParametricLSystem.copyFrom(l)
+            copied.checkpoints = checkpoints
+            copies.append(copied)
+        serialResults = [str(ParametricLSystem.copyFrom(l).iterate()) for l in copies]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            concurrentResults = list(executor.map(lambda l: str(ParametricLSystem.copyFrom(l).iterate()), copies))
+        print(("With" if checkpoints is not None else "Without") + " checkpoints: " + str(serialResults == concurrentResults))
+
     print("\nFinish testing  ParametricLSystem")
@@ -34,7 +34,6 @@ class ParametricModule:
         """
         if len(letter) > 1: raise Exception("Letter must be a single character!")
         self.letter = letter
-        self.ignoreConversion = False
         self.globalDefines = None
 
         # Copy the parameters. May be set if the symbol is parameterized. May be multiple parameters.
@@ -50,6 +49,21 @@ class ParametricModule:
         if params == [""]: params = []
         return ParametricModule(letter,params)
 
+    @staticmethod
+    def fromValues(letter,values):
+        """
+        Creates a 'valued' module from already evaluated parameters.
+        Faster than the constructor, since the parameters are not checked again.
+
+        @param values: The parameter values. The list is used directly, not copied.
+        @type values: list of float
+        """
+        module = ParametricModule.__new__(ParametricModule)
+        module.letter = letter
+        module.globalDefines = None
+        module.params = values
+        return module
+
     def setGlobals(self,globalDefines):
         self.globalDefines = globalDefines
 
@@ -72,15 +86,8 @@ class ParametricModule:
         return self.letter == ']'
 
     def __str__(self):
-        s = self.letter
-        if len(self.params)>0:
-            s += '('
-            for j in range(len(self.params)):
-                p = self.params[j]
-                s += str(p)
-                if j < len(self.params)-1: s += ','
-            s += ')'
-        return s
+        if len(self.params) == 0: return self.letter
+        return self.letter + '(' + ','.join([str(p) for p in self.params]) + ')'
 
     def evaluate(self,*values):
         """
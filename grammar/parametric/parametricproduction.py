@@ -19,6 +19,7 @@ from grammar.parametric.utilities import Utilities
 
 import operator
 import datetime
+from bisect import bisect_left
 
 class ParametricProductionPredecessor(ParametricModule):
     """
@@ -60,8 +61,9 @@ class ParametricProductionCondition:
         else:
             # Otherwise, this condition is a check on a parameter
             # Example production ---  A(x) : x > 1 -> B
-            # The input text is in the form: 'x>1'
+            # The input text is in the form: 'x>1' (or 'x > 1', as written by __str__)
             conditionType = 'P'
+            text = text.replace(" ","")
             conditionOperatorString = ""
             for i in range(len(text)):
                 c = text[i]
@@ -78,7 +80,7 @@ class ParametricProductionCondition:
                         #@note: THIS WILL WORK ONLY IF THE GLOBAL DEFINES ARE CREATED BEFORE THE PRODUCTIONS!
                         definedParam = text[i:len(text)]
                         if definedParam in defines:
-                            self.conditionValue = defines[definedParam]
+                            conditionValue = defines[definedParam]
                     break
                 else:
                     # We are building the operator
@@ -94,16 +96,28 @@ class ParametricProductionCondition:
         """
         Parses the condition into a string representation.
         """
-        s = ""
         if self.type == '*':
-            s += '*'
+            return '*'
         elif self.type == '#':
-            s += str(self.value)
+            return str(self.value)
         elif self.type == 'P':
-            s += str(self.parameter)
-            if self.operator is not None: s += " " + str(self.operator)
-            if self.value is not None: s += " " + str(self.value)
-        return s
+            tokens = [str(self.parameter)]
+            if self.operator is not None: tokens.append(str(self.operator))
+            if self.value is not None: tokens.append(str(self.value))
+            return " ".join(tokens)
+        return ""
+
+    @staticmethod
+    def copyFrom(other_condition):
+        """
+        Copies a condition and returns the copy.
+        """
+        new_condition = ParametricProductionCondition()
+        new_condition.type = other_condition.type
+        new_condition.parameter = other_condition.parameter
+        new_condition.operator = other_condition.operator
+        new_condition.value = other_condition.value
+        return new_condition
 
 class ParametricProductionSucessor(ParametricString):
     """
@@ -112,47 +126,123 @@ class ParametricProductionSucessor(ParametricString):
     def __init__(self):
         ParametricString.__init__(self)
 
+class StochasticProductionTable:
+    """
+    The stochastic productions of a single predecessor letter, in order, with their cumulative probabilities.
+    A production is chosen for each rewritten module, with a binary search on a random value.
+    """
+
+    def __init__(self):
+        self.productions = []
+        self.cumulativeProbabilities = []
+        self.fallbackProduction = None     # Chosen when the random value exceeds all probabilities. If None, the module is not rewritten.
+
+    def addProduction(self,prod):
+        """
+        @param prod: A stochastic production. Its probability is added to those of the previous productions.
+        @type prod: ParametricProduction
+        """
+        total = self.cumulativeProbabilities[-1] if len(self.cumulativeProbabilities) > 0 else 0
+        self.productions.append(prod)
+        self.cumulativeProbabilities.append(total + prod.condition.value)
+
+    def choose(self,values,rnd):
+        """
+        @param values: The parameter values of the rewritten module
+        @type values: list
+
+        @param rnd: The random generator of the derivation
+        @type rnd: random.Random
+
+        @return: The chosen production, or None if the module is not rewritten
+        @rtype: ParametricProduction
+        """
+        i = bisect_left(self.cumulativeProbabilities,rnd.random())
+        if i < len(self.productions): return self.productions[i]
+        return self.fallbackProduction
+
+
+class ConditionalProductionTable:
+    """
+    The productions of a single predecessor letter, in order, when some of them have parametric conditions.
+    The conditions are compiled (see ParametricProduction.compileCondition) and checked for each rewritten module:
+    the first production whose condition holds is chosen.
+    Stochastic productions draw a single random value per module, and their probabilities accumulate as in a StochasticProductionTable.
+    """
+
+    def __init__(self):
+        self.entries = []   # (production, predicate or None, cumulative probability or None)
+        self.totalProbability = 0
+        self.stochastic = False
+
+    def addProduction(self,prod):
+        """
+        @param prod: A production. Productions after one whose condition always holds are never chosen.
+        @type prod: ParametricProduction
+        """
+        if prod.condition.type == "#":
+            self.totalProbability += prod.condition.value
+            self.entries.append((prod,None,self.totalProbability))
+            self.stochastic = True
+        elif prod.condition.type == "P":
+            self.entries.append((prod,prod.compileCondition(),None))
+        else:
+            self.entries.append((prod,None,None))
+
+    def choose(self,values,rnd):
+        """ See StochasticProductionTable.choose """
+        randomValue = rnd.random() if self.stochastic else None
+        for prod, predicate, cumulativeProbability in self.entries:
+            if predicate is not None:
+                if predicate(values): return prod
+            elif cumulativeProbability is not None:
+                if randomValue <= cumulativeProbability: return prod
+            else:
+                return prod
+        return None
+
+
 class ParametricProduction:
     """
     Defines a single production rule for a L-system.
     Also known as rule.
+
+    The version of the production is increased by the building methods (changes of the successor pString increase its own version).
     """
     GENOME_SEPARATOR = ';'  # Not '.' used for decimal. Not ',' used for lists.
-    ops = None
-    randomValue = None
-    totalCondition = 0
 
-    @staticmethod
-    def resetStochasticState():
-        ParametricProduction.randomValue = None
-        ParametricProduction.totalCondition = 0
+    # The operators of expressions and conditions. Never modified.
+    ops = {
+            "+": operator.add,
+            "-": operator.sub,
+            "*": operator.mul,
+            "/": operator.truediv,
+            "%": operator.mod,
+            ">": operator.gt,
+            "<": operator.lt,
+            "=": operator.eq,
+            "!=": operator.ne,
+            ">=": operator.ge,
+            "<=": operator.le,
+            } # etc.
 
     def __init__(self,verbose = False):
         self.verbose = verbose
+        self.version = 0
 
         self.globalDefines = None
         self.predecessor = None
         self.condition = None
         self.successor = None
 
-        if ParametricProduction.ops is None:
-            # Build the operators dictionary
-            ParametricProduction.ops = {
-                    "+": operator.add,
-                    "-": operator.sub,
-                    "*": operator.mul,
-                    "/": operator.truediv,
-                    "%": operator.mod,
-                    ">": operator.gt,
-                    "<": operator.lt,
-                    "=": operator.eq,
-                    "!=": operator.ne,
-                    ">=": operator.ge,
-                    "<=": operator.le,
-                    } # etc.
+        # Compiled form of the successor, built by compileSuccessor()
+        self.compiledSuccessor = None
+        self.compilationKey = None
 
     def setGlobals(self,globalDefines):
         self.globalDefines = globalDefines
+        self.version += 1
+        self.clearCompiledSuccessor()   # Global values are bound in the compiled successor
         if self.predecessor is not None: self.predecessor.setGlobals(globalDefines)
         #self.condition.setGlobals(globalDefines)
         if self.successor is not None: self.successor.setGlobals(globalDefines)
@@ -169,13 +259,35 @@ class ParametricProduction:
 
     def setPredecessorModule(self,pred):
         self.predecessor = pred
+        self.version += 1
+        self.clearCompiledSuccessor()
 
     def setConditionFromString(self,conditionString):
         self.condition = self.parseConditionString(conditionString)
+        self.version += 1
 
     def setSuccessorPstring(self,succ):
         succ.setGlobals(self.globalDefines)
         self.successor = succ
+        self.version += 1
+        self.compileSuccessor()
+
+    def setElements(self,pred,cond,succ):
+        """
+        Sets all the elements of this production at once.
+
+        @param pred: The predecessor module
+        @type pred: ParametricModule
+
+        @param cond: The condition, as a string
+        @type cond: str
+
+        @param succ: The successor pString
+        @type succ: ParametricString
+        """
+        self.setPredecessorModule(pred)
+        self.setConditionFromString(cond)
+        self.setSuccessorPstring(succ)
 
     ######################
     # Parse from text string
@@ -194,6 +306,8 @@ class ParametricProduction:
         self.predecessor = self.parsePredecessorString(predecessorString)
         self.condition = self.parseConditionString(conditionString)
         self.successor = self.parseSuccessorString(successorString)
+        self.version += 1
+        self.compileSuccessor()
         if self.verbose: print("\nProduction: " + str(self))
 
     def parsePredecessorString(self,string):
@@ -222,11 +336,45 @@ class ParametricProduction:
         """
         Parses the production into a string representation.
         """
-        s = ""
-        if self.predecessor is not None: s += str(self.predecessor)
-        if self.condition is not None: s += " : " + str(self.condition)
-        if self.successor is not None: s += " -> " + str(self.successor)
-        return s
+        tokens = []
+        if self.predecessor is not None: tokens.append(str(self.predecessor))
+        if self.condition is not None: tokens.append(" : " + str(self.condition))
+        if self.successor is not None: tokens.append(" -> " + str(self.successor))
+        return "".join(tokens)
+
+    def writeTo(self,fileLike):
+        """
+        Writes the text form of this production (see __str__) to a file-like object. The successor is streamed.
+        """
+        if self.predecessor is not None: fileLike.write(str(self.predecessor))
+        if self.condition is not None: fileLike.write(" : " + str(self.condition))
+        if self.successor is not None:
+            fileLike.write(" -> ")
+            self.successor.writeTo(fileLike)
+
+    ######################
+    # Copy
+    ######################
+
+    @staticmethod
+    def copyFrom(other_production):
+        """
+        Copies a production and returns the copy, without converting it to a string and back.
+        The copy uses the same global defines, and the same compiled successor until either production changes.
+        """
+        new_production = ParametricProduction(other_production.verbose)
+        new_production.globalDefines = other_production.globalDefines
+        if other_production.predecessor is not None:
+            new_production.predecessor = ParametricModule.copyFrom(other_production.predecessor)
+            new_production.predecessor.setGlobals(other_production.globalDefines)
+        if other_production.condition is not None:
+            new_production.condition = ParametricProductionCondition.copyFrom(other_production.condition)
+        if other_production.successor is not None:
+            new_production.successor = ParametricString.copyFrom(other_production.successor)
+        # The compiled successor is never modified, and it is checked against its key before being used
+        new_production.compiledSuccessor = other_production.compiledSuccessor
+        new_production.compilationKey = other_production.compilationKey
+        return new_production
 
     #########################
     # Genome Representation
@@ -243,14 +391,21 @@ class ParametricProduction:
         self.predecessor = self.parsePredecessorString(predecessorString)
         self.condition = self.parseConditionString(conditionString)
         self.successor = self.parseSuccessorString(successorString)
+        self.version += 1
+        self.compileSuccessor()
         if self.verbose: print("\nProduction: " + str(self))
 
     def toGenomeRepresentation(self):
-        s = ""
-        s += (str(self.predecessor)  if (self.successor is not None) else "")
-        s += self.GENOME_SEPARATOR + (str(self.condition) if self.successor is not None else "")
-        s += self.GENOME_SEPARATOR + (str(self.successor) if self.successor is not None else "")
-        return s
+        if self.successor is None: return self.GENOME_SEPARATOR*2
+        return self.GENOME_SEPARATOR.join([str(self.predecessor), str(self.condition), str(self.successor)])
+
+    def writeGenomeRepresentation(self,fileLike):
+        """ Writes the genome representation (see toGenomeRepresentation) to a file-like object. The successor is streamed. """
+        if self.successor is None:
+            fileLike.write(self.GENOME_SEPARATOR*2)
+            return
+        fileLike.write(str(self.predecessor) + self.GENOME_SEPARATOR + str(self.condition) + self.GENOME_SEPARATOR)
+        self.successor.writeTo(fileLike)
 
     ######################
     # Utilities
@@ -266,40 +421,19 @@ class ParametricProduction:
             return True
 
         # Stochastic
+        # @note: this checks the production alone. The stochastic productions of a letter are chosen together by a StochasticProductionTable.
         elif self.condition.type == "#":
-            if ParametricProduction.randomValue is None:
-                ParametricProduction.randomValue = rnd.random()
-            ParametricProduction.totalCondition += self.condition.value
-            if self.verbose: print("Checking random " + str(ParametricProduction.randomValue) + " against value " + str(self.condition.value))
-            if ParametricProduction.randomValue <= ParametricProduction.totalCondition:
-                return True
-            else:
-                return False
+            randomValue = rnd.random()
+            if self.verbose: print("Checking random " + str(randomValue) + " against value " + str(self.condition.value))
+            return randomValue <= self.condition.value
 
         # Parametric
+        # @note: this checks the first module with the predecessor's letter. When deriving, the condition is checked for each module instead (see ConditionalProductionTable).
         elif self.condition.type == "P":
-            predecessor = self.predecessor
-            predecessorLetter = predecessor.letter
-            if self.verbose: print("Checking condition for letter " + predecessorLetter + " and parameter " + str(self.condition.parameter))
-
-            # First, we must locate that predecessor's letter in the input string
-            inputModules = inputString.modulesList
-            for i in range(len(inputModules)):
-                inputModule = inputModules[i]
-                print(inputModule)
-                print(predecessorLetter)
-                if inputModule.letter == predecessorLetter:
-                    # TODO: also check that the number of parameters is the same
-                    print("Found the predecessor: " + predecessorLetter)
-
-                    # Check the predecessor parameter J against the condition
-                    for j in range(len(predecessor.params)):
-                        if predecessor.params[j] == self.condition.parameter:
-                            # I-J is the correct parameter's position
-                            #print([v for v in inputString.modulesList[i].params])
-                            value = inputString.modulesList[i].params[j]
-                            if self.verbose: print("Parameter " + self.condition.parameter + " has value " + str(value) + " to check against " + str(self.condition.value))
-                            return ParametricProduction.ops[self.condition.operator](value,(self.condition.value))
+            if self.verbose: print("Checking condition for letter " + self.predecessor.letter + " and parameter " + str(self.condition.parameter))
+            inputModule = inputString.getFirstModuleOfLetter(self.predecessor.letter)
+            if inputModule is None: return False
+            return self.compileCondition()(inputModule.params)
         else:
             raise Exception("Wrong condition type for condition! " + str(self.condition.type))
 
@@ -310,170 +444,198 @@ class ParametricProduction:
         @param inputPString: The ParametricString that must be converted using this production.
         @type inputPString: ParametricString
         """
-        # First, we must locate the predecessor of this rule in the input string, if there is
-        inputModules = inputPString.modulesList
-        #outputModules = [m for m in inputModules]   # Copy NO!!! WE DON'T COPY IT, BECAUSE THEN WE'LL HAVE TO REMOVE AND THAT TAKES A LOT OF TIME!
-        outputModules = []  # We start from an empty output list and will populate it as we loop over the input modules
+        # We start from an empty output list and will populate it as we loop over the input modules
         # @note: with this change, I can do in 2 seconds 600,000 elements instead of 1,000!
+        outputModules = []
+        predecessorLetter = self.predecessor.letter
+        self.compileSuccessor()
+        for inputModule in inputPString.modulesList:
+            if inputModule.letter == predecessorLetter and not inputModule.isBracket():
+                self.rewrite(inputModule,outputModules)
+            else:
+                outputModules.append(inputModule)
+        inputPString.modulesList = outputModules
+        return inputPString
 
-        totInserted = 0
-
-        #print("Input is: " + str(inputPString))
-        #print(self.globalDefines)
-
-        #tot_timedict = datetime.timedelta(0)
-        #tot_timesucc = datetime.timedelta(0)
-
-        for i in range(len(inputModules)):
-            inputModule = inputModules[i]
+    def rewrite(self,inputModule,outputModules):
+        """
+        Rewrites a single module matching the predecessor, appending the successor modules (with their parameters evaluated) to the output list.
 
-            if inputModule.isBracket():
-                outputModules.append(inputModule)
-                continue
+        @note: The successor must have been compiled beforehand, see compileSuccessor.
 
-            #print("CHECKING " + str(inputModule))
-            #print(datetime.datetime.now())
+        @param inputModule: The module to be rewritten. Its letter must be the predecessor's letter.
+        @type inputModule: ParametricModule
 
-            if inputModule.ignoreConversion:
-                #print("APPEND " + str(inputModule))
-                outputModules.append(inputModule)
-                continue
-            if inputModule.letter != self.predecessor.letter:
-                outputModules.append(inputModule)
-                continue
+        @param outputModules: The list the successor modules are appended to.
+        @type outputModules: list of ParametricModule
+        """
+        values = inputModule.params
+        if self.verbose: print("Predecessor " + self.predecessor.letter + " has values (" + " ".join([str(p) for p in values]) + ")")
+        for letter, evaluators, successorModule in self.compiledSuccessor:
+            if evaluators is None:
+                # Brackets are not evaluated
+                outputModules.append(successorModule)
             else:
-                # This is to be transformed!
-                #timestart = datetime.datetime.now()
+                outputModules.append(ParametricModule.fromValues(letter,[evaluate(values) for evaluate in evaluators]))
+            if self.verbose: print("Inserting output module " + str(outputModules[-1]))
+
+    def rewriteValues(self,values,outputPString):
+        """
+        Same as rewrite, but for compact pStrings: the rewritten module is given by its parameter values only, and the successor is appended to a CompactParametricString.
 
-                # We located it, we now need to substitute for the successor
-                #print("FOUND THE PREDECESSOR " + predecessorLetter)
+        @param values: The parameter values of the module to be rewritten.
+        @type values: sequence of float
 
-                # Remove the predecessor
-                predIndex = i
-                #outputModules.remove(inputModule)   # TODO: this is REALLY SLOW!!!
+        @param outputPString: The pString the successor modules are appended to.
+        @type outputPString: CompactParametricString
+        """
+        if self.verbose: print("Predecessor " + self.predecessor.letter + " has values (" + " ".join([str(p) for p in values]) + ")")
+        append = outputPString.appendLetterAndValues
+        for letter, evaluators, successorModule in self.compiledSuccessor:
+            if evaluators is None: append(letter,())
+            else: append(letter,[evaluate(values) for evaluate in evaluators])
 
-                #timedict = datetime.datetime.now() - timestart
-                #tot_timedict += timedict
-                #timestart = datetime.datetime.now()
+    ######################
+    # Compilation
+    ######################
 
+    def compileSuccessor(self):
+        """
+        Compiles the successor's parameter expressions into evaluators, so that they need not be parsed again for each rewritten module.
+        The compiled successor is kept until the production changes.
 
-                # We get the parameters' current values too
-                predParamNames = self.predecessor.params
-                predParamValues = inputModule.params
-                if self.verbose:
-                    strnames = " ".join([str(p) for p in predParamNames])
-                    strvalues =  " ".join([str(p) for p in predParamValues])
-                    print("Predecessor " + self.predecessor.letter +" at index " + str(predIndex) + " has parameters (" + strnames + ") with values (" + strvalues + ")")
+        @note: Generators also modify successors directly, so we check that the production still matches what was compiled.
 
-                # Build a dictionary with the parameter values
-                paramDict = {}
-                for j in range(len(predParamNames)):
-                    paramDict[predParamNames[j]] = predParamValues[j]
+        @return: A list of (letter, evaluators, module) tuples, one per successor module. Evaluators are None for brackets.
+        @rtype: list
+        """
+        if self.predecessor is None or self.successor is None: return None
+        key = self.getCompilationKey()
+        if self.compiledSuccessor is None or key != self.compilationKey:
+            if self.verbose: print("Compiling successor " + str(self.successor))
+            parameterIndices = {}
+            for j in range(len(self.predecessor.params)):
+                parameterIndices[self.predecessor.params[j]] = j
+            compiledSuccessor = []
+            for successorModule in self.successor.modulesList:
+                if successorModule.isBracket():
+                    compiledSuccessor.append((successorModule.letter,None,successorModule))
+                else:
+                    evaluators = [self.compileExpression(expression,parameterIndices) for expression in successorModule.params]
+                    compiledSuccessor.append((successorModule.letter,evaluators,successorModule))
+            self.compiledSuccessor = compiledSuccessor
+            self.compilationKey = key
+        return self.compiledSuccessor
 
-                #print("Dict: " + str(timedict))
+    def compileCondition(self):
+        """
+        Compiles a parametric condition (e.g. 'x>1') into a predicate on the parameter values of a rewritten module.
 
-                #print "Successor: " + str(self.successor)
+        @return: A function that, given the rewritten module's parameter values, returns whether the condition holds. None if the condition is not parametric.
+        @rtype: function
+        """
+        if self.condition.type != "P": return None
+        if self.condition.parameter not in self.predecessor.params:
+            return lambda values: False
+        index = self.predecessor.params.index(self.condition.parameter)
+        compare = ParametricProduction.ops[self.condition.operator]
+        value = self.condition.value
+        return lambda values: compare(float(values[index]),value)
+
+    def clearCompiledSuccessor(self):
+        self.compiledSuccessor = None
+        self.compilationKey = None
+
+    def getCompilationKey(self):
+        """ Returns what the compiled successor depends on. """
+        globalDefines = self.globalDefines if self.globalDefines is not None else {}
+        return (tuple(self.predecessor.params),
+                tuple([(m.letter,tuple(m.params)) for m in self.successor.modulesList]),
+                tuple(globalDefines.items()))
+
+    def compileExpression(self,expression,parameterIndices):
+        """
+        Compiles a parameter expression (e.g. 'x*0.5+d1') into an evaluator.
+        Operations are performed from left to right, without precedence.
+        Global defines are bound to their current values, while predecessor parameters are read from the rewritten module's values.
 
-                # Add the successors
-                for j in range(len(self.successor.modulesList)):
-                    successorModule = self.successor.modulesList[j]
+        @param expression: The expression to compile
+        @type expression: str or float
 
-                    # Look for what parameters must be evaluated for the successor (which contains expressions)
-                    if successorModule.isBracket():
-                        if self.verbose: print("Module " + successorModule)
-                        actualSuccessorModule = successorModule
-                    else:
-                        if self.verbose:
-                            strexpressions = " ".join([p for p in successorModule.params])
-                            print("Successor with letter " + successorModule.letter + " has expressions (" + strexpressions + ")")
-                        values = []
-
-                        for expression in successorModule.params:
-                            expression = str(expression)
-                            v = ""
-                            op_last = None
-                            op = None
-                            # Check each character of the expression
-                            tmp_digit_string = ""
-                            tmp_letter_string = ""
-
-                            #print(expression)
-                            #print(type(expression))
-                            expression += "?"   # Ending
-                            for c in expression:
-                                countingDigits = False
-                                countingLetters = False
-                                #print(c)
-                                if c in ParametricProduction.ops:
-                                    # Found an operator
-                                    op_last = op
-                                    op = ParametricProduction.ops[c]
-                                    #print("FOUND OP" + str(op))
-                                elif c.isdigit() or c is '.':
-                                    # Found a digit
-                                    if tmp_letter_string != "":
-                                        # Continuing a literal parameter
-                                        tmp_letter_string += c
-                                    else:
-                                        # Starting a number parameter
-                                        tmp_digit_string += c
-                                        countingDigits = True
-                                    #print(tmp_digit_string) 
-                                elif c == '?':
-                                    # Ending, do nothing
-                                    op_last = op
-                                    pass
-                                else:
-                                    # Found a letter
-                                    tmp_letter_string += c
-                                    countingLetters = True
-
-                                # Build the previous stuff
-                                if not countingDigits and len(tmp_digit_string) > 0:
-                                    if self.verbose: print("FOUND NUMBER: " + str(tmp_digit_string))
-                                    v = self.performOperation(v,op_last,float(tmp_digit_string))
-                                    tmp_digit_string = ""
-
-                                if not countingLetters and len(tmp_letter_string) > 0:
-                                    #print "CURRENT: " + str(self.globalDefines)
-                                    #print("TEMP LETTER STRING: " + str(tmp_letter_string))
-                                    if tmp_letter_string in self.globalDefines.keys():
-                                        new_v = self.globalDefines[tmp_letter_string]
-                                    else:
-                                        new_v = paramDict[tmp_letter_string]
-                                        #if not (new_v is float): #TODOO!!!!
-                                        #    new_v = eval(str(new_v))    # WARNING: added this for when the axiom contains some functions! Instead they should be evaluated beforehand!
-                                    if self.verbose:  print("FOUND PARAMETER: " + str(tmp_letter_string) + " with value " + str(new_v) + " to be added to current value: (" + str(v) +")")
-                                    v = self.performOperation(v,op_last,float(new_v))
-                                    tmp_letter_string = ""
-
-                            values.append(v)
-                            #print("Value: " + str(v))
-                        actualSuccessorModule = successorModule.evaluate(*values)
-                        actualSuccessorModule.ignoreConversion = True   # This module won't be converted again during this step
-
-                    if self.verbose: print("Inserting output module " + str(actualSuccessorModule))
-                    #outputModules.insert(predIndex+totInserted,actualSuccessorModule)
-                    outputModules.append(actualSuccessorModule)
-                    totInserted+=1
-
-                    #print("CURRENT MODULES:"); for m in outputModules: print(m)
-                totInserted-=1 # The removed module must not be counted
-
-                #timesucc = datetime.datetime.now() - timestart
-                #tot_timesucc += timesucc
-                #print("Succ: " + str(timesucc))
-
-                #print ("Current output: " + str(outputModules))
-
-        #tot_time = tot_timedict + tot_timesucc
-        #print("TOT time: " + str(tot_time))
-        #print("TOT dict: " + str(tot_timedict))
-        #print("TOT succ: " + str(tot_timesucc))
+        @param parameterIndices: The position of each predecessor parameter
+        @type parameterIndices: dictionary
 
-        inputPString.modulesList = outputModules
-        #print("Result: " + str(inputPString))
-        return inputPString
+        @return: A function that, given the rewritten module's parameter values, returns the value of the expression
+        @rtype: function
+        """
+        if not isinstance(expression,str):
+            # Already a number
+            constant = float(expression)
+            return lambda values: constant
+
+        globalDefines = self.globalDefines if self.globalDefines is not None else {}
+
+        # Each step is an operation (None for the first operand) with either a parameter index or a constant
+        steps = []
+        op_last = None
+        op = None
+        tmp_digit_string = ""
+        tmp_letter_string = ""
+        for c in expression + "?":  # '?' is the ending
+            countingDigits = False
+            countingLetters = False
+            if c in ParametricProduction.ops:
+                # Found an operator
+                op_last = op
+                op = ParametricProduction.ops[c]
+            elif c.isdigit() or c == '.':
+                if tmp_letter_string != "":
+                    # Continuing a literal parameter
+                    tmp_letter_string += c
+                else:
+                    # Starting a number parameter
+                    tmp_digit_string += c
+                    countingDigits = True
+            elif c == '?':
+                op_last = op
+            else:
+                # Found a letter
+                tmp_letter_string += c
+                countingLetters = True
+
+            # Build the previous stuff
+            if not countingDigits and len(tmp_digit_string) > 0:
+                steps.append((op_last,None,float(tmp_digit_string)))
+                tmp_digit_string = ""
+
+            if not countingLetters and len(tmp_letter_string) > 0:
+                if tmp_letter_string in globalDefines:
+                    steps.append((op_last,None,float(globalDefines[tmp_letter_string])))
+                elif tmp_letter_string in parameterIndices:
+                    steps.append((op_last,parameterIndices[tmp_letter_string],None))
+                else:
+                    # Unknown parameter: this can be found only when rewriting
+                    return self.createFailingEvaluator(tmp_letter_string)
+                tmp_letter_string = ""
+
+        # Simple expressions get faster evaluators
+        if len(steps) == 1 and steps[0][0] is None:
+            index, constant = steps[0][1], steps[0][2]
+            if index is None: return lambda values: constant
+            return lambda values: float(values[index])
+
+        def evaluate(values):
+            v = ""
+            for op, index, constant in steps:
+                operand = constant if index is None else float(values[index])
+                v = operand if op is None else op(v,operand)
+            return v
+        return evaluate
+
+    def createFailingEvaluator(self,parameterName):
+        def evaluate(values):
+            raise KeyError(parameterName)
+        return evaluate
 
     def performOperation(self,v1,op,v2):
         """
@@ -529,10 +691,27 @@ if __name__ == "__main__":
     ps = pp.convert(ps)
     print("Result: " + str(ps))
 
+    print("\nConvert after changing globals (the compiled successor is rebuilt)")
+    pp.setGlobals({"p":3.0})
+    ps = ParametricString.fromTextString("A(2)")
+    print("Input: " + str(ps))
+    ps = pp.convert(ps)
+    print("Result: " + str(ps))
+
 
     print("\nTo genome")
     genome = pp.toGenomeRepresentation()
     print("Result: " + str(genome))
 
+    print("\nStochastic table")
+    table = StochasticProductionTable()
+    for p in ["0.2","0.5","0.3"]:
+        sp = ParametricProduction()
+        sp.parseString("A:" + p + "->B")
+        table.addProduction(sp)
+    counts = [0,0,0]
+    for i in range(10000): counts[table.productions.index(table.choose([],rnd))] += 1
+    print("Cumulative probabilities: " + str(table.cumulativeProbabilities) + " Chosen: " + str(counts))
+
 
     print("\nFinish testing ParametricProduction")
\ No newline at end of file
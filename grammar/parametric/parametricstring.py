@@ -11,16 +11,46 @@ imp.reload(grammar.parametric.parametricmodule)
 
 from grammar.parametric.parametricmodule import ParametricModule
 
+import re
+from collections import Counter
+
 class ParametricString:
     """
     An pL-system string, composed of multiple ParametricModule
     Examples: B(y)A(x,y)  F(x)C(y)
+
+    The number of modules of each letter and the matching brackets are computed when first needed, and then kept up to date by the building methods.
+    The string form is also computed when first needed, and it is cleared by the building methods, which also increase the version of the pString.
     """
+    # A module is either a bracket, or a letter with optional parameters: (bracket, letter, parameters)
+    # Parameters can contain one level of parentheses, as in 'A((x+1)*2)'
+    MODULE_PATTERN = re.compile(r"([\[\]])|([^\[\]()?])(?:\(((?:[^()]|\([^()]*\))*)\)?)?")
+    # Commas outside of parentheses, which separate parameters
+    PARAMETER_SEPARATOR_PATTERN = re.compile(r",(?![^(]*\))")
+
+    WRITE_CHUNK_MODULES = 4096  # Modules joined for each write in writeTo
 
     def __init__(self):
+        self.version = 0    # Increased whenever this pString is modified
         self.modulesList = []
         self.globalDefines = None
 
+    @property
+    def modulesList(self):
+        """
+        The modules of this pString.
+        @note: Do not modify this list directly, use the building methods instead (or assign a new list).
+        """
+        return self.modules
+
+    @modulesList.setter
+    def modulesList(self,modules):
+        self.modules = modules
+        self.letterCounts = None
+        self.matchingBrackets = None
+        self.cachedString = None
+        self.version += 1
+
     @staticmethod
     def fromTextString(textString):
         ps = ParametricString()
@@ -44,15 +74,59 @@ class ParametricString:
         self.modulesList = self.stringToModulesList(textString)
 
     def __str__(self):
-        s = ""
-        for i in range(len(self.modulesList)):
-            module = self.modulesList[i]
-            s += str(module)
-        return s
+        if self.cachedString is None:
+            self.cachedString = "".join([str(m) for m in self.modules])
+        return self.cachedString
+
+    def writeTo(self,fileLike):
+        """
+        Writes the string form of this pString to a file-like object, a chunk of modules at a time.
+        The whole string is never built, unless it is already cached.
 
-    def resetConversions(self):
-        for module in self.modulesList:
-            module.ignoreConversion = False
+        @param fileLike: Any object with a write(str) method
+        """
+        if self.cachedString is not None:
+            fileLike.write(self.cachedString)
+            return
+        modules = self.modules
+        for start in range(0,len(modules),self.WRITE_CHUNK_MODULES):
+            fileLike.write("".join([str(m) for m in modules[start:start+self.WRITE_CHUNK_MODULES]]))
+
+    def modulesChanged(self):
+        """
+        Clears the string form and increases the version of this pString.
+        Called by the building methods, and it must be called after changing the parameters of some modules of this pString directly.
+        """
+        self.cachedString = None
+        self.version += 1
+
+    def getLetterCounts(self):
+        """
+        @return: The number of modules of each letter in this pString (brackets included)
+        @rtype: dict
+        """
+        if self.letterCounts is None:
+            self.letterCounts = Counter([m.letter for m in self.modules])
+        return self.letterCounts
+
+    def getMatchingBracketIndex(self,i):
+        """
+        @return: The index of the bracket matching the bracket at index I, or None if it is not matched
+        @rtype: int
+        """
+        if self.matchingBrackets is None:
+            matchingBrackets = {}
+            openIndices = []
+            for j in range(len(self.modules)):
+                letter = self.modules[j].letter
+                if letter == '[':
+                    openIndices.append(j)
+                elif letter == ']' and len(openIndices) > 0:
+                    k = openIndices.pop()
+                    matchingBrackets[k] = j
+                    matchingBrackets[j] = k
+            self.matchingBrackets = matchingBrackets
+        return self.matchingBrackets.get(i)
 
     def containsAllLetters(self,letters):
         """ True if this pString contains all the requested letters. """
@@ -68,51 +142,80 @@ class ParametricString:
 
     def containsLetter(self,letter):
         """ True if this pString contains the requested letter (at least once) """
-        for m in self.getActualModules():
-            if m.letter == letter: return True
-        return False
+        if letter in ('[',']'): return False
+        return self.getLetterCounts().get(letter,0) > 0
 
     def containsLetterAtLeastCount(self,letter,count):
         """ True if this pString contains the requested letter at least COUNT times. """
-        n = 0
-        for m in self.getActualModules():
-            if m.letter == letter: n+=1
-        return n>=count
+        if letter in ('[',']'): return count <= 0
+        return self.getLetterCounts().get(letter,0) >= count
 
     def hasBranches(self):
         """ True if this pString contains at least one branch """
-        for m in self.modulesList:
-            if m.isBracket():
-                return True
-        return False
+        letterCounts = self.getLetterCounts()
+        return letterCounts.get('[',0) > 0 or letterCounts.get(']',0) > 0
 
     ################
     # Building
     ################
 
     def appendOpenBranch(self):
-        self.modulesList.append(ParametricModule.fromTextString("["))
+        self.insertModule(len(self.modules),ParametricModule.fromTextString("["))
 
     def appendCloseBranch(self):
-        self.modulesList.append(ParametricModule.fromTextString("]"))
+        self.insertModule(len(self.modules),ParametricModule.fromTextString("]"))
 
     def appendModule(self,m):
         if self.globalDefines is not None:
             for i in range(len(m.params)):
                 if m.params[i] in self.globalDefines:    # Uses global defines, if available
                     m.params[i] = self.globalDefines[m.params[i]]
-        self.modulesList.append(m)
+        self.insertModule(len(self.modules),m)
+
+    def insertModule(self,index,m):
+        """
+        Inserts a module as it is, before the given index.
+        """
+        self.modules.insert(index,m)
+        self.modulesChanged()
+        if self.letterCounts is not None: self.letterCounts[m.letter] += 1
+        if m.isBracket(): self.matchingBrackets = None
+        elif self.matchingBrackets is not None and index < len(self.modules)-1: self.matchingBrackets = None
+
+    def replaceModuleAt(self,index,m):
+        """
+        Replaces the module at the given index.
+        """
+        self.removeModulesFromTo(index,index+1)
+        self.insertModule(index,m)
+
+    def removeModule(self,m):
+        """
+        Removes a module (the same object, not an equal one).
+        """
+        index = self.index(m)
+        self.removeModulesFromTo(index,index+1)
 
     def removeModulesFromTo(self,start_index,end_index):
-        del self.modulesList[start_index:end_index]
+        if self.letterCounts is not None:
+            for m in self.modules[start_index:end_index]: self.letterCounts[m.letter] -= 1
+        del self.modules[start_index:end_index]
+        self.matchingBrackets = None
+        self.modulesChanged()
 
     def evaluateDefines(self):
         """
         Evaluates this pString according to global defines. Its modules are replaced with 'valued' modules.
+        Modules that use no define are kept, and the others are replaced by new modules, so modules shared with other pStrings are not changed.
         """
-        for i in range(len(self.modulesList)):
-            if self.modulesList[i].isBracket(): continue    # Bracket have no params
-            self.modulesList[i].params = [(self.globalDefines[v]  if v in self.globalDefines else v)  for v in  self.modulesList[i].params]
+        globalDefines = self.globalDefines
+        if not globalDefines: return
+        modules = self.modules
+        for i in range(len(modules)):
+            m = modules[i]
+            if any(v in globalDefines for v in m.params):   # Brackets have no params
+                modules[i] = ParametricModule.fromValues(m.letter,[(globalDefines[v] if v in globalDefines else v) for v in m.params])
+        self.modulesChanged()
 
     def setParameterToModulesOfLetter(self,letter,param_value):
         """
@@ -120,38 +223,40 @@ class ParametricString:
         """
         for m in self.getActualModules():
             if m.letter == letter: m.changeAllParametersTo(param_value)
+        self.modulesChanged()
+
     ################
     # Utilities
     ################
 
     def __iter__(self):
-        return self.modulesList.__iter__()
+        return self.modules.__iter__()
 
     def __getitem__(self, key):
-        return self.modulesList[key]
+        return self.modules[key]
 
     def __len__(self):
-        return len(self.modulesList)
+        return len(self.modules)
 
     def index(self,m):
-        return self.modulesList.index(m)
+        return self.modules.index(m)
 
     def lengthWithoutBrackets(self):
-        return len(self.getActualModules())
+        letterCounts = self.getLetterCounts()
+        return len(self.modules) - letterCounts.get('[',0) - letterCounts.get(']',0)
 
     def bracketsAreBalanced(self):
-        balance = 0
-        for m in self.modulesList:
-            if m.isOpenBracket(): balance += 1
-            elif m.isClosedBracket(): balance -= 1
-        return balance == 0
+        letterCounts = self.getLetterCounts()
+        return letterCounts.get('[',0) == letterCounts.get(']',0)
 
     def getActualModules(self):
         """ Returns the list of modules, without additional stuff such as brackets """
-        return list(filter( lambda m: not m.isBracket(),self.modulesList))
+        if not self.hasBranches(): return list(self.modules)
+        return [m for m in self.modules if m.letter != '[' and m.letter != ']']
 
     def getFirstModuleOfLetter(self,letter):
-        for m in self.getActualModules():
+        if not self.containsLetter(letter): return None
+        for m in self.modules:
             if m.letter == letter:
                 return m
         return None
@@ -160,17 +265,18 @@ class ParametricString:
     def copyFrom(other_pString):
         """
         Copies a ParametricString and returns the copy.
+        The cached string is not copied, since the modules of a copy are often changed directly.
         """
         new_pString = ParametricString()
         new_pString.setGlobals(other_pString.globalDefines)
-        new_pString.modulesList = []
-        for m in other_pString.modulesList:
-            new_pString.modulesList.append(ParametricModule.copyFrom(m))
+        new_pString.modulesList = [ParametricModule.copyFrom(m) for m in other_pString.modulesList]
+        if getattr(other_pString,"letterCounts",None) is not None: new_pString.letterCounts = Counter(other_pString.letterCounts)
         return new_pString
 
     def stringToModulesList(self,inputTextString):
         """
         Parse a text string into a sequence of pL-System modules, o.e. a parametric string.
+        All modules are found at once by MODULE_PATTERN.
 
         @param inputTextString: The string to be parsed.
         @type inputTextString: str
@@ -179,118 +285,24 @@ class ParametricString:
         @rtype: list of ParametricModule
         """
         modulesList = []
-
-        inputTextString = inputTextString.strip()
-
-        #if verbose: print("\nParsing string " + inputTextString)
-
-        tmp_params_string = ""
-        tmp_letter_string = ""
-
-        letter = ''
-        params = []
-
-        inputTextString += "?"      # We treat this as the ending character
-        countingLetters = True      # Always starts with a letter symbol
-        buildLast = False
-        appendThisAfter = False
-
-        for i in range(len(inputTextString)):
-            c = inputTextString[i]
-
-            if c == ']':
-                # Next is a letter
-                countingLetters = True
-                # We finished the last one
-                buildLast = True
-                appendThisAfter = True
-
-            elif c == '[':
-                # Next is a letter
-                countingLetters = True
-                # We finished the last one
-                buildLast = True
-                appendThisAfter = True
-
-            elif c == ')':
-                # Next is a letter
-                countingLetters = True
-                # We finished the last one
-                buildLast = True
-
-            elif c == '(':
-                # Next is a param
-                countingLetters = False
-                # We finished the last one
-                buildLast = True
-
-            elif c == '?':
-                # Ending!
-                # We finished the last one
-                buildLast = True
-
-            else:
-                if countingLetters:
-                    # A letter is exactly one character long
-                    tmp_letter_string += c
-                    buildLast = True
-                else:
-                    # A parameter may be longer than one character
-                    tmp_params_string += c
-
-            # Build the previous stuff
-            if buildLast:
-                if len(tmp_letter_string) > 0:
-
-                    if len(letter) > 0:
-                        # We already had a letter
-                        modulesList.append(ParametricModule(letter,[]))
-
-                    letter = tmp_letter_string
-                    tmp_letter_string = ''
-
-                    #if verbose: print("Found letter: " + letter)
-
-                    if inputTextString[i] != '(' and inputTextString[i+1] != '(':
-                        #if verbose: print("Adding NONPARAMETRIC")
-                        # This is not a parametric module, so we just add it
-                        modulesList.append(ParametricModule(letter,params))
-                        letter = ''
-
-                if len(tmp_params_string) > 0:
-                    params = tmp_params_string.split(",")
-
-                    #if verbose: print("Found params: " + tmp_params_string)
-                    tmp_params_string = ''
-
-                    # Parametric module
-                    #if verbose: print("Adding PARAMETRIC")
-                    modulesList.append(ParametricModule(letter,params))
-                    letter = ''
-                    params = []
-
-                #if len(params) > 0:
-                #    modulesList.append(Module(letter,params))
-                #    letter = ''
-                #    params = []
-
-                buildLast = False
-
-
-            if appendThisAfter:
-                modulesList.append(ParametricModule(c,[]))
-                appendThisAfter = False
-
-        if len(letter) > 0:
-            # We still had a letter
-            modulesList.append(ParametricModule(letter,[]))
-
-        """if verbose:
-            print("Modules: ")
-            for a in modulesList: print(a)"""
-
+        append = modulesList.append
+        parseParameter = ParametricString.parseParameter
+        for bracket, letter, paramsString in ParametricString.MODULE_PATTERN.findall(inputTextString.strip()):
+            if bracket: append(ParametricModule.fromValues(bracket,[]))
+            elif paramsString:
+                paramsStrings = paramsString.split(",") if "(" not in paramsString else ParametricString.PARAMETER_SEPARATOR_PATTERN.split(paramsString)
+                append(ParametricModule.fromValues(letter,[parseParameter(p) for p in paramsStrings]))
+            else: append(ParametricModule.fromValues(letter,[]))
         return modulesList
 
+    @staticmethod
+    def parseParameter(p):
+        """ Number parameters are cast directly, as in ParametricModule.appendParameter """
+        try:
+            return float(p)
+        except ValueError:
+            return p
+
 
 ''' TODO: Differentiate ParametricString from ValuedParametricString
 class ValuedParametricString(ParametricString):
@@ -349,5 +361,77 @@ if __name__ == "__main__":
     print("\nHas branches? " + str(ps.hasBranches()))
     print("\nIs balanced? " + str(ps.bracketsAreBalanced()))
 
+    print("\nLetter counts (kept up to date)")
+    ps = ParametricString.fromTextString("F[+F[-F]A]FA")
+    print(str(sorted(ps.getLetterCounts().items())) + " without brackets: " + str(ps.lengthWithoutBrackets()))
+    ps.insertModule(1,ParametricModule("A"))
+    ps.removeModulesFromTo(5,9)
+    print(str(ps) + " " + str(sorted(ps.getLetterCounts().items())) + " contains 3 A? " + str(ps.containsLetterAtLeastCount("A",3)))
+    print("Bracket matching index 2: " + str(ps.getMatchingBracketIndex(2)))
+
+    print("\nString form (cached until modified)")
+    import io
+    ps = ParametricString.fromTextString("F(1.5)[+(30)F(2)]A(1,2)")
+    buffer = io.StringIO()
+    ps.writeTo(buffer)
+    print(str(ps) + " written: " + buffer.getvalue())
+    ps.insertModule(0,ParametricModule("B",[3.0]))
+    print(str(ps) + " cached: " + str(ps.cachedString == str(ps)))
+
+    print("\nParsing regression check")
+    import os
+    import json
+    def modulesToLists(modulesList): return [[m.letter,m.params] for m in modulesList]
+    ps = ParametricString()
+
+    # Expected modules of the genomes to render, recorded from the previous character by character parser
+    textStrings = []
+    genomesPath = os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","..","blender","imagegeneration","genomes_to_render.txt")
+    with open(genomesPath) as genomesFile:
+        for genome in genomesFile:
+            # Axiom and productions' predecessors and successors
+            tokens = genome.strip().split("||")
+            textStrings.append(tokens[0])
+            for production in tokens[2:]:
+                textStrings.extend([production_token for production_token in production.split(";") if production_token != ""])
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),"parsedgenomes.json")) as expectedFile:
+        expected = json.load(expectedFile)
+    assert [t for t, modules in expected] == textStrings, "parsedgenomes.json does not match genomes_to_render.txt"
+    for t, modules in expected:
+        assert modulesToLists(ps.stringToModulesList(t)) == modules, "Different modules for " + t
+    print("Checked " + str(len(expected)) + " genome strings")
+
+    # Edge cases
+    edgeCases = [
+        ("FF[F]A", [["F",[]],["F",[]],["[",[]],["F",[]],["]",[]],["A",[]]]),
+        ("A()B", [["A",[]],["B",[]]]),
+        ("  F(1.5) F ", [["F",[1.5]],[" ",[]],["F",[]]]),                                     # Inner spaces are modules
+        ("A(x, y)B(1 , 2)", [["A",["x"," y"]],["B",[1.0,2.0]]]),                             # Number parameters are stripped by float
+        ("F(-1.5)+(-30)F(-x)", [["F",[-1.5]],["+",[-30.0]],["F",["-x"]]]),
+        ("F(1e-05)F(2.5E+3)F(-1.2e-05)", [["F",[1e-05]],["F",[2500.0]],["F",[-1.2e-05]]]),
+        ("A(x*d1+0.5,y/2-d2)!(d0)\\(x)", [["A",["x*d1+0.5","y/2-d2"]],["!",["d0"]],["\\",["x"]]]),
+        ("A((x+1)*2,y)B(x*(y-1))", [["A",["(x+1)*2","y"]],["B",["x*(y-1)"]]]),                 # Nested parameters
+        ("[+F[-F(2)]][&(10)L]", [["[",[]],["+",[]],["F",[]],["[",[]],["-",[]],["F",[2.0]],["]",[]],["]",[]],["[",[]],["&",[10.0]],["L",[]],["]",[]]]),
+        ]
+    for t, modules in edgeCases:
+        result = modulesToLists(ps.stringToModulesList(t))
+        assert result == modules, "Different modules for " + t + ": " + str(result)
+        print(t + " -> " + str(result))
+
+    print("\nBenchmark")
+    import timeit
+    time = timeit.timeit(lambda: [ps.stringToModulesList(t) for t in textStrings], number=100)
+    print("Parsed " + str(len(textStrings)) + " strings 100 times: " + "{0:.4f}".format(time) + "s")
+
+    print("\nBenchmark string form")
+    ps = ParametricString.fromTextString("F(1.5)[+(30)F(2)]A(1,2)"*100000)
+    def concatenated(pString):
+        s = ""
+        for module in pString: s += str(module)
+        return s
+    for name, serialize in [("concatenated", concatenated), ("joined", lambda pString: "".join([str(m) for m in pString])), ("streamed", lambda pString: pString.writeTo(io.StringIO()))]:
+        time = timeit.timeit(lambda: serialize(ps), number=1)
+        print(name + ": " + "{0:.4f}".format(time) + "s")
+
 
     print("\nFinish testing ParametricString")
\ No newline at end of file
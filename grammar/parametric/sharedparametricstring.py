@@ -0,0 +1,278 @@
+"""
+    @author: Michele Pirovano
+    @copyright: 2013-2015
+"""
+
+# This code needed for blender to load correctly updated source files
+import grammar.parametric.parametricmodule
+import grammar.parametric.parametricstring
+
+import imp
+imp.reload(grammar.parametric.parametricmodule)
+imp.reload(grammar.parametric.parametricstring)
+
+from grammar.parametric.parametricmodule import ParametricModule
+from grammar.parametric.parametricstring import ParametricString
+
+from itertools import islice
+
+class DerivationNode:
+    """
+    A piece of a derived pString: the expansion of a single module.
+    Modules that expand identically share the same node, so a derived pString is a graph of nodes instead of a flat list.
+    """
+
+    def __init__(self, children):
+        """
+        @param children: The content of this node, in order.
+        @type children: list of ParametricModule and DerivationNode
+        """
+        self.children = children
+        self.length = 0
+        for child in children:
+            if isinstance(child,DerivationNode): self.length += child.length
+            else: self.length += 1
+        self.letterCounts = None
+
+    def getLetterCounts(self):
+        """
+        @return: The number of modules of each letter in this node
+        @rtype: dict
+        """
+        if self.letterCounts is None:
+            letterCounts = {}
+            for child in self.children:
+                if isinstance(child,DerivationNode):
+                    for letter, count in child.getLetterCounts().items():
+                        letterCounts[letter] = letterCounts.get(letter,0) + count
+                else:
+                    letterCounts[child.letter] = letterCounts.get(child.letter,0) + 1
+            self.letterCounts = letterCounts
+        return self.letterCounts
+
+    def __iter__(self):
+        stack = [iter(self.children)]
+        while len(stack) > 0:
+            for child in stack[-1]:
+                if isinstance(child,DerivationNode):
+                    stack.append(iter(child.children))
+                    break
+                yield child
+            else:
+                stack.pop()
+
+    def __len__(self):
+        return self.length
+
+    def getModule(self,i):
+        """ Finds the module at position I, without traversing the whole node """
+        node = self
+        while True:
+            for child in node.children:
+                if isinstance(child,DerivationNode):
+                    if i < child.length:
+                        node = child
+                        break
+                    i -= child.length
+                else:
+                    if i == 0: return child
+                    i -= 1
+
+
+class SharedParametricString(ParametricString):
+    """
+    A derived pString whose identical parts are shared, see DerivationNode.
+    Length, letter counts, iteration and serialization all work on the shared nodes, without flattening the pString.
+
+    @note: The modules are shared between several positions of the pString, and the pString cannot be modified. Copy it first, if needed.
+    """
+
+    def __init__(self, root = None):
+        if root is None: root = DerivationNode([])
+        self.root = root
+        self.globalDefines = None
+        self.cachedString = None    # Never cleared, since the pString cannot be modified
+        self.version = 0
+
+    @property
+    def modulesList(self):
+        """ A list of the modules of this pString. It is a copy. """
+        return list(self.root)
+
+    def __str__(self):
+        if self.cachedString is None:
+            self.cachedString = "".join([str(m) for m in self.root])
+        return self.cachedString
+
+    def writeTo(self,fileLike):
+        """
+        Writes the string form of this pString to a file-like object, a chunk of modules at a time. See ParametricString.writeTo.
+        """
+        if self.cachedString is not None:
+            fileLike.write(self.cachedString)
+            return
+        modulesIterator = iter(self.root)
+        while True:
+            chunk = "".join([str(m) for m in islice(modulesIterator,self.WRITE_CHUNK_MODULES)])
+            if chunk == "": break
+            fileLike.write(chunk)
+
+    def getLetterCounts(self):
+        """
+        @return: The number of modules of each letter in this pString
+        @rtype: dict
+        """
+        return self.root.getLetterCounts()
+
+    ################
+    # Building
+    ################
+
+    def parseString(self,textString):
+        raise Exception("A SharedParametricString cannot be modified!")
+
+    def appendOpenBranch(self):
+        raise Exception("A SharedParametricString cannot be modified!")
+
+    def appendCloseBranch(self):
+        raise Exception("A SharedParametricString cannot be modified!")
+
+    def appendModule(self,m):
+        raise Exception("A SharedParametricString cannot be modified!")
+
+    def insertModule(self,index,m):
+        raise Exception("A SharedParametricString cannot be modified!")
+
+    def replaceModuleAt(self,index,m):
+        raise Exception("A SharedParametricString cannot be modified!")
+
+    def removeModule(self,m):
+        raise Exception("A SharedParametricString cannot be modified!")
+
+    def removeModulesFromTo(self,start_index,end_index):
+        raise Exception("A SharedParametricString cannot be modified!")
+
+    def setParameterToModulesOfLetter(self,letter,param_value):
+        raise Exception("A SharedParametricString cannot be modified!")
+
+    def evaluateDefines(self):
+        """ Defines are evaluated when the pString is derived. """
+        pass
+
+    ################
+    # Utilities
+    ################
+
+    def __iter__(self):
+        return self.root.__iter__()
+
+    def __getitem__(self, key):
+        if isinstance(key,slice):
+            return self.modulesList[key]
+        if key < 0: key += self.root.length
+        if key < 0 or key >= self.root.length: raise IndexError("SharedParametricString index out of range")
+        return self.root.getModule(key)
+
+    def __len__(self):
+        return self.root.length
+
+    def index(self,m):
+        for i, other_m in enumerate(self.root):
+            if other_m is m: return i
+        raise ValueError(str(m) + " is not in the pString")
+
+    def getMatchingBracketIndex(self,i):
+        """
+        Finds the matching bracket by iterating the shared nodes, without flattening the pString.
+
+        @return: The index of the bracket matching the bracket at index I, or None if it is not matched
+        @rtype: int
+        """
+        if i < 0 or i >= self.root.length: return None
+        letter = self.root.getModule(i).letter
+        if letter == '[':
+            depth = 0
+            for j, m in enumerate(islice(self.root,i,None),i):
+                if m.letter == '[': depth += 1
+                elif m.letter == ']':
+                    depth -= 1
+                    if depth == 0: return j
+        elif letter == ']':
+            # The open brackets before I, as in ParametricString.getMatchingBracketIndex
+            openIndices = []
+            for j, m in enumerate(islice(self.root,i)):
+                if m.letter == '[': openIndices.append(j)
+                elif m.letter == ']' and len(openIndices) > 0: openIndices.pop()
+            if len(openIndices) > 0: return openIndices[-1]
+        return None
+
+    def containsLetter(self,letter):
+        if letter in ('[',']'): return False
+        return self.getLetterCounts().get(letter,0) > 0
+
+    def containsLetterAtLeastCount(self,letter,count):
+        if letter in ('[',']'): return count <= 0
+        return self.getLetterCounts().get(letter,0) >= count
+
+    def hasBranches(self):
+        letterCounts = self.getLetterCounts()
+        return letterCounts.get('[',0) > 0 or letterCounts.get(']',0) > 0
+
+    def lengthWithoutBrackets(self):
+        letterCounts = self.getLetterCounts()
+        return self.root.length - letterCounts.get('[',0) - letterCounts.get(']',0)
+
+    def bracketsAreBalanced(self):
+        letterCounts = self.getLetterCounts()
+        return letterCounts.get('[',0) == letterCounts.get(']',0)
+
+    def getActualModules(self):
+        return [m for m in self.root if not m.isBracket()]
+
+    def getFirstModuleOfLetter(self,letter):
+        if not self.containsLetter(letter): return None
+        for m in self.root:
+            if m.letter == letter: return m
+        return None
+
+
+if __name__ == "__main__":
+    print("Start testing SharedParametricString")
+
+    import grammar.parametric.parametriclsystem
+    imp.reload(grammar.parametric.parametriclsystem)
+    from grammar.parametric.parametriclsystem import ParametricLSystem
+
+    def createLSystem(shared):
+        pl = ParametricLSystem(sharedDerivation = shared)
+        pl.setAxiomFromString("A")
+        pl.addProductionFromString("A:*->F[+A][-A]FAL")
+        pl.addProductionFromString("F:*->FF")
+        return pl
+
+    print("\nDerivation")
+    ps = createLSystem(True).iterate(3)
+    print(ps)
+    print("Same as flat derivation? " + str(str(ps) == str(createLSystem(False).iterate(3))))
+
+    print("\nLength: " + str(len(ps)) + " without brackets: " + str(ps.lengthWithoutBrackets()))
+    print("Letter counts: " + str(sorted(ps.getLetterCounts().items())))
+    print("Module 10: " + str(ps[10]) + " last: " + str(ps[-1]))
+    print("Is balanced? " + str(ps.bracketsAreBalanced()))
+    flatPs = createLSystem(False).iterate(3)
+    print("Same matching brackets? " + str([ps.getMatchingBracketIndex(i) for i in range(len(ps))] == [flatPs.getMatchingBracketIndex(i) for i in range(len(flatPs))]))
+
+    print("\nBenchmark against the flat derivation")
+    import timeit
+    import tracemalloc
+    for shared in [False, True]:
+        name = "shared" if shared else "flat"
+        time = timeit.timeit(lambda: createLSystem(shared).iterate(8), number=1)
+        tracemalloc.start()
+        ps = createLSystem(shared).iterate(8)
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(name + ": " + str(len(ps)) + " modules in " + "{0:.2f}".format(time) + "s, "
+              + "{0:.1f}".format(size/1e6) + " MB held (" + "{0:.1f}".format(peak/1e6) + " MB peak)")
+
+    print("\nFinish testing SharedParametricString")
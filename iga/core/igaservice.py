@@ -3,11 +3,12 @@
     @copyright: 2013-2015
 """
 
-from turtles.turtle import Turtle
+from turtles.arrayturtle import ArrayTurtle
 from procedural.geneticevolver import GeneticEvolver,GeneticInstance,InitialPopulationGenerationChoice
 from procedural.incrementalgenerator import IncrementalGenerator
 from procedural.plantsincrementalgenerator import PlantsIncrementalGenerator
 from grammar.parametric.parametriclsystem import ParametricLSystem
+from grammar.parametric.derivationbudget import DerivationBudget
 from blender.imagegeneration.generateplantimage import *
 from iga.core.experimentparameters import ExperimentParameters
 from iga.core.databaseinstance import DatabaseInstance
@@ -26,7 +27,8 @@ class IgaService:
         params = ExperimentParameters()
 
         # Create a Turtle that will be used to render the trees. Its parameters will be updated when needed.
-        turtle = Turtle()
+        # The ArrayTurtle draws the same trees, faster, since the evolver draws each tree to compute its fitness
+        turtle = ArrayTurtle()
 
         # Initialize the genetic evolver
         lsystem = ParametricLSystem(params.randomSeed)
@@ -48,6 +50,7 @@ class IgaService:
         #evolver.populationInitialisationComplexifySteps = 2 # A good number to obtain a randomized tree without taking too much time
         evolver.discardEmptyEvolutions = True
         evolver.discardLSystemsLargerThan = 1000
+        evolver.derivationBudget = DerivationBudget(maxModules = 10000, timeout = 5)    # A single lsystem cannot stall the steady state
         evolver.verbose = False
         evolver.mini_verbose = False
         evolver.recap_verbose = False
@@ -33,10 +33,23 @@ class GeneticInstance():
 
         # Saved fitness, so that it needs not to be recomputed if it exists already
         self.fitness = 0    # TODO: Should be None at the beginning
+        self.fitnessVersion = None  # The version of the lsystem the fitness was computed for (see setFitness)
 
         # Additional parameters used by the genetic algorithm
         self.turtleParameters = GeneticTurtleParameters()
 
+    def setFitness(self,fitness):
+        """
+        Saves the fitness computed for the current version of the lsystem.
+        @note: The fitness depends only on the derived pString, so changing the turtle parameters does not invalidate it.
+        """
+        self.fitness = fitness
+        self.fitnessVersion = self.lsystem.getVersion()
+
+    def hasValidFitness(self):
+        """ True if the saved fitness was computed for the current version of the lsystem """
+        return self.fitnessVersion is not None and self.fitnessVersion == self.lsystem.getVersion()
+
     def copyParametersFrom(self,other_instance):
         self.turtleParameters.copyFrom(other_instance.turtleParameters)
 
@@ -62,9 +75,12 @@ class GeneticInstance():
 
     def toGenomeRepresentation(self):
         # "||||" separates these big elements
-        full_genome = self.lsystem.toGenomeRepresentation()
-        full_genome += "||||" + self.turtleParameters.toGenomeRepresentation()
-        return full_genome
+        return self.lsystem.toGenomeRepresentation() + "||||" + self.turtleParameters.toGenomeRepresentation()
+
+    def writeGenomeRepresentation(self,fileLike):
+        """ Writes the genome representation to a file-like object, streaming the lsystem part """
+        self.lsystem.writeGenomeRepresentation(fileLike)
+        fileLike.write("||||" + self.turtleParameters.toGenomeRepresentation())
 
     def fromGenomeRepresentation(self,genome):
         #print(genome)
@@ -100,6 +116,9 @@ class GeneticInstance():
     def copyFrom(other_instance):
         new_instance = GeneticInstance(ParametricLSystem.copyFrom(other_instance.lsystem))
         new_instance.copyParametersFrom(other_instance)
+        # The copied lsystem has the same version, so the fitness stays valid until it is modified
+        new_instance.fitness = other_instance.fitness
+        new_instance.fitnessVersion = other_instance.fitnessVersion
         return new_instance
 
 if __name__ == "__main__":
@@ -126,4 +145,18 @@ if __name__ == "__main__":
     print("\nTo filename")
     print(GeneticInstance.genomeToFilename(genome))
 
+    print("\nFitness (valid until the lsystem is modified)")
+    from grammar.parametric.parametricmodule import ParametricModule
+    gi = GeneticInstance(ParametricLSystem())
+    gi.lsystem.fromGenomeRepresentation("F||3||F;*;F[+F]F")
+    gi.setFitness(len(gi.lsystem.getResultPString()))
+    copy_gi = GeneticInstance.copyFrom(gi)
+    copy_gi.mutateAdditionalParameters(rnd)
+    print("After changing the turtle parameters: " + str(copy_gi.hasValidFitness()) + ", same result pString: " + str(copy_gi.lsystem.getResultPString() is gi.lsystem.getResultPString()))
+    copy_gi.lsystem.setIterations(4)
+    print("After changing the iterations: " + str(copy_gi.hasValidFitness()) + ", result length: " + str(len(copy_gi.lsystem.getResultPString())))
+    copy_gi = GeneticInstance.copyFrom(gi)
+    copy_gi.lsystem.getModifiableProduction(0).successor.appendModule(ParametricModule("F"))
+    print("After changing a production: " + str(copy_gi.hasValidFitness()) + ", original still valid: " + str(gi.hasValidFitness()))
+
     print("\nFinish testing GeneticInstance")
@@ -37,18 +37,16 @@ class GeneticTurtleParameters():
 
 
     def toGenomeRepresentation(self):
-        g = ""
-        g += "" +str(self.branch_radius)    # TODO: cut to 2 decimals!
-        g += "|"+str(self.tropism_susceptibility)
-        g += "|"+str(self.details_scale)
-        g += "|"+ str(1 if self.use_canopy else 0)
-        g += "|"+str(self.trunk_material_choice)
-        g += "|"+str(self.leaf_material_choice)
-        g += "|"+str(self.leaf_choice)
-        g += "|"+str(self.bulb_choice)
-        g += "|"+str(self.flower_choice)
-        g += "|"+str(self.fruit_choice)
-        return g
+        return "|".join([str(self.branch_radius),    # TODO: cut to 2 decimals!
+                         str(self.tropism_susceptibility),
+                         str(self.details_scale),
+                         str(1 if self.use_canopy else 0),
+                         str(self.trunk_material_choice),
+                         str(self.leaf_material_choice),
+                         str(self.leaf_choice),
+                         str(self.bulb_choice),
+                         str(self.flower_choice),
+                         str(self.fruit_choice)])
 
     def fromGenomeRepresentation(self,g):
         tokens = g.split("|")
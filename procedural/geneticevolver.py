@@ -6,13 +6,22 @@
 """
 import procedural.incrementalgenerator
 import procedural.core.geneticinstance
+import grammar.parametric.growthmodel
+import grammar.parametric.derivationbudget
+import grammar.parametric.derivationcheckpoints
 
 import imp
 imp.reload(procedural.incrementalgenerator)
 imp.reload(procedural.core.geneticinstance)
+imp.reload(grammar.parametric.growthmodel)
+imp.reload(grammar.parametric.derivationbudget)
+imp.reload(grammar.parametric.derivationcheckpoints)
 
 from procedural.incrementalgenerator import *
 from procedural.core.geneticinstance import *
+from grammar.parametric.growthmodel import GrowthModel
+from grammar.parametric.derivationbudget import DerivationBudget, BudgetExceededResult
+from grammar.parametric.derivationcheckpoints import DerivationCheckpoints
 
 import random
 
@@ -28,6 +37,7 @@ class GeneticEvolver:
     FILE_OUTPUT_PATH = "C:\\Users\\Michele\\Desktop\\"  + "evolution_output.txt"
     MAX_POSSIBLE_ITERATIONS = 1000
     GOOD_INITIAL_FITNESS = 4 # TODO: Choose how to compute this 'good fitness'!
+    LOWEST_FITNESS = -float('inf')  # Fitness of the lsystems whose derivation exceeded the derivationBudget: below any value of the fitness functions, which may be negative
 
     def __init__(self, turtle, verbose = False, mini_verbose = False, randomSeed = None):
         self.turtle = turtle
@@ -57,6 +67,10 @@ class GeneticEvolver:
 
         self.discardEmptyEvolutions = False  # If True, evolutions that result in an empty tree (0 vertices) are discarded and redone
         self.discardLSystemsLargerThan = 0  # If > 0, any lsystem evolved that has length higher than this will be discarded and redone
+        self.derivationBudget = None        # If not None, derivations exceeding this DerivationBudget are stopped, and their lsystems get the LOWEST_FITNESS
+        self.derivationCheckpoints = None   # If not None, all derivations share these DerivationCheckpoints, so unchanged lsystems (or lsystems with more iterations) reuse earlier derivations
+        self.fitnessVariants = 1            # If > 1, stochastic lsystems get the mean fitness of this many variants, derived together (see ParametricLSystem.iterateVariants)
+        self.parallelRewriter = None        # If not None, large deterministic derivations are rewritten in parallel by the workers of this ParallelRewriter. Its pool is closed after each evolution (see close)
 
     ######################
     #--- Setters
@@ -94,7 +108,7 @@ class GeneticEvolver:
         if self.verbose:
             print("\nInitial population:")
             for p in population:
-                pStringResult = p.lsystem.getResultPString()
+                pStringResult = self.getResultPStringOf(p.lsystem)
                 print("Fitness: " + str(p.fitness) + " pString: " + str(pStringResult))
 
         self.evolvePopulation(population,nIterations,targetFitness)
@@ -120,6 +134,11 @@ class GeneticEvolver:
             for i in range(nIterations):
                 population, candidate_instance = self.iterateEvolutionOnce(i, population)
         if self.writeToFile: self.file.close()
+        self.close()
+
+    def close(self):
+        """ Stops the worker processes of the parallel rewriter, if any. They are started again when needed. """
+        if self.parallelRewriter is not None: self.parallelRewriter.close()
 
 
     def iterateEvolutionOnce(self, iteration_index, population):
@@ -128,9 +147,12 @@ class GeneticEvolver:
         if self.writeToFile: self.file.write("\nIteration " + str(iteration_index))
         population = self.evolveStep(population)
         candidate_instance = self.getBestInstance()
-        pStringResult = candidate_instance.lsystem.getResultPString()
+        if self.verbose or self.writeToFile: pStringResult = self.getResultPStringOf(candidate_instance.lsystem)
         if self.verbose: print("Current Best Fitness: " + str(candidate_instance.fitness) + " pString: " + str(pStringResult))
-        if self.writeToFile: self.file.write("|"+str(candidate_instance.fitness) + "|" + str(pStringResult))
+        if self.writeToFile:
+            self.file.write("|"+str(candidate_instance.fitness) + "|")
+            if isinstance(pStringResult,BudgetExceededResult): self.file.write(str(pStringResult))
+            else: pStringResult.writeTo(self.file)
         return population, candidate_instance
 
     def evolveStep(self, population):
@@ -179,7 +201,7 @@ class GeneticEvolver:
                     recap += "\n\n    (Crossovered):"
                     for p in offspring_crossover:
                         recap += "\n"+p.toShortString()
-                        recap += "\n Fitness is " + str(self.currentFitnessFunction(p.lsystem.iterate()))
+                        recap += "\n Fitness is " + str(self.fitnessOf(p.lsystem.iterate(budget = self.derivationBudget)))
 
                 if self.mini_verbose:
                     print("\nCrossovered:")
@@ -218,9 +240,9 @@ class GeneticEvolver:
         for p in new_population:
             """print "\n\nRECOMPUTING: " + str(p)#.lsystem.getResultPString())
             p.lsystem.printGlobalDefinesStatus()"""
-            if p.fitness == 0:
-                p.lsystem.clearResultPString()    # We did some modifications and we thus need to re-compute the result pString!
-                p.fitness = self.currentFitnessFunction(p.lsystem.getResultPString())
+            if not p.hasValidFitness():
+                # The lsystem was modified (instances whose turtle parameters only were modified keep their result pString and fitness)
+                p.setFitness(self.fitnessOfLSystem(p.lsystem))
 
         # Re-sort according to fitness
         new_population = self.sortPopulation(new_population)
@@ -319,11 +341,11 @@ class GeneticEvolver:
         Generate the initial population by copying a single genetic instance.
         Also computes fitness (anc copies it).
         """
-        fitness = self.currentFitnessFunction(input_genetic_instance.lsystem.getResultPString())
+        fitness = self.fitnessOfLSystem(input_genetic_instance.lsystem)
         population = []
         for i in range(population_size):
             new_instance = GeneticInstance.copyFrom(input_genetic_instance)
-            new_instance.fitness = fitness
+            new_instance.setFitness(fitness)
             population.append(new_instance)
             if self.verbose:  print("Added to pop: " + new_instance.toShortString())
         return population
@@ -331,9 +353,15 @@ class GeneticEvolver:
     def createNewGeneticInstanceFromLsystem(self, new_lsystem):
         new_instance = GeneticInstance(new_lsystem)
         if self.consider_additional_parameters: new_instance.randomizeAdditionalParameters(self.rnd)
-        new_instance.fitness = self.currentFitnessFunction(new_lsystem.getResultPString())
+        new_instance.setFitness(self.fitnessOfLSystem(new_lsystem))
         return new_instance
 
+    def getResultPStringOf(self, lsystem):
+        """ Returns the result pString of a lsystem, derived within the derivation budget, with the shared checkpoints and parallel rewriter """
+        if self.derivationCheckpoints is not None: lsystem.checkpoints = self.derivationCheckpoints
+        if self.parallelRewriter is not None: lsystem.parallelRewriter = self.parallelRewriter
+        return lsystem.getResultPString(self.derivationBudget)
+
     ###########################
     #---Crossover
     ###########################
@@ -435,10 +463,6 @@ class GeneticEvolver:
         offspring1_instance = GeneticInstance(offspring1_lsystem)
         offspring2_instance = GeneticInstance(offspring2_lsystem)
 
-        # We clear the result pString since the offspring are different. TODO: do this whenever we modify a lsystem!!
-        offspring1_instance.lsystem.clearResultPString()
-        offspring1_instance.lsystem.clearResultPString()
-
         # We also need to perform crossover on the additional parameters
         if self.consider_additional_parameters:
             self.crossoverAdditionalParameters(offspring1_instance,offspring2_instance,inst1,inst2)
@@ -525,9 +549,7 @@ class GeneticEvolver:
         # We also need to perform mutation on the additional parameters!
         if self.consider_additional_parameters: mutated_instance.mutateAdditionalParameters(self.rnd)
 
-        # We clear the result pString since the offspring are different. TODO: do this whenever we modify a lsystem!!
-        mutated_instance.lsystem.clearResultPString()
-
+        # The result pString and the fitness are recomputed only if the lsystem was modified (see GeneticInstance.hasValidFitness)
         return mutated_instance
 
     ###########################
@@ -575,21 +597,26 @@ class GeneticEvolver:
     def selectRoulette(self, population, selectionSize):
         """
         Selects using the roulette wheel selection method.
-        @note: Make sure the fitness is never negative or it won't work correctly!
+        @note: Negative fitness (e.g. the LOWEST_FITNESS of lsystems that exceeded the derivation budget) counts as 0, so those instances are never selected.
+        If no instance has positive fitness, the other instances are selected with the same probability.
         """
         selected = []
+        validInstances = [instance for instance in population if instance.fitness > GeneticEvolver.LOWEST_FITNESS] or population
         for j in range(selectionSize):
             fitness_sum = 0
             for instance in population:
                 #print("Add fitness: " + str(instance.fitness))
-                fitness_sum += instance.fitness
+                fitness_sum += max(0,instance.fitness)
 
             #print("TOTAL FITNESS: " + str(fitness_sum))
+            if fitness_sum == 0:
+                selected.append(self.getRandomItemFromList(validInstances))
+                continue
             choice = self.rnd.random()*fitness_sum
             #print("Choice: " + str(choice))
             current_sum = 0
             for i in range(len(population)):
-                current_sum += population[i].fitness
+                current_sum += max(0,population[i].fitness)
                 if choice < current_sum:
                     selected.append(population[i])
                     #print("Selected: " + str(i))
@@ -628,18 +655,22 @@ class GeneticEvolver:
     def shouldDiscardLSystem(self,lsystem):
         """
         Sometimes, lsystems are not good enough and we discard them.
+        The lsystem is not derived: its length and number of F are predicted by a GrowthModel (expected values, for stochastic lsystems).
         """
         discard = False
+        predictedCounts = GrowthModel(lsystem).predictLetterCounts()
+        totalLength = sum(predictedCounts.values())
+        numberOfF = predictedCounts.get('F',0)
+
         if self.discardEmptyEvolutions:
-            pstring = lsystem.getResultPString()
-            actualModules = pstring.getActualModules()
-            totalLength = len(pstring)
-            numberOfF = len(list(filter(lambda m: m.letter == 'F',actualModules)))
             discard = discard or numberOfF == 0
 
         if self.discardLSystemsLargerThan > 0:
             discard = discard or totalLength > self.discardLSystemsLargerThan
 
+        if self.derivationBudget is not None and self.derivationBudget.maxModules is not None:
+            discard = discard or totalLength > self.derivationBudget.maxModules
+
         if self.verbose and discard: print("We should discard: Total length is " + str(totalLength) + " and number of F is " + str(numberOfF))
         return discard
 
@@ -664,7 +695,27 @@ class GeneticEvolver:
     ###########################
 
     def applyFitnessFunction(self, instance):
-        instance.fitness = self.currentFitnessFunction(instance.lsystem.iterate())
+        instance.setFitness(self.fitnessOf(instance.lsystem.iterate(budget = self.derivationBudget)))
+
+    def fitnessOfLSystem(self, lsystem):
+        """
+        Applies the current fitness function to the result of a lsystem.
+        With fitnessVariants, stochastic lsystems get the mean fitness of their variants, so that a lucky derivation does not decide their fitness.
+        """
+        if self.fitnessVariants > 1 and lsystem.isStochastic():
+            variants = lsystem.iterateVariants(self.fitnessVariants, budget = self.derivationBudget)
+            return sum([self.fitnessOf(pString) for pString in variants])/len(variants)
+        return self.fitnessOf(self.getResultPStringOf(lsystem))
+
+    def fitnessOf(self, pString):
+        """
+        Applies the current fitness function to a derived pString.
+        Derivations that exceeded their budget get the LOWEST_FITNESS, so they are sorted after any valid derivation and never selected.
+        """
+        if isinstance(pString,BudgetExceededResult):
+            if self.mini_verbose: print(str(pString))
+            return GeneticEvolver.LOWEST_FITNESS
+        return self.currentFitnessFunction(pString)
 
     def defaultFitnessFunction(self, pString, verbose = False):
         """
@@ -679,10 +730,9 @@ class GeneticEvolver:
         """
         fitness = 0
 
-        turtleResult = self.turtle.draw(pString.toString())
-        verts = turtleResult.verts
+        measures = self.turtle.measure(pString)
 
-        s = "pString: " + str(pString) +"\n"
+        if verbose: s = "pString: " + str(pString) +"\n"
 
         # Weights
         length_weight = -0.01
@@ -693,26 +743,26 @@ class GeneticEvolver:
         # Constraint on length of the resulting pString
         delta_fitness = len(pString)*len(pString)
         fitness += delta_fitness * length_weight
-        s+= " | Length: " + str(delta_fitness)
+        if verbose: s += " | Length: " + str(delta_fitness)
 
         # Positive phototropism (tall tree)
-        if len(verts) == 0:
+        if measures.nVerts == 0:
             delta_fitness = 0
         else:
-            delta_fitness = max([v.z for v in verts])
+            delta_fitness = measures.maxZ
         fitness += delta_fitness*phototropism_weight
-        s+= " | Tall: " + str(delta_fitness)
+        if verbose: s += " | Tall: " + str(delta_fitness)
 
         # Bilateral simmetry (balanced tree)
-        if len(verts) == 0:
+        if measures.nVerts == 0:
             delta_fitness = 0
             balance_x = 0
             balance_y = 0
         else:
-            span_x_pos = max([v.x for v in verts])
-            span_x_neg = -min([v.x for v in verts])
-            span_y_pos = max([v.y for v in verts])
-            span_y_neg = -min([v.y for v in verts])
+            span_x_pos = measures.maxX
+            span_x_neg = -measures.minX
+            span_y_pos = measures.maxY
+            span_y_neg = -measures.minY
 
             # We want the trees to have a balanced appearance:
             if span_x_pos == 0 or span_x_neg == 0:
@@ -743,7 +793,7 @@ class GeneticEvolver:
 
             delta_fitness = balance_x+balance_y
         fitness += delta_fitness*simmetry_weight
-        s+= " | Span: " + str(delta_fitness)
+        if verbose: s += " | Span: " + str(delta_fitness)
 
         # Light gathering ability (leaves at the ends)
         # TODO!
@@ -756,8 +806,9 @@ class GeneticEvolver:
 
         fitness = fitness/(phototropism_weight+simmetry_weight+length_weight)
 
-        s += "| Tot: " + str(fitness)
-        print(s)
+        if verbose:
+            s += "| Tot: " + str(fitness)
+            print(s)
 
         return fitness
 
@@ -773,7 +824,7 @@ class GeneticEvolver:
         fitness = 0
         if len(pString) == 0: return -100 # Bad, nothing has been generated at all!
 
-        s = "pString: " + str(pString) +"\n"
+        if verbose: s = "pString: " + str(pString) +"\n"
 
         # Modifiers
         branches_modifier = 0
@@ -816,7 +867,7 @@ class GeneticEvolver:
                 nBranches+=1
         delta_fitness = nBranches*branches_modifier
         #fitness += delta_fitness
-        s += "| BR "+str(delta_fitness)
+        if verbose: s += "| BR "+str(delta_fitness)
 
         # Not too long resulting pstring -> High fitness
         # We do not count branching modules!
@@ -827,93 +878,92 @@ class GeneticEvolver:
         if  length < length_offset:  delta_fitness = 0
         else: delta_fitness = (length-length_offset)*(length-length_offset)*length_modifier
         fitness += delta_fitness
-        s += "| L: " + str(delta_fitness)
+        if verbose: s += "| L: " + str(delta_fitness)
 
         # Lots of F!
         numberOfF = len(list(filter(lambda p: 'F' in str(p), pString)))
         delta_fitness = numberOfF*f_modifier
         fitness += delta_fitness
-        s += "| NF: " + str(delta_fitness)
+        if verbose: s += "| NF: " + str(delta_fitness)
 
         # Lots of + and -!
         numberOfRot = len(list(filter(lambda p: '+' in str(p) or '-' in str(p), pString)))
         delta_fitness = numberOfRot*rot_modifier
         fitness += delta_fitness
-        s += "| NRot: " + str(delta_fitness)
+        if verbose: s += "| NRot: " + str(delta_fitness)
 
         # Lots of leaves!
         numberOfLeaves = len(list(filter(lambda p: 'L' in str(p), pString)))
         delta_fitness = numberOfLeaves*leaves_modifier
         delta_fitness /= len(pString) # This makes it more or less normalized
         fitness += delta_fitness
-        s += "| NLeaves: " + str(delta_fitness)
+        if verbose: s += "| NLeaves: " + str(delta_fitness)
 
         # Fitness based on the resulting tree
         statisticsContainer = []
-        turtleResult = self.turtle.draw(str(pString), statisticsContainer = statisticsContainer)
-        verts = turtleResult.verts
+        measures = self.turtle.measure(pString, statisticsContainer = statisticsContainer)    # Only the aggregates of the tree are needed
 
         trunkWeight = statisticsContainer[0]
         delta_fitness = trunkWeight*trunk_weight_modifier
         fitness += delta_fitness
-        s +=  "| TrunkW: " + str(delta_fitness)
+        if verbose: s += "| TrunkW: " + str(delta_fitness)
 
         branchWeight = statisticsContainer[1]
         delta_fitness = branchWeight*branch_weight_modifier
         fitness += delta_fitness
-        s +=  "| BranchW: " + str(delta_fitness)
+        if verbose: s += "| BranchW: " + str(delta_fitness)
 
         undergroundWeight = statisticsContainer[2]
         delta_fitness = undergroundWeight*underground_modifier
         fitness += delta_fitness
-        s +=  "| Under: " + str(delta_fitness)
+        if verbose: s += "| Under: " + str(delta_fitness)
 
         endLeavesWeight = statisticsContainer[3]
         delta_fitness = endLeavesWeight*end_leaves_modifier
         fitness += delta_fitness
-        s +=  "| EndLeaves: " + str(delta_fitness)
+        if verbose: s += "| EndLeaves: " + str(delta_fitness)
 
         fruitsWeight = statisticsContainer[4]
         delta_fitness = fruitsWeight*fruits_modifier
         fitness += delta_fitness
-        s +=  "| Fruits: " + str(delta_fitness)
+        if verbose: s += "| Fruits: " + str(delta_fitness)
 
         branchSizeRatio = statisticsContainer[5]
         delta_fitness = branchSizeRatio*branch_size_ratio_modifier
         fitness += delta_fitness
-        s +=  "| Size Ratio: " + str(delta_fitness)
+        if verbose: s += "| Size Ratio: " + str(delta_fitness)
 
 
         # We want tall trees (high max z)
-        if len(verts) == 0:
+        if measures.nVerts == 0:
             delta_fitness = 0
         else:
-            delta_fitness = max([v.z for v in verts])
-            delta_fitness /= len(verts) # This makes it more or less normalized
+            delta_fitness = measures.maxZ
+            delta_fitness /= measures.nVerts # This makes it more or less normalized
         tall_fitness = delta_fitness
         delta_fitness *= tall_modifier
         fitness += delta_fitness
-        s +=  "| Tall: " + str(delta_fitness)
+        if verbose: s += "| Tall: " + str(delta_fitness)
 
         # We want trees high towards the value
-        if len(verts) == 0:
+        if measures.nVerts == 0:
             delta_fitness = 0
         else:
-            delta_fitness = 10-abs(target_height-max([v.z for v in verts]))
+            delta_fitness = 10-abs(target_height-measures.maxZ)
         fitness += delta_fitness
-        s += " | Tall target: " + str(delta_fitness)
+        if verbose: s += " | Tall target: " + str(delta_fitness)
 
         # We want trees that span out (high minimum span on y and x)
-        if len(verts) == 0:
+        if measures.nVerts == 0:
             delta_fitness = 0
             balance_x = 0
             balance_y = 0
 
         else:
-            span_x_pos = max([v.x for v in verts])
-            span_x_neg = -min([v.x for v in verts])
-            span_y_pos = max([v.y for v in verts])
-            span_y_neg = -min([v.z for v in verts])
+            span_x_pos = measures.maxX
+            span_x_neg = -measures.minX
+            span_y_pos = measures.maxY
+            span_y_neg = -measures.minZ
 
             # We want the trees to have a balanced appearance
 
@@ -959,28 +1009,29 @@ class GeneticEvolver:
         span_fitness = delta_fitness
         delta_fitness *= span_modifier
         fitness += delta_fitness
-        s +=  "| Span: " + str(delta_fitness)
+        if verbose: s += "| Span: " + str(delta_fitness)
 
-        if len(verts) > 0:
+        if measures.nVerts > 0:
             # We want trees spanning towards the target value, on all four directions
             delta_fitness = 10 - abs(target_volume_span-span_x_pos) -  abs(target_volume_span-span_x_neg)  -  abs(target_volume_span-span_y_pos)  -  abs(target_volume_span-span_y_neg)
             #avg_span = (span_x_pos+span_y_pos + span_x_neg + span_y_neg)/4
             #delta_fitness = 10-abs(target_volume_span-avg_span)
             fitness += delta_fitness
-            s += " | Span target: " + str(delta_fitness)
+            if verbose: s += " | Span target: " + str(delta_fitness)
 
         #fitness *= tall_fitness
         #fitness *= span_fitness
         delta_fitness = (tall_fitness*tall_fitness*span_fitness*span_fitness)*tallspan_modifier
         fitness += delta_fitness
-        s +=  "| TallSpan: " + str(delta_fitness)
+        if verbose: s += "| TallSpan: " + str(delta_fitness)
 
         delta_fitness = (balance_x*balance_y)*balance_modifier
         fitness += delta_fitness
-        s +=  "| Balance: " + str(delta_fitness)
+        if verbose: s += "| Balance: " + str(delta_fitness)
 
-        s+= "\nTot fitness: " + str(fitness)
-        if verbose: print(s)
+        if verbose:
+            s += "\nTot fitness: " + str(fitness)
+            print(s)
 
         #print("Tall: " + str(tall_fitness) + "  Span: " + str(span_fitness))
         #print("Fitness: " + str(p.fitness) + " pString: " + str(pStringResult))
@@ -1076,6 +1127,25 @@ if __name__ == "__main__":
             print("\n" + mutated_instance.toShortString())
 
 
+        def testBudgetFitness(self):
+            print("\n\nTEST - Budget Fitness")
+            self.evolver.currentFitnessFunction = self.evolver.ochoaFitnessFunction
+            self.evolver.derivationBudget = DerivationBudget(maxModules = 100)
+            population = []
+            for axiom in ["F(1)", "-(90)-(90)-(90)", "A(1)"]:
+                instance = GeneticInstance(ParametricLSystem())
+                instance.lsystem.setAxiomFromString(axiom)
+                instance.lsystem.addProductionFromString("A(x):*->A(x)A(x)")
+                instance.lsystem.niterations = 8
+                self.evolver.applyFitnessFunction(instance)
+                population.append(instance)
+            for instance in self.evolver.sortPopulation(population): print(str(instance.lsystem.axiom) + " fitness: " + str(instance.fitness))
+            print("Over budget is last: " + str(population[-1].fitness == GeneticEvolver.LOWEST_FITNESS))
+            selected = self.evolver.selectRoulette(population, 20)
+            print("Over budget selected: " + str(any(instance.fitness == GeneticEvolver.LOWEST_FITNESS for instance in selected)))
+            self.evolver.currentFitnessFunction = self.evolver.defaultFitnessFunction
+            self.evolver.derivationBudget = None
+
         def testEvolution(self, populationSize, nIterations, targetFitness):
             print("\n\nTEST - Evolution")
             self.evolver.verbose = False
@@ -1099,6 +1169,7 @@ if __name__ == "__main__":
     #t.testPopulationGenerationAutomated(10)
     t.testEvolution(populationSize = popSize, nIterations=nIterations, targetFitness = targetFitness)
 
+    t.testBudgetFitness()
     #t.testCrossover()
     #t.testMutation()
 
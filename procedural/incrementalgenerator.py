@@ -314,6 +314,7 @@ class IncrementalGenerator(RandomGenerator):
                     #if len(chosen_module.params) > 0:
                     index = self.rnd.randint(0,len(chosen_module.params)-1)
                     chosen_module.params[index] = param
+                successor.modulesChanged()
 
     # Parameters
 
@@ -362,6 +363,7 @@ class IncrementalGenerator(RandomGenerator):
             changeTo = str(changeTo) + "*" + str(Utilities.getRandomTwoDigitFloat(self.rnd,0.5,2.0))
 
         module.params[choice] = changeTo
+        pString.modulesChanged()
         #print("We changed it to: " + str(changeTo))
 
         #print("The resulting pString is: " + str(pString))
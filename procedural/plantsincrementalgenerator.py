@@ -351,30 +351,30 @@ class PlantsIncrementalGenerator(IncrementalGenerator):
     def removeFirstBranch(self,input_pstring):
         """ Given a pString, removes the first branch we find """
         output_pstring = ParametricString.copyFrom(input_pstring)
-        i = 0
         start_index = None
-        for m in input_pstring.modulesList:
-            if m.isOpenBracket():   # Will take the innermost open bracket
-                start_index = i
-            elif m.isClosedBracket():
+        for i in range(len(input_pstring)):
+            if input_pstring[i].isClosedBracket():
+                start_index = input_pstring.getMatchingBracketIndex(i)  # The innermost open bracket
                 end_index = i+1
                 break
-            i += 1
         if start_index is None:
             print("Remove first branch failed: there are no branches here!")
             return output_pstring
-        if start_index == 0 and end_index == len(input_pstring.modulesList):
+        if start_index == 0 and end_index == len(input_pstring):
             print("Remove first branch failed: the whole production is a branch!")
             return output_pstring
         output_pstring.removeModulesFromTo(start_index,end_index)
         return output_pstring
 
     def removeDuplicatesOf(self,chosen_letter):
-        for production in self.lsystem.productions:
+        for index in range(len(self.lsystem.productions)):
+            modules = self.lsystem.getProduction(index).successor.getActualModules()
+            if not any(modules[i].letter == chosen_letter and modules[i-1].letter == chosen_letter for i in range(1,len(modules))): continue
+            production = self.lsystem.getModifiableProduction(index)
             modules = production.successor.getActualModules()
             for i in range(len(modules)-1,0,-1):
                 if modules[i].letter == chosen_letter and modules[i].letter == modules[i-1].letter:
-                    production.successor.modulesList.remove(modules[i])
+                    production.successor.removeModule(modules[i])
 
     def changeModuleFromLetterToPString(self,input_pstring,from_letter,to_pstring):
         """ Changes a module into the given pString """
@@ -394,11 +394,12 @@ class PlantsIncrementalGenerator(IncrementalGenerator):
                     for i in range(len(from_module.params)):
                         if i < len(to_modules[j].params):
                             to_modules[j].params[i] = from_module.params[i]
+            to_pstring.modulesChanged()
 
-        change_index = input_pstring.modulesList.index(from_module)
-        del output_pstring.modulesList[change_index]
+        change_index = input_pstring.index(from_module)
+        output_pstring.removeModulesFromTo(change_index,change_index+1)
         for to_module in to_pstring:
-            output_pstring.modulesList.insert(change_index,to_module)
+            output_pstring.insertModule(change_index,to_module)
             change_index+=1
         return output_pstring
 
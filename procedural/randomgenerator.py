@@ -280,6 +280,7 @@ class RandomGenerator():
                     #if len(chosen_module.params) > 0:
                     index = self.rnd.randint(0,len(chosen_module.params)-1)
                     chosen_module.params[index] = param
+                pstring.modulesChanged()
 
         return pstring
 
@@ -299,7 +300,7 @@ class RandomGenerator():
     # Productions
 
     def getProduction(self,i):
-        return self.lsystem.productions[i]
+        return self.lsystem.getModifiableProduction(i)
 
     def addExistingProduction(self,prod):
         self.lsystem.addExistingProduction(prod)
@@ -324,8 +325,7 @@ class RandomGenerator():
         @param redistribute: If True and the deleted production was stochastic, the remaining value is redistributed.
         @type redistribute: bool
         """
-        deleted_production = self.lsystem.productions[index]
-        del  self.lsystem.productions[index]
+        deleted_production = self.lsystem.removeProduction(index)
 
         if redistribute:
             # If this production was stochastic, we need to redistribute its weight to the other productions with the same predecessor
@@ -340,8 +340,10 @@ class RandomGenerator():
     def redistributeStochasticValue(self,predecessor_letter,redistributed_value,excludedProduction=None):
         remaining_value = 1-redistributed_value
         print("Redistributing weight: the weight to distribute is " + str(redistributed_value) + " and the remanining weight is " + str(remaining_value))
-        for prod in self.lsystem.productions:
+        for i in range(len(self.lsystem.productions)):
+            prod = self.lsystem.productions[i]
             if prod.predecessor.letter == predecessor_letter and prod != excludedProduction:
+                prod = self.lsystem.getModifiableProduction(i)
                 print("Production has value " + str(prod.condition.value))
                 prod.condition.value = round((prod.condition.value+prod.condition.value/redistributed_value*redistributed_value)*100)/100.0
                 print("Production is thus given value " + str(prod.condition.value))
@@ -358,7 +360,7 @@ class RandomGenerator():
                                     doNotConsiderProductionWithPredecessor=None,
                                     containsBranches = None):
         """
-        Returns one of the existing productions.
+        Returns one of the existing productions, ready to be modified.
         Ignores productions that reached maxLength with their successor.
         Returns None if no production exists
         """
@@ -368,7 +370,7 @@ class RandomGenerator():
 
         production_index = self.getRandomItemFromList(availableIndices)
         if len(availableIndices) == 0: return None, -1
-        return self.lsystem.productions[production_index], production_index
+        return self.lsystem.getModifiableProduction(production_index), production_index
 
     def getAllProductionIndicesWith(self, maxLength = None, containedLetters=[],
                                     atLeastCountLetters = 1,
@@ -398,9 +400,10 @@ class RandomGenerator():
 
 
     def getRandomExistingStochasticProduction(self):
-        def isStochastic(production): return production.condition.type == '#'
-        prods = list(filter(isStochastic,self.lsystem.productions))
-        return self.getRandomItemFromList(prods)
+        def isStochastic(i): return self.lsystem.productions[i].condition.type == '#'
+        indices = list(filter(isStochastic,range(len(self.lsystem.productions))))
+        if len(indices) == 0: return None
+        return self.lsystem.getModifiableProduction(self.getRandomItemFromList(indices))
 
     # Various
     def getRandomItemFromList(self,list):
@@ -433,7 +436,7 @@ class RandomGenerator():
 
     def appendModuleToPstring(self,new_module,pString):
         pString = ParametricString.copyFrom(pString)
-        pString.modulesList.append(new_module)
+        pString.insertModule(len(pString),new_module)
         if new_module.letter not in self.currentlyUsedLetters:  self.currentlyUsedLetters.append(new_module.letter)
         return pString
 
@@ -444,7 +447,7 @@ class RandomGenerator():
     def insertModuleIntoPstringRandomly(self,new_module,pString):
         pString = ParametricString.copyFrom(pString)
         index = self.rnd.randint(0,len(pString))    # Max is len(pString) so that we can also insert at the end
-        pString.modulesList.insert(index,new_module)
+        pString.insertModule(index,new_module)
         if new_module.letter not in self.currentlyUsedLetters:  self.currentlyUsedLetters.append(new_module.letter)
         return pString
 
@@ -459,7 +462,7 @@ class RandomGenerator():
         new_module = self.generateWeightedRandomModule()#parametric=True)
         index = self.rnd.randint(0,len(pString))    # Max is len(pString) so that we can also insert at the end
         #print("From string " + str(pString) + " we add at index " + str(index) + " a new Module " + str(new_module))
-        pString.modulesList.insert(index,new_module)
+        pString.insertModule(index,new_module)
         #print("Result: " + str(pString))
 
         if new_module.letter not in self.currentlyUsedLetters:
@@ -479,7 +482,7 @@ class RandomGenerator():
         if module in input_pstring.modulesList:
             index = input_pstring.index(module)
             removeBrackets = self.checkBracketsRemoval(index,output_pstring)
-            del output_pstring.modulesList[index]
+            output_pstring.removeModulesFromTo(index,index+1)
             if removeBrackets: self.performBracketsRemoval(index,output_pstring)
         return output_pstring
 
@@ -504,9 +507,9 @@ class RandomGenerator():
         removeBrackets = True
         while removeBrackets is True:
             #print("Now pString is " + str(pString))
-            del pString.modulesList[index]
+            pString.removeModulesFromTo(index,index+1)
             #print("Now pString is " + str(pString))
-            del pString.modulesList[index-1]
+            pString.removeModulesFromTo(index-1,index)
             #print("Now pString is " + str(pString))
             #if len(pString) > 0: print("At left we now have " + str(pString[index-2]))
 
@@ -530,7 +533,7 @@ class RandomGenerator():
 
         # We also remove the brackets if no other module is there
         removeBrackets = self.checkBracketsRemoval(index, pString)
-        del pString.modulesList[index]
+        pString.removeModulesFromTo(index,index+1)
         if removeBrackets: self.performBracketsRemoval(index, pString)
         #TODO: Do something if we completely remove this production
         return pString
@@ -557,7 +560,7 @@ class RandomGenerator():
                     new_module.params[i] = module_to_change.params[i]
 
         #print("From string " + str(string) + " we change module " + str(string[index]) + " at index " + str(index) + " to a new module " + new_module)
-        pString.modulesList[pString.modulesList.index(module_to_change)] = new_module
+        pString.replaceModuleAt(pString.index(module_to_change),new_module)
         #print("Result: " + string)
         return pString
 
@@ -0,0 +1,395 @@
+"""
+    A Turtle that draws L-system structures into flat arrays.
+
+    @author: Michele Pirovano
+    @copyright: 2013-2015
+"""
+
+import turtles.turtle
+
+import imp
+imp.reload(turtles.turtle)
+
+from turtles.turtle import *
+
+from array import array
+from math import cos,sin,atan2,asin,sqrt,pi
+import random
+
+
+class DetailArrays:
+    """
+    The positions and orientations (in euler angles) of a kind of detail, as flat arrays of x,y,z values.
+    """
+    def __init__(self):
+        self.positions = array('d')
+        self.orientations = array('d')
+
+    def append(self, x, y, z, ex, ey, ez):
+        self.positions.extend((x,y,z))
+        self.orientations.extend((ex,ey,ez))
+
+    def toQuads(self):
+        return [Quad(Vector(self.positions[i:i+3]),Euler(self.orientations[i:i+3])) for i in range(0,len(self.positions),3)]
+
+    def __len__(self):
+        return len(self.positions)//3
+
+class TurtleArrays:
+    """
+    The results of drawing with an ArrayTurtle.
+    Vertices are a flat array of x,y,z values, edges a flat array of pairs of vertex indices, and radii an array with a radius for each vertex.
+    Leaves, bulbs, flowers and fruits are DetailArrays.
+    """
+    def __init__(self, instance_index):
+        self.instance_index = instance_index
+        self.verts = array('d')
+        self.edges = array('l')
+        self.radii = array('d')
+        self.leaves = DetailArrays()
+        self.bulbs = DetailArrays()
+        self.flowers = DetailArrays()
+        self.fruits = DetailArrays()
+
+    keepsDetails = True
+
+    def addVertex(self, x, y, z, radius):
+        self.verts.extend((x,y,z))
+        self.radii.append(radius)
+
+    def addEdge(self, a, b):
+        self.edges.extend((a,b))
+
+    def addDetail(self, c, x, y, z, ex, ey, ez):
+        (self.leaves if c == "L" else self.bulbs if c == "B" else self.flowers if c == "K" else self.fruits).append(x,y,z,ex,ey,ez)
+
+    def getUndergroundWeight(self):
+        undergroundWeight = 0
+        for k in range(2,len(self.verts),3):
+            if self.verts[k] < 0: undergroundWeight += (-self.verts[k])
+        return undergroundWeight
+
+    def nVerts(self):
+        return len(self.radii)
+
+    def toNumpy(self):
+        """
+        Views the arrays as NumPy arrays, without copying them.
+
+        @note: Needs NumPy, which is shipped with Blender.
+
+        @return: A dictionary with 'verts' (N,3), 'edges' (M,2), 'radii' (N,), and a (positions (n,3), orientations (n,3)) pair for 'leaves', 'bulbs', 'flowers' and 'fruits'
+        @rtype: dict
+        """
+        import numpy
+        def view(values, columns):
+            return numpy.frombuffer(values,dtype = values.typecode).reshape(-1,columns)
+        arrays = {"verts": view(self.verts,3), "edges": view(self.edges,2), "radii": numpy.frombuffer(self.radii,dtype = 'd')}
+        for name in ("leaves","bulbs","flowers","fruits"):
+            details = getattr(self,name)
+            arrays[name] = (view(details.positions,3),view(details.orientations,3))
+        return arrays
+
+    def toTurtleResult(self):
+        """
+        @return: The same results as those drawn by a Turtle
+        @rtype: TurtleResult
+        """
+        verts = [Vector(self.verts[i:i+3]) for i in range(0,len(self.verts),3)]
+        edges = [[self.edges[i],self.edges[i+1]] for i in range(0,len(self.edges),2)]
+        return TurtleResult(self.instance_index,verts,edges,list(self.radii),
+                            self.leaves.toQuads(),self.bulbs.toQuads(),self.flowers.toQuads(),self.fruits.toQuads())
+
+    def __str__(self):
+        s = "\nTurtle Arrays:"
+        s += "\nVerts: " + str(self.nVerts())
+        s += "\nEdges: " + str(len(self.edges)//2)
+        return s
+
+class ArrayTurtle(Turtle):
+    """
+    A Turtle that draws into flat arrays (see TurtleArrays), with the same results and statistics as the Turtle.
+
+    The state of the turtle is kept in floats: no Vector, Euler or Quaternion is created for each character,
+    and the rotations of the Turtle (see Vector.rotateEul, Turtle.getQuaternionBetween and Quaternion.to_euler) are expanded in place.
+    draw returns a TurtleResult, so an ArrayTurtle can replace a Turtle. Use drawArrays to skip building it.
+    """
+
+    # Axis of each rotation character, see Turtle.draw
+    ROTATION_AXES = {'+':(1,0,0), '-':(-1,0,0), '&':(0,1,0), '^':(0,-1,0), '\\':(0,0,1), '/':(0,0,-1)}
+
+    def draw(self, structure, instance_index = 0, statisticsContainer = None):
+        return self.drawArrays(structure,instance_index,statisticsContainer).toTurtleResult()
+
+    def drawArrays(self, structure, instance_index = 0, statisticsContainer = None):
+        """
+        Same as draw, into flat arrays.
+
+        @rtype: TurtleArrays
+        """
+        return self.trace(structure,statisticsContainer,TurtleArrays(instance_index))
+
+    def measure(self, structure, instance_index = 0, statisticsContainer = None):
+        """
+        Same as Turtle.measure, without drawing: only the aggregates of the results are kept, as they are drawn.
+        No vertex, edge or detail is stored, so the memory used depends only on the depth of the branches.
+
+        @rtype: TurtleMeasures
+        """
+        return self.trace(structure,statisticsContainer,TurtleMeasures(instance_index))
+
+    def trace(self, structure, statisticsContainer, output):
+        """
+        Moves the turtle along a structure, passing the vertices, edges and details to the output (see TurtleArrays and TurtleMeasures).
+
+        @return: The output
+        """
+        tokens = self.getTokens(structure)
+        instance_index = output.instance_index
+        addVertex = output.addVertex
+        addEdge = output.addEdge
+        addDetail = output.addDetail
+        detailCounts = {"L": 0, "B": 0, "K": 0, "R": 0}
+        endDetailsCounts = {"L": 0, "B": 0, "K": 0, "R": 0}
+        detailsCount = 0
+
+        # Each instance has a different seed (for randomization). Random values are re-used by index, see Turtle.getRandom
+        self.rnd = random.Random()
+        if self.randomSeed: self.rnd.seed(self.randomSeed+instance_index)
+        self.randoms = []
+        randoms = self.randoms
+        uniform = self.rnd.uniform
+
+        saveStatistics = statisticsContainer is not None
+        maxBranchWeightStatistic = 0
+        rotationAxes = ArrayTurtle.ROTATION_AXES
+        tropismSusceptibility = self.tropism_susceptibility
+        tx, ty, tz = self.tropism
+        elasticity = 1
+
+        # The state of the turtle
+        last_i = 0
+        tot_i = 0
+        x = y = z = 0
+        ex = ey = ez = 0
+        bx = by = bz = 0    # Euler of the last branch
+        current_radius = self.defaultRadius
+        stack = []
+
+        branch_depth = 0
+        branch_sizes = [self.defaultRadius]
+        branch_lengths = [0]
+
+        # Details are end points if no F or branch follows them before their branch closes, see Turtle.draw
+        pendingDetails = []
+        def placePendingDetails(isEndPoint):
+            nonlocal detailsCount
+            heuristic = self.heuristic_details_orientations
+            for c, dx, dy, dz, dex, dey, dez in pendingDetails:
+                if heuristic:
+                    if c == "R": dex, dey, dez = 0, 0, 0                # Oriented towards the ground
+                    else: dex, dey, dez = bx, by, bz                    # Oriented with the last branch (see Turtle.orientWithBranch)
+                addDetail(c,dx,dy,dz,dex,dey,dez)
+                detailCounts[c] += 1
+                if isEndPoint: endDetailsCounts[c] += 1
+                detailsCount += 1
+            del pendingDetails[:]
+
+        firstPointAdded = False
+        for c, param, i in tokens:
+            if c == 'F' or c == '[' or c == ']':
+                if pendingDetails: placePendingDetails(c == ']')
+
+            if c == 'F':
+                # Go forward, drawing an edge
+                value = float(param) if param is not None else self.step
+                if last_i >= len(randoms):
+                    rndValue = uniform(-1,+1)
+                    randoms.append(rndValue)
+                else: rndValue = randoms[last_i]
+                value = value + value*rndValue*self.lengthNoise
+
+                # Heading: the up vector rotated by the euler angles (see Vector.rotateEul)
+                dy = 0*cos(ex) - 1*sin(ex)
+                dz = 0*sin(ex) + 1*cos(ex)
+                dx = 0*cos(ey) - dz*sin(ey)
+                dz = 0*sin(ey) + dz*cos(ey)
+                dx, dy = dx*cos(ez) + dy*sin(ez), -dx*sin(ez) + dy*cos(ez)
+
+                if tropismSusceptibility > 0:
+                    # Bend towards the tropism vector (see Turtle.getQuaternionBetween and Vector.rotateQuat)
+                    if self.elasticityDependsOnBranchRadius: elasticity = 1/current_radius
+                    ux, uy, uz = tx*(tropismSusceptibility*elasticity), ty*(tropismSusceptibility*elasticity), tz*(tropismSusceptibility*elasticity)
+                    qx, qy, qz = dy*uz - dz*uy, dz*ux - dx*uz, dx*uy - dy*ux
+                    qw = 1.0 + (dx*ux + dy*uy + dz*uz)
+                    mag = sqrt(qw*qw + qx*qx + qy*qy + qz*qz)
+                    if mag == 0: qw = qx = qy = qz = 0
+                    else: qw, qx, qy, qz = qw/mag, qx/mag, qy/mag, qz/mag
+                    qxsq, qysq, qzsq = qx*qx, qy*qy, qz*qz
+                    dx, dy, dz = (dx*(1-2*qysq-2*qzsq)+dy*(2*(qx*qy-qw*qz))+dz*(2*(qx*qz+qw*qy)),
+                                  dx*(2*(qx*qy+qw*qz))+dy*(1-2*qxsq-2*qzsq)+dz*(2*(qy*qz-qw*qx)),
+                                  dx*(2*(qx*qz-qw*qy))+dy*(2*(qy*qz+qw*qx))+dz*(1-2*qxsq-2*qysq))
+
+                # New euler angles: the rotation from up to the heading (see Quaternion.to_euler)
+                qx, qy, qz = 0*dz - 1*dy, 1*dx - 0*dz, 0*dy - 0*dx
+                qw = 1.0 + (0*dx + 0*dy + 1*dz)
+                mag = sqrt(qw*qw + qx*qx + qy*qy + qz*qz)
+                if mag != 0:
+                    qw, qx, qy, qz = qw/mag, qx/mag, qy/mag, qz/mag
+                    if qx != 0 or qy != 0 or qz != 0:
+                        test = qx*qy*qz*qw
+                        if test > 0.4999:
+                            ex, ey, ez = pi*0.5, 2*atan2(qx,qw), 0
+                        elif test < -0.4999:
+                            ex, ey, ez = -pi*0.5, 2*atan2(qx,qw), 0
+                        else:
+                            sqw, sqx, sqy, sqz = qw*qw, qx*qx, qy*qy, qz*qz
+                            ex = atan2(2.0*(qy*qz + qx*qw),(-sqx - sqy + sqz + sqw))
+                            ey = asin(2.0*(qx*qz - qy*qw))
+                            ez = atan2(-2.0*(qx*qy + qz*qw),(sqx - sqy - sqz + sqw))
+
+                # Add the first point now, if needed
+                if not firstPointAdded:
+                    addVertex(x,y,z,current_radius)
+                    firstPointAdded = True
+
+                # Add the new point
+                x, y, z = x+dx*value, y+dy*value, z+dz*value
+                addVertex(x,y,z,current_radius)
+
+                tot_i += 1
+                addEdge(last_i,tot_i)
+                last_i = tot_i
+                bx, by, bz = ex, ey, ez
+
+                if saveStatistics:
+                    branch_lengths[branch_depth] += 1
+                    branch_sizes[branch_depth] += current_radius
+
+            elif c in rotationAxes:
+                # See Turtle.changeOrientation
+                value = float(param) if param is not None else self.angle
+                if i >= len(randoms):
+                    rndValue = uniform(-1,+1)
+                    randoms.append(rndValue)
+                else: rndValue = randoms[i]
+                value = value + (self.angleNoise*rndValue)*value
+                value = value/180*pi
+                ax, ay, az = rotationAxes[c]
+                ex, ey, ez = ex+ax*value, ey+ay*value, ez+az*value
+            elif c == '|':
+                ex += pi
+
+            elif c == '[':
+                # Open a new branch
+                stack.append((x,y,z,ex,ey,ez,last_i,current_radius))
+                branch_depth += 1
+                if len(branch_lengths) <= branch_depth:
+                    branch_lengths.append(0)
+                    branch_sizes.append(current_radius)
+                else:
+                    branch_lengths[branch_depth] = 0
+                    branch_sizes[branch_depth] = current_radius
+
+            elif c == ']':
+                # Close the latest open branch
+                if saveStatistics and branch_lengths[branch_depth] > maxBranchWeightStatistic:
+                    maxBranchWeightStatistic = branch_lengths[branch_depth]
+                branch_depth -= 1
+                x, y, z, ex, ey, ez, last_i, current_radius = stack.pop()
+
+            elif c == "L" or c == "B" or c == "K" or c == "R":
+                pendingDetails.append((c,x,y,z,ex,ey,ez))
+
+        placePendingDetails(True)
+
+        if saveStatistics: self.appendStatistics(statisticsContainer,output,branch_lengths,branch_sizes,maxBranchWeightStatistic,detailCounts,endDetailsCounts,detailsCount)
+        return output
+
+    def appendStatistics(self, statisticsContainer, output, branch_lengths, branch_sizes, maxBranchWeightStatistic, detailCounts, endDetailsCounts, detailsCount):
+        """ Appends the statistics of a drawing to the container, in the order of Turtle.draw """
+        statisticsContainer.append(branch_lengths[0])
+        statisticsContainer.append(maxBranchWeightStatistic)
+        statisticsContainer.append(output.getUndergroundWeight())
+
+        tot_details = detailCounts["L"]+detailCounts["B"]+detailCounts["K"]
+        if tot_details > 0: endDetails = (endDetailsCounts["L"] + endDetailsCounts["B"] + endDetailsCounts["K"])/tot_details
+        else: endDetails = 0
+        statisticsContainer.append(endDetails)
+
+        if detailsCount > 0: fruitsRatio = endDetailsCounts["R"]/detailsCount
+        else: fruitsRatio = 0
+        statisticsContainer.append(fruitsRatio)
+
+        branch_sizes = [branch_sizes[k]/max(1,branch_lengths[k]) for k in range(len(branch_sizes))]
+        branch_deltas = [(branch_sizes[k] - branch_sizes[k+1]) for k in range(len(branch_sizes)-1)]
+        if len(branch_deltas) > 0: branch_size_ratio = sum(branch_deltas)/len(branch_deltas)
+        else: branch_size_ratio = 0
+        statisticsContainer.append(max(-1,min(1,branch_size_ratio)))
+
+
+
+if __name__ == "__main__":
+    print("Test array turtle")
+    import os
+    import timeit
+    import grammar.parametric.parametriclsystem
+    imp.reload(grammar.parametric.parametriclsystem)
+    from grammar.parametric.parametriclsystem import ParametricLSystem
+
+    def sameResults(result, otherResult):
+        def quads(details): return [((q.pos.x,q.pos.y,q.pos.z),(q.eul.x,q.eul.y,q.eul.z)) for q in details]
+        return ([tuple(v) for v in result.verts] == [tuple(v) for v in otherResult.verts] and result.edges == otherResult.edges and result.radii == otherResult.radii
+                and all(quads(details) == quads(otherDetails) for details, otherDetails in [(result.leaves,otherResult.leaves),(result.bulbs,otherResult.bulbs),
+                                                                                            (result.flowers,otherResult.flowers),(result.fruits,otherResult.fruits)]))
+
+    print("\nTEST - Same results as the Turtle")
+    structures = ["F(2)[+(20)F(1.5)L]-F(1.0)BF", "!!+(39)F(2.2)!F(2)", "F[&F[^(45)FK]|F/(10)R]\\(20)F(0.5)LL[B]", "F(-1)[-(-30)FL]RF[]"]
+    genomesPath = os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","blender","imagegeneration","genomes_to_render.txt")
+    with open(genomesPath) as genomesFile:
+        for line in genomesFile:
+            if line.strip() == "": continue
+            pl = ParametricLSystem()
+            pl.fromGenomeRepresentation(line.strip().split("||||")[0])
+            structures.append(str(pl.iterate()))
+    same = True
+    for settings in [{}, {"lengthNoise": 0.3, "angleNoise": 0.2, "randomSeed": 5}, {"tropism_susceptibility": 0, "heuristic_details_orientations": False},
+                     {"elasticityDependsOnBranchRadius": True}]:
+        turtle, arrayTurtle = Turtle(), ArrayTurtle()
+        for name, value in settings.items():
+            setattr(turtle,name,value)
+            setattr(arrayTurtle,name,value)
+        for structure in structures:
+            statistics, arrayStatistics = [], []
+            same = same and sameResults(turtle.draw(structure,1,statistics),arrayTurtle.draw(structure,1,arrayStatistics)) and statistics == arrayStatistics
+    print(same)
+
+    print("\nTEST - Measures are the same as those of the drawing")
+    def measuresOf(measures):
+        return (measures.nVerts,measures.nEdges,measures.minX,measures.maxX,measures.minY,measures.maxY,measures.minZ,measures.maxZ,
+                measures.undergroundWeight,measures.detailCounts)
+    same = True
+    for structure in structures:
+        statistics, measureStatistics = [], []
+        turtle, arrayTurtle = Turtle(), ArrayTurtle()
+        drawnMeasures = TurtleMeasures.fromTurtleResult(turtle.draw(structure,0,statistics))
+        same = same and measuresOf(drawnMeasures) == measuresOf(arrayTurtle.measure(structure,0,measureStatistics)) and statistics == measureStatistics
+    print(same)
+
+    print("\nTEST - Arrays")
+    arrays = ArrayTurtle().drawArrays("F(2)[+(20)F(1.5)L]-F(1.0)BF")
+    print(str(arrays) + "\nLeaves: " + str(len(arrays.leaves)) + " Bulbs: " + str(len(arrays.bulbs)))
+    try:
+        print("NumPy vertices shape: " + str(arrays.toNumpy()["verts"].shape))
+    except ImportError:
+        print("NumPy is not available")
+
+    print("\nTEST - Benchmark")
+    turtle, arrayTurtle = Turtle(), ArrayTurtle()
+    print("Characters: " + str(sum([len(s) for s in structures])))
+    print("Turtle: " + "{0:.4f}".format(timeit.timeit(lambda: [turtle.draw(s,0,[]) for s in structures], number=3)) + "s")
+    print("ArrayTurtle: " + "{0:.4f}".format(timeit.timeit(lambda: [arrayTurtle.drawArrays(s,0,[]) for s in structures], number=3)) + "s")
+    print("ArrayTurtle measures: " + "{0:.4f}".format(timeit.timeit(lambda: [arrayTurtle.measure(s,0,[]) for s in structures], number=3)) + "s")
+    print("ArrayTurtle with TurtleResult: " + "{0:.4f}".format(timeit.timeit(lambda: [arrayTurtle.draw(s,0,[]) for s in structures], number=3)) + "s")
+
+    print("\nEND TESTS")
@@ -0,0 +1,313 @@
+"""
+    A Turtle that keeps its orientation as a frame of heading, left and up vectors.
+
+    @author: Michele Pirovano
+    @copyright: 2013-2015
+"""
+
+import turtles.arrayturtle
+
+import imp
+imp.reload(turtles.arrayturtle)
+
+from turtles.arrayturtle import *
+
+from math import cos,sin,atan2,sqrt,pi
+
+
+class FrameTurtle(ArrayTurtle):
+    """
+    The classic HLU turtle (see "The Algorithmic Beauty of Plants", 1.5): the orientation is a rotation matrix whose columns are
+    the heading H, the left L and the up U vectors of the turtle. It draws into flat arrays, as an ArrayTurtle.
+
+    Rotations turn the frame around its own vectors:
+        - '+' and '-' turn around U, '|' turns around U by 180 degrees
+        - '&' and '^' pitch around L
+        - '\\' and '/' roll around H
+    The rotation matrix of each (character, angle) is computed once and cached, so drawing the same angles needs no trigonometry.
+    Tropism bends the frame around H x T by e*|H x T|, where T is the tropism vector and e the susceptibility.
+    Each F only multiplies the frame: there are no euler angles to convert to and from, and no pole singularities.
+
+    @note: Rotations compose as rotations of the frame, while the Turtle sums euler angles,
+    so the same structure is drawn with the same branching angles but a different shape than with a Turtle.
+    Details are oriented with the euler angles (XYZ, as in Blender) of the rotation from the initial frame, computed only for details.
+    In Blender, it is selected with the 'frame turtle' option of the Generation panel.
+    """
+
+    # The initial frame: heading up, as in Turtle.draw. '+' turns towards -y and '&' towards -x, as with a Turtle.
+    INITIAL_FRAME = (0.0,0.0,1.0, 0.0,1.0,0.0, -1.0,0.0,0.0)
+
+    # Rotation axis of each character, as an index of the frame vectors (H=0, L=1, U=2), and direction
+    ROTATION_AXES = {'+':(2,1), '-':(2,-1), '&':(1,1), '^':(1,-1), '\\':(0,1), '/':(0,-1)}
+
+    MAX_CACHED_ROTATIONS = 4096
+
+    def __init__(self, verbose = False):
+        super().__init__(verbose)
+        self.rotations = {}     # Cached rotation matrices, by (character, angle)
+
+    def getRotation(self, c, value):
+        """
+        @param c: A rotation character
+        @param value: The angle, in radians
+
+        @return: The rotation matrix (by rows) that turns the frame around its own axis, see ROTATION_AXES
+        @rtype: tuple of 9 floats
+        """
+        key = (c,value)
+        rotation = self.rotations.get(key)
+        if rotation is None:
+            axis, direction = FrameTurtle.ROTATION_AXES[c]
+            ca, sa = cos(value), sin(value)*direction
+            if axis == 2: rotation = (ca,sa,0.0, -sa,ca,0.0, 0.0,0.0,1.0)
+            elif axis == 1: rotation = (ca,0.0,-sa, 0.0,1.0,0.0, sa,0.0,ca)
+            else: rotation = (1.0,0.0,0.0, 0.0,ca,-sa, 0.0,sa,ca)
+            if len(self.rotations) >= FrameTurtle.MAX_CACHED_ROTATIONS: self.rotations.clear()     # With angle noise, angles are seldom repeated
+            self.rotations[key] = rotation
+        return rotation
+
+    @staticmethod
+    def rotateFrame(frame, r):
+        """
+        @return: The frame turned by a rotation matrix (by rows) in its own coordinates, that is, frame times r
+        @rtype: tuple of 9 floats
+        """
+        hx,hy,hz, lx,ly,lz, ux,uy,uz = frame
+        r00,r01,r02, r10,r11,r12, r20,r21,r22 = r
+        return (hx*r00+lx*r10+ux*r20, hy*r00+ly*r10+uy*r20, hz*r00+lz*r10+uz*r20,
+                hx*r01+lx*r11+ux*r21, hy*r01+ly*r11+uy*r21, hz*r01+lz*r11+uz*r21,
+                hx*r02+lx*r12+ux*r22, hy*r02+ly*r12+uy*r22, hz*r02+lz*r12+uz*r22)
+
+    @staticmethod
+    def frameToEuler(frame):
+        """
+        @return: The euler angles (XYZ, as in Blender) of the rotation from the initial frame to the frame
+        @rtype: tuple of 3 floats
+        """
+        # The rotation M maps the initial frame to the frame: M = [H L U] * [H0 L0 U0]^T, with H0 = z, L0 = y and U0 = -x
+        hx,hy,hz, lx,ly,lz, ux,uy,uz = frame
+        m00, m01, m02 = -ux, lx, hx
+        m10, m11, m12 = -uy, ly, hy
+        m20, m21, m22 = -uz, lz, hz
+        cy = sqrt(m00*m00 + m10*m10)
+        if cy > 1e-6:
+            return atan2(m21,m22), atan2(-m20,cy), atan2(m10,m00)
+        return atan2(-m12,m11), atan2(-m20,cy), 0.0
+
+    def trace(self, structure, statisticsContainer, output):
+        """
+        Same as ArrayTurtle.trace, keeping the orientation as a frame.
+        """
+        tokens = self.getTokens(structure)
+        instance_index = output.instance_index
+        addVertex = output.addVertex
+        addEdge = output.addEdge
+        addDetail = output.addDetail
+        detailCounts = {"L": 0, "B": 0, "K": 0, "R": 0}
+        endDetailsCounts = {"L": 0, "B": 0, "K": 0, "R": 0}
+        detailsCount = 0
+
+        # Each instance has a different seed (for randomization). Random values are re-used by index, see Turtle.getRandom
+        self.rnd = random.Random()
+        if self.randomSeed: self.rnd.seed(self.randomSeed+instance_index)
+        self.randoms = []
+        randoms = self.randoms
+        uniform = self.rnd.uniform
+
+        saveStatistics = statisticsContainer is not None
+        maxBranchWeightStatistic = 0
+        rotationAxes = FrameTurtle.ROTATION_AXES
+        getRotation = self.getRotation
+        rotateFrame = FrameTurtle.rotateFrame
+        halfTurn = getRotation('+',pi)
+        tropismSusceptibility = self.tropism_susceptibility
+        tx, ty, tz = self.tropism
+        elasticity = 1
+
+        # The state of the turtle
+        last_i = 0
+        tot_i = 0
+        x = y = z = 0.0
+        frame = FrameTurtle.INITIAL_FRAME
+        branchFrame = frame     # Frame of the last branch
+        current_radius = self.defaultRadius
+        stack = []
+
+        branch_depth = 0
+        branch_sizes = [self.defaultRadius]
+        branch_lengths = [0]
+
+        # Details are end points if no F or branch follows them before their branch closes, see Turtle.draw
+        pendingDetails = []
+        def placePendingDetails(isEndPoint):
+            nonlocal detailsCount
+            heuristic = self.heuristic_details_orientations
+            for c, dx, dy, dz, detailFrame in pendingDetails:
+                dex = dey = dez = 0.0
+                if not output.keepsDetails: pass
+                elif heuristic:
+                    if c != "R": dex, dey, dez = FrameTurtle.frameToEuler(branchFrame)    # Oriented with the last branch, fruits towards the ground
+                else: dex, dey, dez = FrameTurtle.frameToEuler(detailFrame)
+                addDetail(c,dx,dy,dz,dex,dey,dez)
+                detailCounts[c] += 1
+                if isEndPoint: endDetailsCounts[c] += 1
+                detailsCount += 1
+            del pendingDetails[:]
+
+        firstPointAdded = False
+        for c, param, i in tokens:
+            if c == 'F' or c == '[' or c == ']':
+                if pendingDetails: placePendingDetails(c == ']')
+
+            if c == 'F':
+                # Go forward, drawing an edge
+                value = float(param) if param is not None else self.step
+                if last_i >= len(randoms):
+                    rndValue = uniform(-1,+1)
+                    randoms.append(rndValue)
+                else: rndValue = randoms[last_i]
+                value = value + value*rndValue*self.lengthNoise
+
+                if tropismSusceptibility > 0:
+                    # Bend the frame around H x T by e*|H x T|
+                    if self.elasticityDependsOnBranchRadius: elasticity = 1/current_radius
+                    hx,hy,hz, lx,ly,lz, ux,uy,uz = frame
+                    kx, ky, kz = hy*tz - hz*ty, hz*tx - hx*tz, hx*ty - hy*tx
+                    norm = sqrt(kx*kx + ky*ky + kz*kz)
+                    if norm > 0:
+                        angle = tropismSusceptibility*elasticity*norm
+                        ca, sa = cos(angle), sin(angle)
+                        kx, ky, kz = kx/norm, ky/norm, kz/norm
+                        # Rodrigues' rotation of each vector of the frame
+                        dh = (kx*hx + ky*hy + kz*hz)*(1-ca)
+                        dl = (kx*lx + ky*ly + kz*lz)*(1-ca)
+                        du = (kx*ux + ky*uy + kz*uz)*(1-ca)
+                        frame = (hx*ca + (ky*hz - kz*hy)*sa + kx*dh, hy*ca + (kz*hx - kx*hz)*sa + ky*dh, hz*ca + (kx*hy - ky*hx)*sa + kz*dh,
+                                 lx*ca + (ky*lz - kz*ly)*sa + kx*dl, ly*ca + (kz*lx - kx*lz)*sa + ky*dl, lz*ca + (kx*ly - ky*lx)*sa + kz*dl,
+                                 ux*ca + (ky*uz - kz*uy)*sa + kx*du, uy*ca + (kz*ux - kx*uz)*sa + ky*du, uz*ca + (kx*uy - ky*ux)*sa + kz*du)
+
+                # Add the first point now, if needed
+                if not firstPointAdded:
+                    addVertex(x,y,z,current_radius)
+                    firstPointAdded = True
+
+                # Add the new point, along the heading
+                x, y, z = x+frame[0]*value, y+frame[1]*value, z+frame[2]*value
+                addVertex(x,y,z,current_radius)
+
+                tot_i += 1
+                addEdge(last_i,tot_i)
+                last_i = tot_i
+                branchFrame = frame
+
+                if saveStatistics:
+                    branch_lengths[branch_depth] += 1
+                    branch_sizes[branch_depth] += current_radius
+
+            elif c in rotationAxes:
+                # See Turtle.changeOrientation
+                value = float(param) if param is not None else self.angle
+                if i >= len(randoms):
+                    rndValue = uniform(-1,+1)
+                    randoms.append(rndValue)
+                else: rndValue = randoms[i]
+                value = value + (self.angleNoise*rndValue)*value
+                frame = rotateFrame(frame,getRotation(c,value/180*pi))
+            elif c == '|':
+                frame = rotateFrame(frame,halfTurn)
+
+            elif c == '[':
+                # Open a new branch
+                stack.append((x,y,z,frame,last_i,current_radius))
+                branch_depth += 1
+                if len(branch_lengths) <= branch_depth:
+                    branch_lengths.append(0)
+                    branch_sizes.append(current_radius)
+                else:
+                    branch_lengths[branch_depth] = 0
+                    branch_sizes[branch_depth] = current_radius
+
+            elif c == ']':
+                # Close the latest open branch
+                if saveStatistics and branch_lengths[branch_depth] > maxBranchWeightStatistic:
+                    maxBranchWeightStatistic = branch_lengths[branch_depth]
+                branch_depth -= 1
+                x, y, z, frame, last_i, current_radius = stack.pop()
+
+            elif c == "L" or c == "B" or c == "K" or c == "R":
+                pendingDetails.append((c,x,y,z,frame))
+
+        placePendingDetails(True)
+
+        if saveStatistics: self.appendStatistics(statisticsContainer,output,branch_lengths,branch_sizes,maxBranchWeightStatistic,detailCounts,endDetailsCounts,detailsCount)
+        return output
+
+
+if __name__ == "__main__":
+    print("Test frame turtle")
+    import os
+    import timeit
+    import grammar.parametric.parametriclsystem
+    imp.reload(grammar.parametric.parametriclsystem)
+    from grammar.parametric.parametriclsystem import ParametricLSystem
+
+    def vertices(result):
+        return [tuple(result.verts[k:k+3]) for k in range(0,len(result.verts),3)]
+
+    def close(vectors, otherVectors, tolerance = 1e-9):
+        return len(vectors) == len(otherVectors) and all(abs(a-b) <= tolerance for v, w in zip(vectors,otherVectors) for a, b in zip(v,w))
+
+    turtle, frameTurtle = ArrayTurtle(), FrameTurtle()
+    turtle.tropism_susceptibility = frameTurtle.tropism_susceptibility = 0
+
+    print("\nTEST - Single rotations are drawn as with a Turtle")
+    structures = ["F+(20)F", "F-(35)F", "F&(20)F", "F^(50)F", "F[+F][-F]F", "F|F"]
+    print(all(close(vertices(turtle.drawArrays(s)),vertices(frameTurtle.drawArrays(s))) for s in structures))
+
+    print("\nTEST - Rotations compose as rotations of the frame")
+    result = frameTurtle.drawArrays("F+(90)&(90)F")     # After turning left, pitching moves along the turtle's new up vector
+    print(close(vertices(result),[(0,0,0),(0,0,1),(-1,0,1)]))
+    result = frameTurtle.drawArrays("F\\(90)+(90)F")    # Rolling around the heading turns the left vector
+    print(close(vertices(result),[(0,0,0),(0,0,1),(1,0,1)]))
+    frame = FrameTurtle.INITIAL_FRAME
+    for c in "+&\\-^/+++":
+        frame = FrameTurtle.rotateFrame(frame,frameTurtle.getRotation(c,0.7))
+    h, l, u = frame[0:3], frame[3:6], frame[6:9]
+    print("Orthonormal frame: " + str(close([(sum(a*b for a, b in zip(v,w)),) for v in (h,l,u) for w in (h,l,u)],[(1,),(0,),(0,),(0,),(1,),(0,),(0,),(0,),(1,)])))
+    print("Cached rotations: " + str(len(frameTurtle.rotations)))
+
+    print("\nTEST - Tropism")
+    frameTurtle.tropism_susceptibility = 0.4
+    result = frameTurtle.drawArrays("F+(90)FFFF")
+    zs = [v[2] for v in vertices(result)]
+    print("Bends down: " + str(all(zs[k+1] <= zs[k] for k in range(2,len(zs)-1))))
+
+    print("\nTEST - Details and statistics")
+    structure = "F(2)[+(20)F(1.5)L]-F(1.0)BF[&FK]R"
+    statistics, frameStatistics = [], []
+    turtle.draw(structure,0,statistics)
+    frameResult = frameTurtle.draw(structure,0,frameStatistics)
+    print(len(frameResult.leaves) == 1 and len(frameResult.flowers) == 1 and len(frameResult.fruits) == 1)
+    print("Same statistics (except underground weight): " + str(statistics[0:2] + statistics[3:] == frameStatistics[0:2] + frameStatistics[3:]))
+    print("Leaf orientation: " + str(frameResult.leaves[0].eul))
+    frameMeasures, measureStatistics = frameTurtle.measure(structure,0,[]), []
+    frameTurtle.measure(structure,0,measureStatistics)
+    print("Same measures: " + str(frameMeasures.maxZ == max([v.z for v in frameResult.verts]) and frameMeasures.nVerts == len(frameResult.verts)
+                                   and frameMeasures.detailCounts["K"] == 1 and measureStatistics == frameStatistics))
+
+    print("\nTEST - Benchmark")
+    structures = []
+    genomesPath = os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","blender","imagegeneration","genomes_to_render.txt")
+    with open(genomesPath) as genomesFile:
+        for line in genomesFile:
+            if line.strip() == "": continue
+            pl = ParametricLSystem()
+            pl.fromGenomeRepresentation(line.strip().split("||||")[0])
+            structures.append(str(pl.iterate()))
+    turtle, frameTurtle = Turtle(), FrameTurtle()
+    arrayTurtle = ArrayTurtle()
+    print("Turtle: " + "{0:.4f}".format(timeit.timeit(lambda: [turtle.draw(s,0,[]) for s in structures], number=3)) + "s")
+    print("ArrayTurtle: " + "{0:.4f}".format(timeit.timeit(lambda: [arrayTurtle.drawArrays(s,0,[]) for s in structures], number=3)) + "s")
+    print("FrameTurtle: " + "{0:.4f}".format(timeit.timeit(lambda: [frameTurtle.drawArrays(s,0,[]) for s in structures], number=3)) + "s")
+
+    print("\nEND TESTS")
@@ -13,6 +13,7 @@ imp.reload(turtles.my_mathutils)
 
 from turtles.my_mathutils import *
 
+from array import array
 from math import cos,sin,pi
 import random
 
@@ -55,11 +56,67 @@ class TurtleResult:
         s += "\nEdges: " + str(len(self.edges))
         return s
 
+class TurtleMeasures:
+    """
+    Aggregates of the results of drawing with a turtle: the counts of vertices, edges and details, the bounding box of the vertices,
+    and the underground weight (the sum of the depths of the vertices below the ground). See Turtle.measure.
+    """
+    keepsDetails = False    # Positions and orientations of details are not kept
+
+    def __init__(self, instance_index):
+        self.instance_index = instance_index
+        self.nVerts = 0
+        self.nEdges = 0
+        self.minX = self.minY = self.minZ = float('inf')
+        self.maxX = self.maxY = self.maxZ = float('-inf')
+        self.undergroundWeight = 0
+        self.detailCounts = {"L": 0, "B": 0, "K": 0, "R": 0}
+
+    def addVertex(self,x,y,z,radius):
+        self.nVerts += 1
+        if x < self.minX: self.minX = x
+        if x > self.maxX: self.maxX = x
+        if y < self.minY: self.minY = y
+        if y > self.maxY: self.maxY = y
+        if z < self.minZ: self.minZ = z
+        if z > self.maxZ: self.maxZ = z
+        if z < 0: self.undergroundWeight += (-z)
+
+    def addEdge(self,a,b):
+        self.nEdges += 1
+
+    def addDetail(self,c,x,y,z,ex,ey,ez):
+        self.detailCounts[c] += 1
+
+    def getUndergroundWeight(self):
+        return self.undergroundWeight
+
+    @staticmethod
+    def fromTurtleResult(result):
+        """
+        @return: The measures of the results of drawing
+        @rtype: TurtleMeasures
+        """
+        measures = TurtleMeasures(result.instance_index)
+        for v in result.verts: measures.addVertex(v.x,v.y,v.z,None)
+        measures.nEdges = len(result.edges)
+        for c, details in (("L",result.leaves),("B",result.bulbs),("K",result.flowers),("R",result.fruits)): measures.detailCounts[c] = len(details)
+        return measures
+
+    def __str__(self):
+        s = "\nTurtle Measures:"
+        s += "\nVerts: " + str(self.nVerts)
+        s += "\nEdges: " + str(self.nEdges)
+        return s
+
 class Turtle:
     """
     A class that is used to convert a pL-String into a graphical structure.
     """
 
+    # Characters whose parameter is read by the turtle
+    PARAMETRIC_CHARACTERS = ('!','/','F','+','-','&','^','\\')
+
     def __init__(self, verbose = False):
         """
         Noise should be in the [0,1] range, with 0 meaning no noise and 1 meaning noise equal to the initial value.
@@ -91,13 +148,14 @@ class Turtle:
         """
         Draws from a pL-string
 
-        @note: the parameter structure must be a string, not a pString!
+        @note: the parameter structure can be a string, or any iterable of modules (a pString, or a stream from ParametricLSystem.iterateModules).
+        Compact pStrings are read directly from their arrays of letters and values, see getTokens.
 
         @param structure: The structure to convert into a graphical representation.
         @param instance_index: Index of this instance in a set of randomized instances.
         @param statisticsContainer: A container for statistics of this turtle, populated and then used externally.
         """
-        assert isinstance(structure,str), "The structure parameter must be a string"
+        tokens = self.getTokens(structure)
 
         # Statistics
         saveStatistics = statisticsContainer is not None
@@ -105,13 +163,14 @@ class Turtle:
             trunkWeightStatistic = 0            # Will be higher, the longer the trunk is
             maxBranchWeightStatistic = 0        # Will be higher, the longer branches are (gets the maximum branch length)
             undergroundWeightStatistic = 0      # Will be higher, the more the branch has vertices with y < 0
-            endLeavesCount = 0                  # Will be higher, the more the leaves are towards the end-depth branches (ratio on the total number of leaves)
-            endBulbsCount = 0                   # Will be higher, the more the bulbs are towards the end-depth branches (ratio on the total number of bulbs)
-            endFlowersCount = 0                 # Will be higher, the more the leaves are flowers the end-depth branches (ratio on the total number of flowers)
-            fruitsCount = 0                     # Will be higher, the more fruits are there (ratio on the total number of details)
-            detailsCount = 0                    # Will be higher, the more generic details are there
+        # Details statistics are always counted, since details are placed later on
+        endLeavesCount = 0                  # Will be higher, the more the leaves are towards the end-depth branches (ratio on the total number of leaves)
+        endBulbsCount = 0                   # Will be higher, the more the bulbs are towards the end-depth branches (ratio on the total number of bulbs)
+        endFlowersCount = 0                 # Will be higher, the more the leaves are flowers the end-depth branches (ratio on the total number of flowers)
+        fruitsCount = 0                     # Will be higher, the more fruits are there (ratio on the total number of details)
+        detailsCount = 0                    # Will be higher, the more generic details are there
 
-        if self.verbose: print("\nGot structure: " + structure)
+        if self.verbose and isinstance(structure,str): print("\nGot structure: " + structure)
 
         # Each instance has a different seed (for randomization)
         self.rnd = random.Random()
@@ -146,21 +205,51 @@ class Turtle:
         verts = []
         edges = []
 
+        # Details are end points if no F or branch follows them before their branch closes
+        # We know this only later, so they are placed when the next F or bracket is found
+        pendingDetails = []
+        def placePendingDetails(isEndPoint):
+            nonlocal endLeavesCount, endBulbsCount, endFlowersCount, fruitsCount, detailsCount
+            for c, detail_pos, detail_eul in pendingDetails:
+                if c == "R": tmp_eul = self.orientWithGround(detail_eul,last_branch_euler,isEndPoint)
+                else: tmp_eul = self.orientWithBranch(detail_eul,last_branch_euler,isEndPoint)
+                q = Quad(detail_pos,tmp_eul)
+
+                if c == "L":
+                    # This is a LEAF node, save its position and orientation
+                    leaves.append(q)
+                    if isEndPoint:  endLeavesCount += 1
+                elif c == "B":
+                    # This is a BULB node, save its position and orientation
+                    bulbs.append(q)
+                    if isEndPoint:  endBulbsCount += 1
+                elif c == "K":
+                    # This is a FLOWER node, save its position and orientation
+                    flowers.append(q)
+                    if isEndPoint: endFlowersCount += 1
+                elif c == "R":
+                    # This is a FRUIT node, save its position and orientation
+                    fruits.append(q)
+                    if isEndPoint: fruitsCount += 1
+                detailsCount += 1
+            del pendingDetails[:]
+
         firstPointAdded  = False
-        i = 0    # We'll iterate over all the characters
-        while i <  len(structure):
-            c = structure[i]
+        for c, param, i in tokens:   # We'll iterate over all the characters
             if self.verbose: print("\nChecking character " + c + " at " + str(i))
 
+            if c == 'F' or c == '[' or c == ']':
+                placePendingDetails(c == ']')
+
             if c == '!':
                 # Change branch radius
-                value, i = self.extractParameter(structure,i,self.defaultRadius)
+                value = self.extractParameter(param,self.defaultRadius)
                 value = max(1,value)
                 if self.verbose: print("CURRENT RADIUS: " + str(current_radius))
 
             if c == 'F':
                 # Go forward, drawing an edge
-                value, i = self.extractParameter(structure,i,self.step)
+                value = self.extractParameter(param,self.step)
                 # Randomize
                 rndValue = self.getRandom(last_i)
                 value = value + value*rndValue*self.lengthNoise
@@ -221,24 +310,24 @@ class Turtle:
 
 
             elif c == '+':
-                eul_delta, i = self.changeOrientation(structure,i,(1,0,0))
+                eul_delta = self.changeOrientation(param,i,(1,0,0))
                 eul += eul_delta
             elif c == '-':
-                eul_delta, i = self.changeOrientation(structure,i,(-1,0,0))
+                eul_delta = self.changeOrientation(param,i,(-1,0,0))
                 eul += eul_delta
             elif c == '|':
                 eul.x += pi
             elif c == '&':
-                eul_delta, i = self.changeOrientation(structure,i,(0,1,0))
+                eul_delta = self.changeOrientation(param,i,(0,1,0))
                 eul += eul_delta
             elif c == '^':
-                eul_delta, i = self.changeOrientation(structure,i,(0,-1,0))
+                eul_delta = self.changeOrientation(param,i,(0,-1,0))
                 eul += eul_delta
             elif c == '\\':
-                eul_delta, i = self.changeOrientation(structure,i,(0,0,1))
+                eul_delta = self.changeOrientation(param,i,(0,0,1))
                 eul += eul_delta
             elif c == '/':
-                eul_delta, i = self.changeOrientation(structure,i,(0,0,-1))
+                eul_delta = self.changeOrientation(param,i,(0,0,-1))
                 eul += eul_delta
 
             elif c == '[':
@@ -280,21 +369,11 @@ class Turtle:
                         #print("Updated max branch weight to " + str(maxBranchWeightStatistic))
                 branch_depth-=1
 
-                last_pos = pos_stack[-1]
-                pos = last_pos.copy()
-                pos_stack = pos_stack[0:len(pos_stack)-1]#.remove(-1)
-
-                last_index = index_stack[-1]
-                last_i = last_index
-                index_stack = index_stack[0:len(index_stack)-1] #.remove(-1)
-
-                last_eul = eul_stack[-1]
-                eul = last_eul
-                eul_stack = eul_stack[0:len(eul_stack)-1]
-
-                last_radius = radii_stack[-1]
-                current_radius = last_radius
-                radii_stack = radii_stack[0:len(radii_stack)-1]
+                # The stacks are popped in place, so that closing a branch does not copy them
+                pos = pos_stack.pop()
+                last_i = index_stack.pop()
+                eul = eul_stack.pop()
+                current_radius = radii_stack.pop()
 
                 #print("Resuming from " + str(pos) + " with index " + str(last_i))
                 #print("Orientation stack has: ")
@@ -302,54 +381,13 @@ class Turtle:
                 #    print(p)
 
 
-            elif c == "L":
-                # This is a LEAF node, save its position and orientation
-                isEndPoint = self.checkIsEndPoint(i,structure)
-                tmp_eul = self.orientWithBranch(eul,last_branch_euler,isEndPoint)
-                q = Quad(pos.copy(),tmp_eul)
-                leaves.append(q)
-
-                if saveStatistics:
-                    if isEndPoint:  endLeavesCount += 1
-                    detailsCount += 1
-
-
-            elif c == "B":
-                # This is a BULB node, save its position and orientation
-                isEndPoint = self.checkIsEndPoint(i,structure)
-                tmp_eul = self.orientWithBranch(eul,last_branch_euler,isEndPoint)
-                q = Quad(pos.copy(),tmp_eul)
-                bulbs.append(q)
-
-                if saveStatistics:
-                    if isEndPoint:  endBulbsCount += 1
-                    detailsCount += 1
-
-            elif c == "K":
-                # This is a FLOWER node, save its position and orientation
-                isEndPoint = self.checkIsEndPoint(i,structure)
-                tmp_eul = self.orientWithBranch(eul,last_branch_euler,isEndPoint)
-                q = Quad(pos.copy(),tmp_eul)
-                flowers.append(q)
-
-                if saveStatistics:
-                    if isEndPoint: endFlowersCount += 1
-                    detailsCount += 1
+            elif c == "L" or c == "B" or c == "K" or c == "R":
+                pendingDetails.append((c,pos.copy(),eul.copy()))
 
-            elif c == "R":
-                # This is a FRUIT node, save its position and orientation
-                isEndPoint = self.checkIsEndPoint(i,structure)
-                tmp_eul = self.orientWithGround(eul, last_branch_euler, isEndPoint)
-                q = Quad(pos.copy(),tmp_eul)
-                fruits.append(q)
-
-                if saveStatistics:
-                    if isEndPoint: fruitsCount += 1
-                    detailsCount += 1
-            i+=1
 
             #print(verts)
             #print(edges)
+        placePendingDetails(True)
 
         result = TurtleResult(instance_index,verts,edges,radii,leaves,bulbs,flowers,fruits)
 
@@ -400,15 +438,24 @@ class Turtle:
 
         return result
 
-    def changeOrientation(self,structure,i,axisVector):
+    def measure(self, structure, instance_index = 0, statisticsContainer = None):
+        """
+        Measures the results of drawing a pL-string, with the same statistics as draw.
+        This draws the whole structure first: an ArrayTurtle measures it without keeping any geometry, so fitness evaluation should use one.
+
+        @rtype: TurtleMeasures
+        """
+        return TurtleMeasures.fromTurtleResult(self.draw(structure,instance_index,statisticsContainer))
+
+    def changeOrientation(self,param,i,axisVector):
         """
         Changes the orientation of the branch according to the chosen rotation
 
-        @param structure: The structure of the system
+        @param param: The parameter of the rotation, or None
         @param i: The current character's index
         @param axisVector: The vector representing the axis of rotation
         """
-        value, i = self.extractParameter(structure,i,self.angle)
+        value = self.extractParameter(param,self.angle)
         rnd_value = self.getRandom(i)
         delta_value = self.angleNoise*rnd_value
         value = value + delta_value*value
@@ -418,7 +465,7 @@ class Turtle:
         #for p in orientation_stack:
         #    print(p)
         if self.verbose: print("Rotating on " + str(eulOffset) + ": " + str(value) + " | (" + str(value*180/pi) + " deg)" + " results in " + str(eulOffset*value))
-        return eulOffset*value, i
+        return eulOffset*value
 
     def orientWithBranch(self,eul,last_branch_euler,isEndPoint):
         """
@@ -442,28 +489,6 @@ class Turtle:
             tmp_eul = Euler((0,0,0))
         return tmp_eul
 
-    def checkIsEndPoint(self,i,structure):
-        """
-        Check whether this is an end point (leaf node)
-
-        We need to make sure there is no F after this, before the branch closes!
-        Also, no branch must be opened!
-        """
-        #print("Checking end point for node " + structure[i] + " at " + str(i))
-        tmp_i = i
-        #isEndPoint = True
-        while(tmp_i <  len(structure)):
-            tmp_c = structure[tmp_i]
-            if tmp_c == "F" or tmp_c == "[":
-                #print("NO! Found another branch!")
-                return False
-            if tmp_c == "]":
-                #print("YES! Found end of branch!")
-                return True
-            tmp_i += 1
-        #print("YES! Found end of tree!")
-        return True
-
     def getQuaternionBetween(self,u,v):
         """
         Given two vectors, returns the quaternion representing the rotation between them.
@@ -489,25 +514,99 @@ class Turtle:
             rndValue = self.randoms[index]    # Re-use previously created random value
         return float(rndValue)
 
-    def extractParameter(self,structure,i,default_value):
-        """ Extracts a parameter out of a piece of structure """
-        if i < len(structure)-1 and structure[i+1] == '(':
-            # Get the parameter value after this
-            param_value_string = ''
-            j=i+2
-            while True:
-                c2 = structure[j]
-                if c2 == ')':
-                    break
-                else:
-                    param_value_string += c2
-                    j+=1
-            i = j # We place the index after the parameter
-            param_value = float(param_value_string)
+    def extractParameter(self,param,default_value):
+        """ Extracts the value of a parameter, as found by tokenize (a string, or a value for instructions) """
+        if param is not None:
+            param_value = float(param)
             if self.verbose: print("Found parameter: " + str(param_value))
-            return param_value, i
+            return param_value
         else:
-            return default_value, i
+            return default_value
+
+    def tokenize(self,structure):
+        """
+        Splits a pL-string into the characters the turtle reads.
+
+        @return: A generator of (character, parameter string or None, index) tuples. The index is that of the last character read.
+        """
+        i = 0
+        while i < len(structure):
+            c = structure[i]
+            if c in Turtle.PARAMETRIC_CHARACTERS and i < len(structure)-1 and structure[i+1] == '(':
+                # Get the parameter value after this
+                j = structure.index(')',i+2)
+                yield c, structure[i+2:j], j    # We place the index after the parameter
+                i = j+1
+            else:
+                yield c, None, i
+                i += 1
+
+    def getTokens(self,structure):
+        """
+        @param structure: A pL-string, a compact pString, or an iterable of modules
+
+        @return: A generator of the characters the turtle reads, see tokenize
+        """
+        if isinstance(structure,str): return self.tokenize(structure)
+        # Compact pStrings (see CompactParametricString) are recognized by their arrays, since reloading their module creates a new class
+        if hasattr(structure,'letters') and hasattr(structure,'offsets'): return self.tokenizeInstructions(self.compactInstructions(structure))
+        return self.tokenizeModules(structure)
+
+    def tokenizeModules(self,modules):
+        """
+        Same as tokenize, for a stream of modules. Indices are those the modules would have in the pL-string.
+        """
+        return self.tokenizeInstructions((m.letter,m.params) for m in modules)
+
+    def compactInstructions(self,pString):
+        """
+        @return: A generator of (letter, parameter values) instructions, read from the arrays of a compact pString
+        """
+        values = pString.values
+        offsets = pString.offsets
+        nModules = len(pString)
+        for chunkStart in range(0,nModules,65536):
+            letters = pString.letters[chunkStart:chunkStart+65536].decode('latin-1')
+            for i in range(len(letters)):
+                start, end = offsets[chunkStart+i], offsets[chunkStart+i+1]
+                if start == end: yield letters[i], ()
+                else: yield letters[i], values[start:end]
+
+    def tokenizeInstructions(self,instructions):
+        """
+        Same as tokenize, for a stream of (letter, parameter values) instructions.
+        Parameters are passed to the turtle as values: they are not formatted as a pL-string and parsed back.
+
+        The characters read are the same as those of the pL-string, so values are formatted only when the pL-string would be read differently:
+        when the parameters of a module the turtle does not read contain characters that it reads (e.g. the '-' of a negative number),
+        and when the parameters are not numbers.
+        Indices are those the characters would have in the pL-string. They are needed only by noise (see getRandom),
+        so values are formatted to count their characters only with noise.
+        """
+        trackPositions = self.lengthNoise != 0 or self.angleNoise != 0
+        parametricCharacters = Turtle.PARAMETRIC_CHARACTERS
+        position = 0
+        for c, params in instructions:
+            if len(params) == 0:
+                yield c, None, position
+                position += 1
+                continue
+
+            numeric = isinstance(params,array) or all([isinstance(p,(float,int)) for p in params])
+            if c in parametricCharacters:
+                if numeric and len(params) == 1: param = params[0]
+                else: param = ','.join([str(p) for p in params])    # As found in the pL-string
+                if trackPositions: position += 2 + len(','.join([str(p) for p in params])) + 1
+                else: position += 1
+                yield c, param, position-1
+            else:
+                yield c, None, position
+                # Numbers are written with a sign, or with an exponent, only if they are negative, very small or very large
+                if not numeric or trackPositions or any([(p < 0.0001 or p >= 1e16) for p in params]):
+                    text = '(' + ','.join([str(p) for p in params]) + ')'
+                    for paramC, param, i in self.tokenize(text): yield paramC, param, position+1+i
+                    position += 1 + len(text)
+                else: position += 1
 
     def addPos(self,v,verts,radius,radii):
         """ Saves the current position of the turtle as a vertex """
@@ -534,6 +633,40 @@ if __name__ == "__main__":
     result = t.draw(s)
     print(result)
 
+    print("\nTEST - Drawing a stream of modules")
+    import grammar.parametric.parametricstring
+    imp.reload(grammar.parametric.parametricstring)
+    from grammar.parametric.parametricstring import ParametricString
+    t = Turtle()
+    s = "F(2)[+(20)F(1.5)L]-F(1.0)BF"
+    stringResult = t.draw(s)
+    streamResult = t.draw(iter(ParametricString.fromTextString(s)))
+    print([str(v) for v in stringResult.verts] == [str(v) for v in streamResult.verts] and len(stringResult.leaves) == len(streamResult.leaves))
+
+    print("\nTEST - Drawing the arrays of a compact pString")
+    import grammar.parametric.compactparametricstring
+    imp.reload(grammar.parametric.compactparametricstring)
+    from grammar.parametric.compactparametricstring import CompactParametricString
+    s = "F(2)[+(20)F(1.5)L]A(-1)F(1e-05)B(0.5)[&F]"     # The '-' of negative numbers and exponents is read as a rotation
+    for lengthNoise in [0,0.2]:
+        t = Turtle()
+        t.lengthNoise = t.angleNoise = lengthNoise
+        t.randomSeed = 1
+        stringResult = t.draw(s)
+        compactResult = t.draw(CompactParametricString.fromTextString(s))
+        print([tuple(v) for v in stringResult.verts] == [tuple(v) for v in compactResult.verts] and len(stringResult.bulbs) == len(compactResult.bulbs))
+
+    print("\nTEST - End points")
+    statistics = []
+    result = t.draw("F[+FL][-FLF]FLB",0,statistics)     # All details but the one followed by an F are end points
+    print("End details ratio: " + str(statistics[3]) + " (expected 0.75)")
+
+    print("\nTEST - Drawing time is linear in the length of the structure")
+    import timeit
+    for n in [1000,4000]:
+        s = "[F(1)L"*n + "]"*n + "F[L]B"*n
+        print(str(len(s)) + " characters: " + "{0:.4f}".format(timeit.timeit(lambda: t.draw(s,0,[]), number=1)) + "s")
+
     print("\nEND TESTS")
 
     #if renderResult: self.drawMesh(context,instance_index,verts,edges,radii,leaves,bulbs,flowers,fruits,suffix)